@@ -0,0 +1,190 @@
+import os
+import math
+import time
+import uuid
+import sqlite3
+
+
+class AdmissionRejected(Exception):
+    """请求未被接纳：status 为 HTTP 状态码（429 客户端超限 / 503 服务繁忙），retry_after 为建议等待秒数"""
+
+    def __init__(self, reason, retry_after, status=503, message=None):
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.status = status
+        super().__init__(message or f"Request rejected ({reason}), retry after {self.retry_after}s")
+
+
+class AdmissionController:
+    """
+    生成报告的全局准入控制（SQLite，所有 gunicorn worker 共享）：
+    slots 表是正在进行的生成（最多 max_inflight 个），waiters 表是按到达顺序排队的请求（最多 max_queue 个）
+    队列已满或排队超过 queue_timeout 时立即拒绝，并按平均占用时长估算 Retry-After
+    进程崩溃留下的 slot 在租约（lease_seconds）到期后回收，排队中的请求每次轮询都会续期
+    """
+
+    def __init__(self, db_path, max_inflight=8, max_queue=16, queue_timeout=30.0,
+                 lease_seconds=600, poll_interval=0.2):
+        self.db_path = db_path
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS admission_slots (
+                    token TEXT PRIMARY KEY,
+                    acquired REAL NOT NULL,
+                    expires REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS admission_waiters (
+                    token TEXT PRIMARY KEY,
+                    enqueued REAL NOT NULL,
+                    expires REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS admission_stats (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    avg_hold REAL NOT NULL
+                )
+            """)
+            # 还没有样本时按 30 秒一次生成估算
+            conn.execute("INSERT OR IGNORE INTO admission_stats (id, avg_hold) VALUES (0, 30.0)")
+        finally:
+            conn.close()
+
+    @property
+    def enabled(self):
+        return self.max_inflight > 0
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _expire(self, conn, now):
+        conn.execute("DELETE FROM admission_slots WHERE expires < ?", (now,))
+        conn.execute("DELETE FROM admission_waiters WHERE expires < ?", (now,))
+
+    def _retry_after(self, conn, waiting):
+        avg_hold = conn.execute("SELECT avg_hold FROM admission_stats WHERE id = 0").fetchone()[0]
+        return avg_hold * (waiting / self.max_inflight + 1)
+
+    def _waiter_ttl(self):
+        return max(5.0, self.poll_interval * 20)
+
+    def acquire(self, bounded=True):
+        """
+        占用一个生成名额，返回凭证（交给 release）
+        bounded=False 时不受队列长度和等待时长限制（后台任务：任务队列本身就是排队）
+        """
+        if not self.enabled:
+            return None
+        token = uuid.uuid4().hex
+        start = time.time()
+        conn = self._connect()
+        try:
+            while True:
+                now = time.time()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._expire(conn, now)
+                    inflight = conn.execute("SELECT COUNT(*) FROM admission_slots").fetchone()[0]
+                    waiter = conn.execute(
+                        "SELECT enqueued FROM admission_waiters WHERE token = ?", (token,)
+                    ).fetchone()
+                    if waiter:
+                        # 先到先得：排在前面的请求数小于空闲名额时才轮到自己
+                        ahead = conn.execute(
+                            "SELECT COUNT(*) FROM admission_waiters WHERE enqueued < ? OR (enqueued = ? AND token < ?)",
+                            (waiter[0], waiter[0], token)
+                        ).fetchone()[0]
+                    else:
+                        ahead = conn.execute("SELECT COUNT(*) FROM admission_waiters").fetchone()[0]
+
+                    if inflight + ahead < self.max_inflight:
+                        conn.execute("DELETE FROM admission_waiters WHERE token = ?", (token,))
+                        conn.execute(
+                            "INSERT INTO admission_slots (token, acquired, expires) VALUES (?, ?, ?)",
+                            (token, now, now + self.lease_seconds)
+                        )
+                        conn.execute("COMMIT")
+                        return token
+
+                    if bounded and (now - start >= self.queue_timeout or (not waiter and ahead >= self.max_queue)):
+                        reason = 'queue_timeout' if waiter else 'queue_full'
+                        retry_after = self._retry_after(conn, ahead)
+                        conn.execute("DELETE FROM admission_waiters WHERE token = ?", (token,))
+                        conn.execute("COMMIT")
+                        raise AdmissionRejected(reason, retry_after, 503, 'Server is busy, please retry later')
+
+                    # 入队或续期
+                    conn.execute(
+                        "INSERT OR REPLACE INTO admission_waiters (token, enqueued, expires) VALUES (?, ?, ?)",
+                        (token, waiter[0] if waiter else now, now + self._waiter_ttl())
+                    )
+                    conn.execute("COMMIT")
+                except AdmissionRejected:
+                    raise
+                except Exception:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    raise
+                time.sleep(self.poll_interval)
+        finally:
+            conn.close()
+
+    def release(self, token):
+        """释放名额，并把占用时长计入平均值（用于估算 Retry-After）"""
+        if token is None:
+            return
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT acquired FROM admission_slots WHERE token = ?", (token,)).fetchone()
+            conn.execute("DELETE FROM admission_slots WHERE token = ?", (token,))
+            if row:
+                conn.execute(
+                    "UPDATE admission_stats SET avg_hold = avg_hold * 0.8 + ? * 0.2 WHERE id = 0",
+                    (time.time() - row[0],)
+                )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def check_backlog(self, backlog):
+        """入队前的快速检查：排队的后台生成任务已超过 并发 + 队列 上限时拒绝"""
+        if not self.enabled or backlog < self.max_inflight + self.max_queue:
+            return
+        conn = self._connect()
+        try:
+            retry_after = self._retry_after(conn, backlog - self.max_inflight)
+        finally:
+            conn.close()
+        raise AdmissionRejected('backlog_full', retry_after, 503, 'Server is busy, please retry later')
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            now = time.time()
+            inflight = conn.execute("SELECT COUNT(*) FROM admission_slots WHERE expires >= ?", (now,)).fetchone()[0]
+            waiting = conn.execute("SELECT COUNT(*) FROM admission_waiters WHERE expires >= ?", (now,)).fetchone()[0]
+            avg_hold = conn.execute("SELECT avg_hold FROM admission_stats WHERE id = 0").fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            'inflight': inflight,
+            'waiting': waiting,
+            'max_inflight': self.max_inflight,
+            'max_queue': self.max_queue,
+            'queue_timeout': self.queue_timeout,
+            'avg_hold_seconds': round(avg_hold, 2)
+        }
@@ -1,14 +1,37 @@
-from flask import Flask, request, jsonify
+import time
+# 冷启动计时起点（包括 Flask 等依赖的导入）
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, request, jsonify, send_file, redirect, Response, stream_with_context, g, has_request_context
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
 import json
 import uuid
+import hmac
+import hashlib
+import threading
 from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
-from astro_calculator import AstroCalculator
-from report_generator import ReportGenerator
-from email_sender import EmailSender
+from job_queue import JobQueue, RetryJob
+from geocoder import GeoResolver
+from chart_cache import ChartCache
+from openai_client import OpenAIClient, CircuitOpenError
+from report_cache import ReportCache
+from storage import create_store
+from archive import ReadingArchive, archive_readings
+from export import export_chunks, parse_fields
+from rate_limit import SharedTokenBuckets, parse_rate
+from admission import AdmissionController, AdmissionRejected
+from email_templates import render_report_email
+from image_store import ImageStore, VARIANTS as IMAGE_VARIANTS
+from http_cache import Representation, RepresentationStore, choose_encoding, compress, etag_matches, MIN_COMPRESS_SIZE
+from metrics import Metrics, register_default_metrics
+from idempotency import IdempotencyStore, IdempotencyConflict, request_fingerprint
+from services import LazyService
+from sign_table import SignIngressTable, birth_julian_day
 
 # 加载环境变量
 load_dotenv()
@@ -23,72 +46,453 @@ CORS(app, resources={
     }
 })
 
+# 本地持久化数据（任务队列、地理编码缓存等）
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# 指标（各 worker 进程的增量汇总到同一个 SQLite，/api/metrics 导出 Prometheus 格式）
+metrics = Metrics(os.path.join(DATA_DIR, 'metrics.db'))
+register_default_metrics(metrics)
+# 客户端带上 X-Timing: 1 或 ?timing=1 时返回 Server-Timing 头
+TIMING_HEADER_ENABLED = os.getenv('TIMING_HEADER_ENABLED', 'true').lower() == 'true'
+
 # 初始化服务
-calculator = AstroCalculator()
-generator = ReportGenerator(api_key=os.getenv('OPENAI_API_KEY'))
-email_sender = EmailSender(
-    api_key=os.getenv('SENDGRID_API_KEY'),
-    from_email=os.getenv('FROM_EMAIL', 'noreply@soulmate.app')
+resolver = GeoResolver(
+    gazetteer_path=os.getenv('GAZETTEER_PATH', os.path.join(DATA_DIR, 'gazetteer.db')),
+    cache_path=os.path.join(DATA_DIR, 'geocache.db'),
+    online_fallback=os.getenv('GEOCODER_ONLINE_FALLBACK', 'true').lower() == 'true',
+    geonames_username=os.getenv('GEONAMES_USERNAME')
+)
+chart_cache = ChartCache(
+    max_entries=int(os.getenv('CHART_CACHE_SIZE', 4096)),
+    disk_path=os.path.join(DATA_DIR, 'charts.db') if os.getenv('CHART_CACHE_DISK', 'true').lower() == 'true' else None,
+    max_disk_entries=int(os.getenv('CHART_CACHE_DISK_SIZE', 200000)),
+    metrics=metrics
 )
 
-# 简单的文件存储
+
+def record_init_time(service):
+    metrics.observe('cold_start_seconds', service.init_seconds, phase=f'init_{service.name}')
+
+
+# 重量级依赖（kerykeion/swisseph、sendgrid）在首次使用时才导入和构建，见 warm_up()
+def _build_calculator():
+    from astro_calculator import AstroCalculator
+    return AstroCalculator(resolver=resolver, cache=chart_cache)
+
+
+calculator = LazyService('calculator', _build_calculator, on_ready=record_init_time)
+
+# 行星换座表（python sign_table.py build 生成）：只要行星星座时二分查找，不构建 AstrologicalSubject
+# 只读 mmap，打开几乎没有开销；文件不存在时回落到完整计算
+SIGN_TABLE_PATH = os.getenv('SIGN_TABLE_PATH', os.path.join(DATA_DIR, 'sign_ingress.bin'))
+sign_table = SignIngressTable(SIGN_TABLE_PATH) if os.path.exists(SIGN_TABLE_PATH) else None
+SIGN_PLANETS = ['sun', 'moon', 'mercury', 'venus', 'mars', 'jupiter']
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+
+
+def parse_hedge_percentiles(value):
+    """'chat=95,image=95' -> {'chat': 95.0, 'image': 95.0}；空字符串关闭对冲"""
+    percentiles = {}
+    for item in value.split(','):
+        endpoint, _, percentile = item.strip().partition('=')
+        if endpoint and percentile:
+            percentiles[endpoint] = float(percentile)
+    return percentiles
+
+
+openai_client = OpenAIClient(
+    # 每个 job worker 同时最多占用 2 个连接（流式文本 + 图片），另留给同步请求
+    pool_size=int(os.getenv('OPENAI_POOL_SIZE', JOB_WORKERS * 2 + 4)),
+    max_retries=int(os.getenv('OPENAI_MAX_RETRIES', 3)),
+    timeouts={
+        'chat': (5, float(os.getenv('OPENAI_CHAT_TIMEOUT', 60))),
+        'image': (5, float(os.getenv('OPENAI_IMAGE_TIMEOUT', 90)))
+    },
+    metrics=metrics,
+    # 超过最近该分位耗时仍未返回时再发一路请求，主请求失败时用对冲结果
+    # 生图按次计费且不是幂等的，默认不对冲（需要时显式配置 OPENAI_HEDGE=chat=95,image=95）
+    hedge_percentiles=parse_hedge_percentiles(os.getenv('OPENAI_HEDGE', 'chat=95')),
+    hedge_min_delay=float(os.getenv('OPENAI_HEDGE_MIN_DELAY', 1.0)),
+    hedge_budget=float(os.getenv('OPENAI_HEDGE_BUDGET', 0.1)),
+    hedge_pool_size=int(os.getenv('OPENAI_HEDGE_POOL_SIZE', 4)),
+    # 连续失败后熔断，期间直接失败而不是等满超时；reset 秒后放行探测请求
+    breaker_threshold=int(os.getenv('OPENAI_BREAKER_THRESHOLD', 5)),
+    breaker_reset=float(os.getenv('OPENAI_BREAKER_RESET', 30))
+)
+report_cache = None
+if os.getenv('REPORT_CACHE', 'false').lower() == 'true':
+    report_cache = ReportCache(
+        db_path=os.path.join(DATA_DIR, 'report_cache.db'),
+        variants=int(os.getenv('REPORT_CACHE_VARIANTS', 3)),
+        ttl_seconds=int(os.getenv('REPORT_CACHE_TTL', 30 * 86400)),
+        max_signatures=int(os.getenv('REPORT_CACHE_MAX_SIGNATURES', 50000)),
+        metrics=metrics
+    )
+
+
+def _build_generator():
+    from report_generator import ReportGenerator
+    return ReportGenerator(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        stream=os.getenv('REPORT_STREAMING', 'true').lower() == 'true',
+        client=openai_client,
+        report_cache=report_cache
+    )
+
+
+def _build_email_sender():
+    from email_sender import EmailSender
+    return EmailSender(
+        api_key=os.getenv('SENDGRID_API_KEY'),
+        from_email=os.getenv('FROM_EMAIL', 'noreply@soulmate.app')
+    )
+
+
+def _build_synastry():
+    from synastry import SynastryIndex
+    index = SynastryIndex(os.path.join(DATA_DIR, 'synastry.idx'))
+    index.refresh()
+    return index
+
+
+generator = LazyService('generator', _build_generator, on_ready=record_init_time)
+email_sender = LazyService('email_sender', _build_email_sender, on_ready=record_init_time)
+# 合盘匹配索引（所有订单星盘的列存数组），保存订单时增量追加
+synastry = LazyService('synastry', _build_synastry, on_ready=record_init_time)
+SERVICES = [calculator, generator, email_sender, synastry]
+
+# 订单存储（STORAGE_BACKEND=json 每单一个文件 / sqlite 带索引的单库）
 READINGS_DIR = 'readings'
-os.makedirs(READINGS_DIR, exist_ok=True)
+store = create_store(readings_dir=READINGS_DIR)
+
+# 已发送的旧订单归档为压缩段（get_reading 未命中热存储时回落到这里）
+archive = ReadingArchive(os.path.join(DATA_DIR, 'archive'))
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_SEGMENT_SIZE = int(os.getenv('ARCHIVE_SEGMENT_SIZE', 5000))
+
+# 生成的图片下载到本地（内容寻址），派生模糊预览/缩略图/邮件尺寸图
+image_store = ImageStore(os.path.join(DATA_DIR, 'images'))
+# 邮件里的图片需要绝对地址，例如 https://api.example.com
+PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', '').rstrip('/')
+IMAGE_CACHE_SECONDS = 365 * 86400
+# 预览可以看到的图片；其余（原图/邮件图）只通过签名地址或订单令牌访问
+PUBLIC_IMAGE_VARIANTS = ('blur', 'thumb')
+
+# 预览 / 完整报告的预序列化、预压缩响应体（内容寻址，订单里只记录 digest）
+representations = RepresentationStore(os.path.join(DATA_DIR, 'representations'))
+RENDERED_FIELDS = {'preview', 'full_report', 'chart', 'name'}
+# 预览地址不可猜测且内容只在图片本地化时变化：浏览器短缓存，CDN 长一些，过期后用 ETag 重新验证
+PREVIEW_CACHE_CONTROL = os.getenv(
+    'PREVIEW_CACHE_CONTROL', 'public, max-age=60, s-maxage=600, stale-while-revalidate=86400'
+)
+COMPRESSIBLE_TYPES = {'application/json', 'text/html'}
+
+
+def load_token_secret():
+    """完整报告访问令牌的签名密钥：优先 READING_TOKEN_SECRET，否则首次启动时生成并保存在 DATA_DIR（所有 worker 共用）"""
+    secret = os.getenv('READING_TOKEN_SECRET')
+    if secret:
+        return secret.encode('utf-8')
+    path = os.path.join(DATA_DIR, 'reading_token.key')
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, 'w') as f:
+            f.write(os.urandom(32).hex())
+    with open(path, 'r') as f:
+        return f.read().strip().encode('utf-8')
+
+
+READING_TOKEN_SECRET = load_token_secret()
+
+# 创建订单时预渲染邮件（HTML + 纯文本），发送时直接取用
+PRERENDER_EMAIL = os.getenv('PRERENDER_EMAIL', 'true').lower() == 'true'
+
+# 批量发送：并发数 + SendGrid 速率限制（每秒封数，按套餐配置）
+SEND_CONCURRENCY = int(os.getenv('SEND_CONCURRENCY', 4))
+# 发送占用的租约（秒）：发送进程崩溃后，超过这个时间的占用可以被重新领取
+SEND_CLAIM_TTL = float(os.getenv('SEND_CLAIM_TTL', 600))
+# 发送限速用跨进程令牌桶（所有 worker 共用一个 sendgrid 桶），多个 worker 同时批量发送时总速率不超过套餐上限
+SENDGRID_RATE_PER_SEC = float(os.getenv('SENDGRID_RATE_PER_SEC', 5))
+send_buckets = SharedTokenBuckets(os.path.join(DATA_DIR, 'admission.db'))
+SEND_RATE_LIMIT = [('sendgrid', max(1.0, SENDGRID_RATE_PER_SEC), SENDGRID_RATE_PER_SEC)]
+
+# 创建报告的幂等记录（所有 worker 共享）：相同请求在窗口内只计算一次
+idempotency = IdempotencyStore(
+    db_path=os.path.join(DATA_DIR, 'idempotency.db'),
+    ttl_seconds=int(os.getenv('IDEMPOTENCY_TTL', 3600))
+)
+# 没有 Idempotency-Key 头时按 邮箱 + 出生数据 派生
+IDEMPOTENCY_DERIVED_KEYS = os.getenv('IDEMPOTENCY_DERIVED_KEYS', 'true').lower() == 'true'
+# 同步请求等待其他请求完成同一计算的最长时间
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', 180))
+
+# 后台任务队列
+job_queue = JobQueue(
+    db_path=os.path.join(DATA_DIR, 'jobs.db'),
+    num_workers=JOB_WORKERS,
+    events_ttl=float(os.getenv('JOB_EVENTS_TTL', 3600))
+)
+
+# 生成报告的准入控制（所有 worker 共享）：同时进行的生成数上限 + 有界等待队列，满了立即 503 + Retry-After
+admission = AdmissionController(
+    db_path=os.path.join(DATA_DIR, 'admission.db'),
+    max_inflight=int(os.getenv('ADMISSION_MAX_INFLIGHT', 8)),
+    max_queue=int(os.getenv('ADMISSION_MAX_QUEUE', 16)),
+    queue_timeout=float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 30))
+)
+# 创建报告的客户端限流（令牌桶，格式 N/s|m|h|d，0 关闭）：超限返回 429 + Retry-After
+client_buckets = SharedTokenBuckets(os.path.join(DATA_DIR, 'admission.db'))
+CREATE_RATE_LIMIT_IP = parse_rate(os.getenv('CREATE_RATE_LIMIT_IP', '30/h'))
+CREATE_RATE_LIMIT_EMAIL = parse_rate(os.getenv('CREATE_RATE_LIMIT_EMAIL', '10/h'))
+# 部署在反向代理后面时用 X-Forwarded-For 的第一个地址识别客户端
+TRUST_PROXY = os.getenv('TRUST_PROXY', 'false').lower() == 'true'
+
+
+@contextmanager
+def timed(stage):
+    """
+    记录一个阶段的耗时（直方图）和异常（计数器）
+    在请求上下文中同时累计到 Server-Timing
+    """
+    start = time.time()
+    try:
+        yield
+    except Exception:
+        metrics.inc('errors_total', stage=stage)
+        raise
+    finally:
+        elapsed = time.time() - start
+        metrics.observe('stage_duration_seconds', elapsed, stage=stage)
+        if has_request_context() and 'timings' in g:
+            g.timings.append((stage, elapsed))
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.time()
+    if TIMING_HEADER_ENABLED and (request.headers.get('X-Timing') == '1' or request.args.get('timing') == '1'):
+        g.timings = []
+
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = time.time() - g.get('request_started', time.time())
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe('http_request_duration_seconds', elapsed, route=route, method=request.method)
+    if response.status_code >= 500:
+        metrics.inc('errors_total', stage='http')
+    if 'timings' in g:
+        parts = [f'{stage.replace("_", "-")};dur={seconds * 1000:.1f}' for stage, seconds in g.timings]
+        parts.append(f'total;dur={elapsed * 1000:.1f}')
+        response.headers['Server-Timing'] = ', '.join(parts)
+    return response
+
+
+def client_ip():
+    if TRUST_PROXY and request.headers.get('X-Forwarded-For'):
+        return request.headers['X-Forwarded-For'].split(',')[0].strip()
+    return request.remote_addr or 'unknown'
+
+
+def check_client_limits(data):
+    """按 IP 和邮箱各一个令牌桶（同时扣减），超限抛出 AdmissionRejected(429)"""
+    limits = []
+    if CREATE_RATE_LIMIT_IP:
+        limits.append((f'ip:{client_ip()}', *CREATE_RATE_LIMIT_IP))
+    if CREATE_RATE_LIMIT_EMAIL:
+        limits.append((f"email:{str(data['email']).strip().lower()}", *CREATE_RATE_LIMIT_EMAIL))
+    if not limits:
+        return
+    ok, wait, key = client_buckets.try_acquire(limits)
+    if not ok:
+        raise AdmissionRejected(f"rate_limited_{key.split(':')[0]}", wait, 429, 'Too many requests, please retry later')
+
+
+def existing_request(key, fingerprint):
+    """相同请求已在计算或已完成时返回其幂等记录（不占用、不修改），否则返回 None"""
+    if not key:
+        return None
+    record = idempotency.get(key)
+    if record and record['fingerprint'] != fingerprint:
+        raise IdempotencyConflict(f"Idempotency key reused with a different request: {key}")
+    return record
+
+
+@contextmanager
+def generation_slot(bounded=True):
+    """占用一个全局生成名额，排队耗时记入 admission_wait 阶段"""
+    start = time.time()
+    token = admission.acquire(bounded)
+    metrics.observe('stage_duration_seconds', time.time() - start, stage='admission_wait')
+    try:
+        yield
+    finally:
+        admission.release(token)
+
+
+def rejected_response(e):
+    metrics.inc('admission_rejections_total', reason=e.reason)
+    response = jsonify({'error': str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, e.status
+
+
+@app.after_request
+def compress_response(response):
+    """JSON / HTML 响应按 Accept-Encoding 动态压缩（已预压缩的、流式的和文件响应跳过）"""
+    if (response.mimetype not in COMPRESSIBLE_TYPES or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.status_code in (204, 304)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if not encoding:
+        return response
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_SIZE:
+        return response
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
 
 
 def save_reading(reading_data):
-    """保存订单到JSON文件"""
-    reading_id = str(uuid.uuid4())
-    filepath = os.path.join(READINGS_DIR, f'{reading_id}.json')
-    
-    reading_data['reading_id'] = reading_id
-    reading_data['created_at'] = datetime.now().isoformat()
-    reading_data['paid'] = False
-    reading_data['sent'] = False
-    
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(reading_data, f, ensure_ascii=False, indent=2)
-    
+    """保存订单（并把星盘追加进合盘索引）"""
+    with timed('storage_save'):
+        reading_id = store.save(reading_data)
+    try:
+        synastry.add(reading_id, reading_data.get('chart'))
+    except Exception as e:
+        # 索引可随时重建，不影响下单
+        print(f"[SYNASTRY] Indexing {reading_id} failed: {str(e)}")
     return reading_id
 
 
 def get_reading(reading_id):
-    """读取订单"""
-    filepath = os.path.join(READINGS_DIR, f'{reading_id}.json')
-    if not os.path.exists(filepath):
-        return None
-    
-    with open(filepath, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """读取订单（热存储没有时查归档）"""
+    with timed('storage_get'):
+        reading = store.get(reading_id)
+    if reading is None:
+        with timed('archive_get'):
+            reading = archive.get(reading_id)
+    return reading
 
 
 def update_reading(reading_id, updates):
-    """更新订单"""
+    """更新订单；已归档的订单先恢复到热存储再更新；预览或报告变化时重新生成预压缩的响应体"""
+    with timed('storage_update'):
+        updated = store.update(reading_id, updates)
+        if not updated:
+            archived = archive.get(reading_id)
+            if not archived:
+                return False
+            store.import_reading(archived)
+            updated = store.update(reading_id, updates)
+    if updated and RENDERED_FIELDS.intersection(updates):
+        try:
+            with timed('render'):
+                store.update(reading_id, {'representations': render_representations(store.get(reading_id))})
+        except Exception as e:
+            # 清掉过期的 digest，读取时会按需重新生成；不影响更新本身
+            print(f"[RENDER] Rendering {reading_id} failed: {str(e)}")
+            store.update(reading_id, {'representations': {}})
+    return updated
+
+
+def reading_token(reading_id):
+    """完整报告的访问令牌（HMAC），随创建结果返回给下单的客户端"""
+    return hmac.new(READING_TOKEN_SECRET, reading_id.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+def authorize_full_access(reading_id):
+    """
+    完整内容（报告、原图）的访问检查：access_token（Authorization: Bearer <token> 或 ?token=）+ 已付款或已发送
+    返回 (reading, None) 或 (None, 错误响应)
+    """
+    auth = request.headers.get('Authorization', '')
+    token = auth[len('Bearer '):].strip() if auth.startswith('Bearer ') else request.args.get('token', '')
+    if not token or not hmac.compare_digest(token, reading_token(reading_id)):
+        return None, (jsonify({'error': 'Invalid or missing access token'}), 401)
     reading = get_reading(reading_id)
     if not reading:
-        return False
-    
-    reading.update(updates)
-    filepath = os.path.join(READINGS_DIR, f'{reading_id}.json')
-    
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(reading, f, ensure_ascii=False, indent=2)
-    
-    return True
+        return None, (jsonify({'error': 'Reading not found'}), 404)
+    if not (reading.get('paid') or reading.get('sent')):
+        return None, (jsonify({'error': 'Payment required'}), 402)
+    return reading, None
+
+
+def chart_summary_of(chart):
+    return {point: chart[point]['sign'] for point in ('sun', 'moon', 'venus', 'rising') if point in chart}
+
+
+def reading_bodies(reading):
+    """预览（公开，与 create-reading 的返回一致）和完整报告（需令牌）的响应内容"""
+    summary = chart_summary_of(reading.get('chart') or {})
+    full_report = {k: v for k, v in (reading.get('full_report') or {}).items() if k != 'source_image_url'}
+    digest = reading.get('image_digest')
+    if digest:
+        # 旧订单保存的是不带签名的原图/邮件图地址
+        full_report.update({
+            'hd_image_url': image_url(digest, 'original'),
+            'email_image_url': image_url(digest, 'email')
+        })
+    return {
+        'preview': {
+            'success': True,
+            'reading_id': reading['reading_id'],
+            'chart': summary,
+            'preview': reading.get('preview') or {}
+        },
+        'full': {
+            'success': True,
+            'reading_id': reading['reading_id'],
+            'name': reading.get('name'),
+            'chart': summary,
+            'full_report': full_report
+        }
+    }
+
+
+def render_representations(reading):
+    """序列化并预压缩两份响应体，返回 {'preview': digest, 'full': digest}"""
+    return {kind: representations.put(body) for kind, body in reading_bodies(reading).items()}
+
+
+def reading_representation(reading, kind):
+    """读取订单的预压缩响应体；旧订单（或文件缺失）当场生成并记录"""
+    digest = (reading.get('representations') or {}).get(kind)
+    found = representations.get(digest) if digest else None
+    if found:
+        return found
+    with timed('render'):
+        digests = render_representations(reading)
+    # 已归档的订单 update 返回 False，不会被恢复到热存储
+    store.update(reading['reading_id'], {'representations': digests})
+    return representations.get(digests[kind])
+
+
+def representation_response(representation, cache_control):
+    """按 Accept-Encoding 选择预压缩版本，强 ETag 命中 If-None-Match 时返回 304"""
+    encoding, body, etag = representation.select(request.headers.get('Accept-Encoding'))
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=representation.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
 
 
 def get_all_readings():
-    """获取所有订单"""
-    readings = []
-    for filename in os.listdir(READINGS_DIR):
-        if filename.endswith('.json'):
-            filepath = os.path.join(READINGS_DIR, filename)
-            with open(filepath, 'r', encoding='utf-8') as f:
-                readings.append(json.load(f))
-    
-    # 按创建时间倒序
-    readings.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-    return readings
+    """获取所有订单（按创建时间倒序）"""
+    return store.all()
 
 
 @app.route('/api/health', methods=['GET'])
@@ -101,24 +505,82 @@ def health_check():
     })
 
 
-@app.route('/api/create-reading', methods=['POST'])
-def create_reading():
+@app.route('/api/health/live', methods=['GET'])
+def liveness_check():
+    """存活检查：进程能响应即可，不触碰任何依赖"""
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness_check():
     """
-    创建完整的星盘报告（一次性生成所有内容）
+    就绪检查：服务已构建（首次探测时完成懒加载）、存储和任务库可读
+    未就绪返回 503；同时报告本进程的冷启动耗时
     """
+    checks = {}
+    for service in SERVICES:
+        try:
+            service.get()
+            checks[service.name] = {'ok': True, 'init_seconds': round(service.init_seconds, 4)}
+        except Exception as e:
+            checks[service.name] = {'ok': False, 'error': str(e)}
+    for name, probe in (('storage', lambda: store.list_meta(None, None, 1)), ('jobs', job_queue.pending_count)):
+        try:
+            probe()
+            checks[name] = {'ok': True}
+        except Exception as e:
+            checks[name] = {'ok': False, 'error': str(e)}
+
+    ready = all(check['ok'] for check in checks.values())
+    if ready and STARTUP['ready_seconds'] is None:
+        STARTUP['ready_seconds'] = round(time.perf_counter() - IMPORT_STARTED, 4)
+    return jsonify({
+        'status': 'ready' if ready else 'not_ready',
+        'pid': os.getpid(),
+        'checks': checks,
+        # 熔断只影响生成报告，不影响就绪（否则会把整个实例摘掉）
+        'circuit_breakers': openai_client.breaker_states(),
+        'cold_start': STARTUP
+    }), 200 if ready else 503
+
+
+REQUIRED_READING_FIELDS = ['year', 'month', 'day', 'hour', 'minute', 'city', 'email']
+
+
+def validate_reading_request(data):
+    """校验创建报告的请求，返回错误信息或 None"""
+    if not isinstance(data, dict):
+        return 'Invalid JSON body'
+    for field in REQUIRED_READING_FIELDS:
+        if field not in data:
+            return f'Missing required field: {field}'
     try:
-        data = request.json
-        
-        # 验证必需字段
-        required = ['year', 'month', 'day', 'hour', 'minute', 'city', 'email']
-        for field in required:
-            if field not in data:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
-        
-        print(f"[CREATE] New reading request for {data['email']}")
-        
-        # 1. 计算星盘
-        print("[STEP 1] Calculating birth chart...")
+        for field in ['year', 'month', 'day', 'hour', 'minute']:
+            int(data[field])
+    except (TypeError, ValueError):
+        return f'Invalid value for field: {field}'
+    if data.get('format') is not None:
+        # 报告输出格式可按请求选择（便于对比 markdown / json 两种模式）
+        from report_generator import REPORT_FORMATS
+        if data['format'] not in REPORT_FORMATS:
+            return f"Invalid value for field: format (expected one of {', '.join(REPORT_FORMATS)})"
+    return None
+
+
+def run_reading_pipeline(data, job=None, reading_id=None):
+    """
+    完整流程：星盘 -> AI报告（含图片）-> 预览 -> 保存
+    返回给前端的预览数据；在任务中运行时每个阶段都会写入事件（供 SSE 推送）
+    结果会被幂等记录和任务结果保存、可能被重放，不含 access_token（由 with_access_token 在响应时加上）
+    """
+    def stage(name, **event):
+        if job:
+            job.progress(stage=name)
+            job.emit(name, **event)
+
+    # 1. 计算星盘
+    print("[STEP 1] Calculating birth chart...")
+    with timed('chart'):
         chart_data = calculator.calculate_birth_chart({
             'name': data.get('name', 'User'),
             'year': int(data['year']),
@@ -129,42 +591,474 @@ def create_reading():
             'city': data['city'],
             'nation': data.get('nation', 'US')
         })
-        
-        # 2. 生成完整报告（包括图片）
-        print("[STEP 2] Generating full report with AI...")
-        gender = data.get('gender', 'female')
-        full_data = generator.generate_full_report_with_image(chart_data, gender)
-        
-        # 3. 创建预览版本
-        print("[STEP 3] Creating preview version...")
+    chart_summary = chart_summary_of(chart_data)
+    stage('chart', chart=chart_summary)
+
+    # 2. 生成完整报告（包括图片）
+    print("[STEP 2] Generating full report with AI...")
+    gender = data.get('gender', 'female')
+    on_section = None
+    if job:
+        on_section = lambda name, content: job.emit('section', name=name, content=content)
+    with timed('report'):
+        full_data = generator.generate_full_report_with_image(
+            chart_data, gender, on_section=on_section, report_format=data.get('format')
+        )
+    stage('image', ready=full_data['image_status'] == 'ready')
+
+    # 3. 创建预览版本（预览图指向本地模糊图，后台任务负责下载和生成）
+    print("[STEP 3] Creating preview version...")
+    reading_id = reading_id or str(uuid.uuid4())
+    full_data['source_image_url'] = full_data['hd_image_url']
+    with timed('preview'):
         preview_data = generator.create_preview_from_full(full_data)
-        
-        # 4. 保存完整数据
-        reading_id = save_reading({
-            'email': data['email'],
-            'name': data.get('name', 'User'),
-            'birth_data': data,
-            'chart': chart_data,
-            'full_report': full_data,
-            'preview': preview_data,
-            'gender': gender
+    preview_data['blur_image_url'] = reading_image_url(reading_id, 'blur')
+
+    # 4. 保存完整数据
+    reading = {
+        'reading_id': reading_id,
+        'email': data['email'],
+        'name': data.get('name', 'User'),
+        'birth_data': data,
+        'chart': chart_data,
+        'full_report': full_data,
+        'preview': preview_data,
+        'gender': gender
+    }
+    if PRERENDER_EMAIL:
+        with timed('email_render'):
+            reading['email_payload'] = render_report_email(reading['name'], full_data)
+    with timed('render'):
+        reading['representations'] = render_representations(reading)
+    reading_id = save_reading(reading)
+    if full_data['image_status'] == 'pending':
+        # 图片生成失败（或熔断中）：排队稍后生成，完成后再本地化
+        job_queue.submit('generate_image', {'reading_id': reading_id})
+    else:
+        job_queue.submit('mirror_image', {'reading_id': reading_id})
+
+    print(f"[SUCCESS] Reading created: {reading_id}")
+
+    result = {
+        'success': True,
+        'reading_id': reading_id,
+        'chart': chart_summary,
+        'preview': preview_data
+    }
+    stage('preview', **result)
+    return result
+
+
+def with_access_token(result):
+    """给下单的客户端的响应加上完整报告的访问令牌"""
+    return {**result, 'access_token': reading_token(result['reading_id'])}
+
+
+def replay_result(result, key):
+    """
+    幂等重放的响应：只有显式 Idempotency-Key（只有原客户端知道）才带访问令牌；
+    派生键由邮箱 + 出生数据构成，别人也能构造出来，重放时不带令牌
+    """
+    return with_access_token(result) if key.startswith('key:') else result
+
+
+def idempotency_key(data):
+    """返回 (key, fingerprint)；没有请求头且未开启派生键时返回 (None, None)"""
+    fingerprint = request_fingerprint(data)
+    header = (request.headers.get('Idempotency-Key') or '').strip()
+    if header:
+        return f'key:{header[:255]}', fingerprint
+    if IDEMPOTENCY_DERIVED_KEYS:
+        return f'derived:{fingerprint}', fingerprint
+    return None, None
+
+
+def run_reading_once(data, key, fingerprint):
+    """
+    同步创建报告（singleflight）：返回 (result, replayed)
+    其他请求正在计算同一个 key 时等待它的结果；超时返回 (None, True)
+    """
+    deadline = time.time() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        state, record = idempotency.begin(key, fingerprint)
+        if state == 'done':
+            metrics.inc('idempotency_total', result='replayed')
+            return record['result'], True
+        if state == 'owner':
+            try:
+                with generation_slot():
+                    result = run_reading_pipeline(data)
+            except Exception:
+                idempotency.fail(key, record['owner'])
+                raise
+            idempotency.complete(key, record['owner'], result)
+            return result, False
+
+        metrics.inc('idempotency_total', result='joined')
+        record = idempotency.wait(key, max(0.0, deadline - time.time()))
+        if record and record['status'] == 'done':
+            return record['result'], True
+        if record:
+            return None, True
+        # owner 失败，重新竞争
+
+
+def run_reading_job(payload, job):
+    """后台任务版本；payload 中的 _idempotency 由入队的请求写入"""
+    claim = payload.pop('_idempotency', None)
+    reading_id = payload.pop('_reading_id', None)
+    try:
+        # 任务队列本身就是排队，这里只等待名额，不受等待队列长度限制
+        with generation_slot(bounded=False):
+            result = run_reading_pipeline(payload, job, reading_id)
+    except Exception:
+        if claim:
+            idempotency.fail(claim['key'], claim['owner'])
+        raise
+    if claim:
+        idempotency.complete(claim['key'], claim['owner'], result)
+    return result
+
+
+def submit_reading_job(data, key, fingerprint):
+    """
+    入队创建报告的任务，返回 (state, job_id, record)：
+    queued - 新任务（record['reading_id'] 为预先分配的订单号，用来给提交者签发访问令牌）；
+    pending - 已有相同请求的任务（复用其 job_id）；done - 已有结果
+    pending 但由同步请求在计算时 job_id 为 None
+    """
+    reading_id = str(uuid.uuid4())
+    if not key:
+        return 'queued', job_queue.submit('create_reading', {**data, '_reading_id': reading_id}), {'reading_id': reading_id}
+
+    state, record = idempotency.begin(key, fingerprint)
+    if state == 'owner':
+        job_id = job_queue.submit('create_reading', {
+            **data, '_reading_id': reading_id, '_idempotency': {'key': key, 'owner': record['owner']}
         })
+        idempotency.attach_job(key, record['owner'], job_id)
+        return 'queued', job_id, {**record, 'reading_id': reading_id}
+    metrics.inc('idempotency_total', result='replayed' if state == 'done' else 'joined')
+    return state, record.get('job_id'), record
+
+
+job_queue.register('create_reading', run_reading_job)
+
+
+def image_signature(digest, variant):
+    return hmac.new(READING_TOKEN_SECRET, f'image:{digest}:{variant}'.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+def image_url(digest, variant):
+    """公开派生图直接用内容地址；原图/邮件图带签名（只出现在完整报告和邮件中）"""
+    url = f"{PUBLIC_BASE_URL}/images/{digest}/{variant}"
+    if variant not in PUBLIC_IMAGE_VARIANTS:
+        url += f"?sig={image_signature(digest, variant)}"
+    return url
+
+
+def reading_image_url(reading_id, variant):
+    return f"{PUBLIC_BASE_URL}/images/reading/{reading_id}/{variant}"
+
+
+def mirror_reading_images(reading_id, job=None):
+    """
+    下载订单的生成图片到本地并生成派生图，把报告/预览/邮件中的链接换成本地地址
+    返回图片 digest
+    """
+    reading = get_reading(reading_id)
+    if not reading:
+        return None
+    if reading.get('image_digest'):
+        return reading['image_digest']
+
+    full_report = reading['full_report']
+    source = full_report.get('source_image_url') or full_report.get('hd_image_url')
+    if not source:
+        # 图片仍在排队生成
+        return None
+    print(f"[IMAGE] Mirroring image for {reading_id}")
+    with timed('image_mirror'):
+        digest = image_store.mirror(source)
+
+    full_report = {
+        **full_report,
+        'source_image_url': source,
+        'hd_image_url': image_url(digest, 'original'),
+        'blur_image_url': image_url(digest, 'blur'),
+        'thumb_image_url': image_url(digest, 'thumb'),
+        'email_image_url': image_url(digest, 'email')
+    }
+    updates = {
+        'image_digest': digest,
+        'full_report': full_report,
+        'preview': {**reading.get('preview', {}), 'blur_image_url': image_url(digest, 'blur')}
+    }
+    if reading.get('email_payload'):
+        updates['email_payload'] = render_report_email(reading['name'], full_report)
+    update_reading(reading_id, updates)
+    return digest
+
+
+job_queue.register('mirror_image', lambda payload, job: {'digest': mirror_reading_images(payload['reading_id'])})
+
+IMAGE_RETRY_DELAY = float(os.getenv('IMAGE_RETRY_DELAY', 30))
+IMAGE_RETRY_ATTEMPTS = int(os.getenv('IMAGE_RETRY_ATTEMPTS', 8))
+
+
+def generate_reading_image(payload, job):
+    """
+    创建时图片生成失败的订单：重新生成并本地化
+    失败时指数退避重新排队（熔断中至少等到熔断器放行探测）
+    """
+    reading_id = payload['reading_id']
+    reading = get_reading(reading_id)
+    if not reading:
+        return None
+    full_report = reading['full_report']
+    if full_report.get('image_status') != 'pending':
+        return {'digest': mirror_reading_images(reading_id)}
+
+    try:
+        with timed('image_retry'):
+            url = generator.generate_image(full_report['soulmate_appearance'], reading.get('gender', 'female'))
+    except Exception as e:
+        delay = min(IMAGE_RETRY_DELAY * 2 ** (job.attempt - 1), 3600)
+        if isinstance(e, CircuitOpenError):
+            delay = max(delay, e.retry_in)
+        raise RetryJob(f"Image generation failed: {str(e)}", delay=delay, max_attempts=IMAGE_RETRY_ATTEMPTS)
+
+    update_reading(reading_id, {'full_report': {
+        **full_report,
+        'source_image_url': url,
+        'hd_image_url': url,
+        'blur_image_url': url,
+        'image_status': 'ready'
+    }})
+    print(f"[IMAGE] Generated pending image for {reading_id}")
+    return {'digest': mirror_reading_images(reading_id)}
+
+
+job_queue.register('generate_image', generate_reading_image)
+# 启动即开始消费（包括重启前遗留在队列中的任务）
+# gunicorn 下由 post_fork 在每个 worker 中启动（见 gunicorn.conf.py），master 不运行任务
+if os.getenv('JOB_AUTOSTART', 'true').lower() == 'true':
+    job_queue.start()
+
+
+@app.route('/images/<digest>/<variant>', methods=['GET'])
+def serve_image(digest, variant):
+    """
+    本地图片（内容寻址，永不变化，可长期缓存）
+    variant: blur / thumb 公开；original / email / email_webp 需要 image_url 生成的签名（?sig=）
+    """
+    protected = variant not in PUBLIC_IMAGE_VARIANTS
+    if protected and not hmac.compare_digest(request.args.get('sig', ''), image_signature(digest, variant)):
+        return jsonify({'error': 'Image not found'}), 404
+    found = image_store.open(digest, variant)
+    if not found:
+        return jsonify({'error': 'Image not found'}), 404
+    path, mimetype = found
+    response = send_file(path, mimetype=mimetype, etag=f'{digest}-{variant}', conditional=True)
+    visibility = 'private' if protected else 'public'
+    response.headers['Cache-Control'] = f'{visibility}, max-age={IMAGE_CACHE_SECONDS}, immutable'
+    return response
+
+
+@app.route('/images/reading/<reading_id>/<variant>', methods=['GET'])
+def serve_reading_image(reading_id, variant):
+    """
+    订单图片的稳定地址：重定向到内容寻址的图片，尚未下载时当场下载
+    blur / thumb 公开；其余需要订单令牌且已付款或已发送（与完整报告相同）
+    """
+    if variant in PUBLIC_IMAGE_VARIANTS:
+        reading = get_reading(reading_id)
+        if not reading:
+            return jsonify({'error': 'Reading not found'}), 404
+    elif variant == 'original' or variant in IMAGE_VARIANTS:
+        reading, error = authorize_full_access(reading_id)
+        if error:
+            return error
+    else:
+        return jsonify({'error': 'Image not found'}), 404
+    try:
+        digest = reading.get('image_digest') or mirror_reading_images(reading_id)
+    except Exception as e:
+        print(f"[IMAGE] Mirroring failed for {reading_id}: {str(e)}")
+        digest = None
+    if not digest:
+        response = jsonify({'error': 'Image not ready'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    response = redirect(image_url(digest, variant))
+    response.headers['Cache-Control'] = 'public, max-age=300' if variant in PUBLIC_IMAGE_VARIANTS else 'private, no-store'
+    return response
+
+
+@app.route('/api/reading/<reading_id>/preview', methods=['GET'])
+def reading_preview(reading_id):
+    """
+    订单预览（与 create-reading 返回的内容相同），页面刷新后用它取回，不必重新创建
+    预序列化 + 预压缩，支持 If-None-Match，可被 CDN 缓存
+    """
+    reading = get_reading(reading_id)
+    if not reading:
+        return jsonify({'error': 'Reading not found'}), 404
+    return representation_response(reading_representation(reading, 'preview'), PREVIEW_CACHE_CONTROL)
+
+
+@app.route('/api/reading/<reading_id>/full', methods=['GET'])
+def reading_full(reading_id):
+    """
+    完整报告：需要创建时返回的 access_token（Authorization: Bearer <token> 或 ?token=），且订单已付款或已发送
+    私有缓存，只允许浏览器用 ETag 重新验证
+    """
+    reading, error = authorize_full_access(reading_id)
+    if error:
+        return error
+    return representation_response(reading_representation(reading, 'full'), 'private, no-cache')
+
+
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    """星盘/报告缓存命中统计（当前 worker 进程）"""
+    stats = {'chart_cache': chart_cache.stats()}
+    if report_cache:
+        stats['report_cache'] = report_cache.stats()
+    return jsonify(stats)
+
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 抓取接口：阶段耗时直方图、外部调用耗时、错误/重试/缓存命中计数（所有 worker 汇总）"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/upstream-stats', methods=['GET'])
+def upstream_stats():
+    """OpenAI 调用统计：请求数、重试/对冲次数、失败数、每次尝试的平均耗时，以及熔断器状态（当前 worker 进程）"""
+    return jsonify({'openai': openai_client.stats(), 'circuit_breakers': openai_client.breaker_states()})
+
+
+def planet_signs(record):
+    """
+    只算行星星座（不含上升、宫位、度数）：换座表覆盖的日期走二分查找，否则回落到完整计算
+    失败时返回 {'error': ...}，与批量星盘一致
+    """
+    try:
+        if sign_table:
+            location = resolver.resolve(record['city'], record.get('nation', 'US'))
+            jd = birth_julian_day(record, location['tz_str'])
+            if sign_table.covers(jd):
+                return sign_table.signs(jd)
+        chart_data = calculator.calculate_birth_chart(record)
+    except Exception as e:
+        return {'error': f'Birth chart calculation failed: {str(e)}'}
+    return {planet: chart_data[planet]['sign'] for planet in SIGN_PLANETS}
+
+
+@app.route('/api/charts/batch', methods=['POST'])
+def charts_batch():
+    """
+    批量计算星盘（导入/回填用）
+    请求: {"records": [{year, month, day, hour, minute, city, nation}, ...], "signs_only": false}
+    signs_only=true 时只返回六颗行星的星座（走换座表，快得多）
+    """
+    try:
+        data = request.json or {}
+        records = data.get('records')
+        if not isinstance(records, list):
+            return jsonify({'error': 'Missing required field: records'}), 400
+        max_records = int(os.getenv('BATCH_MAX_RECORDS', 10000))
+        if len(records) > max_records:
+            return jsonify({'error': f'Too many records (max {max_records})'}), 400
+
+        for i, record in enumerate(records):
+            for field in ['year', 'month', 'day', 'hour', 'minute', 'city']:
+                if not isinstance(record, dict) or field not in record:
+                    return jsonify({'error': f'Record {i}: missing required field: {field}'}), 400
+
+        if data.get('signs_only'):
+            with timed('planet_signs'):
+                charts = [planet_signs(record) for record in records]
+            return jsonify({'success': True, 'count': len(charts), 'charts': charts})
+
+        print(f"[BATCH] Calculating {len(records)} charts")
+        charts = calculator.calculate_birth_charts(records)
+        return jsonify({'success': True, 'count': len(charts), 'charts': charts})
+
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/create-reading', methods=['POST'])
+def create_reading():
+    """
+    创建完整的星盘报告（一次性生成所有内容）
+    传 ?mode=job 或 {"async": true} 时改为入队，立即返回 202 + job_id
+    """
+    try:
+        data = request.json
         
-        print(f"[SUCCESS] Reading created: {reading_id}")
-        
-        # 5. 返回预览给前端
-        return jsonify({
-            'success': True,
-            'reading_id': reading_id,
-            'chart': {
-                'sun': chart_data['sun']['sign'],
-                'moon': chart_data['moon']['sign'],
-                'venus': chart_data['venus']['sign'],
-                'rising': chart_data['rising']['sign']
-            },
-            'preview': preview_data
-        })
+        # 验证必需字段
+        error = validate_reading_request(data)
+        if error:
+            return jsonify({'error': error}), 400
         
+        print(f"[CREATE] New reading request for {data['email']}")
+        key, fingerprint = idempotency_key(data)
+        # 重复请求（重试/双击）直接复用已有结果或加入计算，不扣限流令牌
+        existing = existing_request(key, fingerprint)
+        if not existing:
+            check_client_limits(data)
+
+        if request.args.get('mode') == 'job' or data.get('async'):
+            if not existing:
+                admission.check_backlog(job_queue.pending_count('create_reading'))
+            data = {k: v for k, v in data.items() if k != 'async'}
+            state, job_id, record = submit_reading_job(data, key, fingerprint)
+            if state == 'done':
+                return replayed_response(replay_result(record['result'], key))
+            if job_id:
+                print(f"[QUEUED] Reading job {job_id}" + (' (existing)' if state == 'pending' else ''))
+                queued = {
+                    'success': True,
+                    'job_id': job_id,
+                    'status': 'queued',
+                    'status_url': f'/api/jobs/{job_id}'
+                }
+                if state == 'queued':
+                    # 任务结果不含令牌，只在这里发给提交者
+                    queued['access_token'] = reading_token(record['reading_id'])
+                response = jsonify(queued)
+                if state == 'pending':
+                    response.headers['Idempotent-Replayed'] = 'true'
+                return response, 202
+            # 相同请求正在同步计算，等待其结果
+
+        if not key:
+            with generation_slot():
+                return jsonify(with_access_token(run_reading_pipeline(data)))
+
+        # 5. 返回预览给前端（重复请求直接返回已有结果）
+        result, replayed = run_reading_once(data, key, fingerprint)
+        if result is None:
+            response = jsonify({'error': 'An identical request is still being processed'})
+            response.headers['Retry-After'] = '5'
+            return response, 409
+        return replayed_response(replay_result(result, key)) if replayed else jsonify(with_access_token(result))
+
+    except IdempotencyConflict as e:
+        return jsonify({'error': str(e)}), 422
+    except AdmissionRejected as e:
+        print(f"[ADMISSION] {str(e)}")
+        return rejected_response(e)
+    except CircuitOpenError as e:
+        print(f"[ERROR] {str(e)}")
+        response = jsonify({'error': 'Report generation is temporarily unavailable'})
+        response.headers['Retry-After'] = str(max(1, int(e.retry_in + 0.999)))
+        return response, 503
     except Exception as e:
         print(f"[ERROR] {str(e)}")
         import traceback
@@ -172,175 +1066,693 @@ def create_reading():
         return jsonify({'error': str(e)}), 500
 
 
+def replayed_response(result):
+    response = jsonify(result)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+SSE_POLL_INTERVAL = 0.25
+SSE_HEARTBEAT_SECONDS = 15
+
+
+def sse_message(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream_job_events(job_id, after_id=0, access_token=None):
+    """
+    把任务事件转成 SSE 流，直到任务结束
+    gunicorn 使用 gthread worker（见 gunicorn.conf.py），每个流只占用一个线程，不独占 worker 进程
+    """
+    # 先发一段注释，让代理立即把响应头和首字节转发给浏览器
+    yield ':' + ' ' * 2048 + '\n\n'
+    queued = {'job_id': job_id}
+    if access_token:
+        queued['access_token'] = access_token
+    yield sse_message('queued', queued)
+    last_sent = time.time()
+    while True:
+        for event_id, event, data in job_queue.events(job_id, after_id):
+            after_id = event_id
+            last_sent = time.time()
+            yield sse_message(event, data, event_id)
+
+        job = job_queue.get(job_id)
+        if not job:
+            yield sse_message('error', {'error': 'Job not found'})
+            return
+        if job['status'] in ('done', 'failed'):
+            # 结束前再取一次，避免漏掉最后写入的事件
+            for event_id, event, data in job_queue.events(job_id, after_id):
+                yield sse_message(event, data, event_id)
+            if job['status'] == 'done':
+                yield sse_message('done', job.get('result', {}))
+            else:
+                yield sse_message('error', {'error': job.get('error', 'Job failed')})
+            return
+
+        if time.time() - last_sent > SSE_HEARTBEAT_SECONDS:
+            last_sent = time.time()
+            yield ': heartbeat\n\n'
+        time.sleep(SSE_POLL_INTERVAL)
+
+
+def replay_result_events(result):
+    """已完成的结果（没有对应任务事件时）直接以 preview + done 推送"""
+    yield sse_message('preview', result)
+    yield sse_message('done', result)
+
+
+def sse_response(generator_fn):
+    return Response(stream_with_context(generator_fn), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@app.route('/api/create-reading/stream', methods=['POST'])
+def create_reading_stream():
+    """
+    创建报告并以 Server-Sent Events 推送进度：
+    queued -> chart -> section(逐段) -> image -> preview -> done
+    计算在后台任务中执行，这里只读取事件
+    """
+    data = request.json
+    error = validate_reading_request(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    print(f"[CREATE] New streaming reading request for {data['email']}")
+    key, fingerprint = idempotency_key(data)
+    try:
+        if not existing_request(key, fingerprint):
+            check_client_limits(data)
+            admission.check_backlog(job_queue.pending_count('create_reading'))
+        state, job_id, record = submit_reading_job(data, key, fingerprint)
+    except IdempotencyConflict as e:
+        return jsonify({'error': str(e)}), 422
+    except AdmissionRejected as e:
+        print(f"[ADMISSION] {str(e)}")
+        return rejected_response(e)
+    if job_id:
+        # 重复请求从头回放同一个任务的事件；访问令牌只发给提交者（queued 事件）
+        access_token = reading_token(record['reading_id']) if state == 'queued' else None
+        return sse_response(stream_job_events(job_id, access_token=access_token))
+    if state == 'pending':
+        record = idempotency.wait(key, IDEMPOTENCY_WAIT_SECONDS)
+    if not record or record['status'] != 'done':
+        response = jsonify({'error': 'An identical request is still being processed'})
+        response.headers['Retry-After'] = '5'
+        return response, 409
+    return sse_response(replay_result_events(replay_result(record['result'], key)))
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    任务事件的 SSE 流（EventSource 断线重连时通过 Last-Event-ID 续传）
+    """
+    if not job_queue.get(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    after_id = request.headers.get('Last-Event-ID') or request.args.get('after', 0)
+    try:
+        after_id = int(after_id)
+    except ValueError:
+        after_id = 0
+    return sse_response(stream_job_events(job_id, after_id))
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    查询后台任务状态（queued / running / done / failed）
+    """
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+
+def deliver_reading(reading_id):
+    """
+    发送一份报告，返回状态：sent / not_found / already_sent / in_progress / failed
+    通过 store.claim_send 保证并发下同一订单只会发送一次
+    """
+    reading = get_reading(reading_id)
+    if not reading:
+        return 'not_found'
+    if reading.get('sent'):
+        return 'already_sent'
+    if not store.claim_send(reading_id, SEND_CLAIM_TTL):
+        return 'in_progress'
+
+    if not reading.get('image_digest'):
+        # 后台下载还没完成时先同步本地化，避免邮件引用已过期的临时链接
+        try:
+            mirror_reading_images(reading_id)
+            reading = get_reading(reading_id)
+        except Exception as e:
+            print(f"[IMAGE] Mirroring failed for {reading_id}: {str(e)}")
+
+    try:
+        print(f"[SEND] Sending report to {reading['email']}")
+        
+        # 发送邮件（优先使用创建时预渲染的内容）
+        with timed('sendgrid'):
+            if reading.get('email_payload'):
+                success = email_sender.send_payload(reading['email'], reading['email_payload'])
+            else:
+                success = email_sender.send_full_report(
+                    to_email=reading['email'],
+                    name=reading['name'],
+                    report_data=reading['full_report'],
+                    chart_data=reading['chart']
+                )
+    except Exception:
+        store.release_send(reading_id)
+        raise
+
+    if not success:
+        metrics.inc('errors_total', stage='sendgrid')
+        store.release_send(reading_id)
+        return 'failed'
+
+    # 标记为已发送（占用记录保留，防止重复发送）
+    update_reading(reading_id, {
+        'sent': True,
+        'sent_at': datetime.now().isoformat()
+    })
+    print(f"[SUCCESS] Report sent to {reading['email']}")
+    return 'sent'
+
+
 @app.route('/api/send-report/<reading_id>', methods=['POST'])
 def send_report(reading_id):
     """
     发送完整报告到用户邮箱（管理员手动触发）
     """
     try:
-        reading = get_reading(reading_id)
-        
-        if not reading:
+        status = deliver_reading(reading_id)
+        if status == 'sent':
+            return jsonify({'success': True})
+        if status == 'not_found':
             return jsonify({'error': 'Reading not found'}), 404
-        
-        if reading.get('sent'):
+        if status == 'already_sent':
             return jsonify({'error': 'Already sent'}), 400
-        
-        print(f"[SEND] Sending report to {reading['email']}")
-        
-        # 发送邮件
-        success = email_sender.send_full_report(
-            to_email=reading['email'],
-            name=reading['name'],
-            report_data=reading['full_report'],
-            chart_data=reading['chart']
-        )
-        
-        if success:
-            # 标记为已发送
-            update_reading(reading_id, {
-                'sent': True,
-                'sent_at': datetime.now().isoformat()
-            })
-            print(f"[SUCCESS] Report sent to {reading['email']}")
-            return jsonify({'success': True})
-        else:
-            return jsonify({'error': 'Failed to send email'}), 500
+        if status == 'in_progress':
+            return jsonify({'error': 'Send already in progress'}), 409
+        return jsonify({'error': 'Failed to send email'}), 500
             
     except Exception as e:
         print(f"[ERROR] {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/admin', methods=['GET'])
-def admin_panel():
+def run_bulk_send(payload, job=None):
     """
-    简单的管理后台 - 显示所有订单
+    批量发送：并发调用 deliver_reading，用令牌桶限制 SendGrid 速率，逐个记录进度
+    payload = {'reading_ids': [...]} 或 {'filter': {'status': 'pending', 'paid': true}}
     """
-    readings = get_all_readings()
-    
-    html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Soulmate Admin</title>
-        <meta charset="utf-8">
-        <style>
-            body { 
-                font-family: Arial, sans-serif; 
-                max-width: 1200px; 
-                margin: 50px auto; 
-                padding: 20px;
-                background: #f5f5f5;
-            }
-            h1 { color: #333; }
-            table { 
-                width: 100%; 
-                background: white;
-                border-collapse: collapse; 
-                box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            }
-            th, td { 
-                padding: 12px; 
-                text-align: left; 
-                border-bottom: 1px solid #ddd;
-            }
-            th { 
-                background: #6366f1; 
-                color: white;
-                font-weight: bold;
-            }
-            button { 
-                padding: 8px 16px; 
-                background: #10b981; 
-                color: white; 
-                border: none; 
-                border-radius: 4px; 
-                cursor: pointer;
-                font-size: 14px;
-            }
-            button:hover { background: #059669; }
-            button:disabled { 
-                background: #ccc; 
-                cursor: not-allowed;
-            }
-            .status { 
-                padding: 4px 8px; 
-                border-radius: 4px; 
-                font-size: 12px;
-                font-weight: bold;
-            }
-            .status.sent { background: #d1fae5; color: #065f46; }
-            .status.pending { background: #fef3c7; color: #92400e; }
-            .email { color: #6366f1; }
-        </style>
-    </head>
-    <body>
-        <h1>📧 Soulmate Admin - Pending Reports</h1>
-        <p>Total readings: <strong>""" + str(len(readings)) + """</strong></p>
-        <table>
-            <thead>
-                <tr>
-                    <th>Email</th>
-                    <th>Name</th>
-                    <th>Created</th>
-                    <th>Status</th>
-                    <th>Action</th>
-                </tr>
-            </thead>
-            <tbody>
+    reading_ids = payload.get('reading_ids')
+    if reading_ids is None:
+        reading_ids = []
+        filters = {**payload.get('filter', {}), 'status': 'pending'}
+        cursor = None
+        while True:
+            items, cursor = store.list_meta(filters, cursor, 500)
+            reading_ids.extend(item['reading_id'] for item in items)
+            if not cursor:
+                break
+
+    results = {reading_id: 'queued' for reading_id in reading_ids}
+    lock = threading.Lock()
+    state = {'done': 0, 'reported_at': 0.0}
+
+    def report_progress(force=False):
+        # 进度最多每秒写一次，避免大批量时频繁序列化整个结果表
+        if job and (force or time.time() - state['reported_at'] >= 1.0):
+            state['reported_at'] = time.time()
+            job.progress(total=len(reading_ids), done=state['done'], results=dict(results))
+
+    def send_one(reading_id):
+        send_buckets.acquire(SEND_RATE_LIMIT)
+        try:
+            status = deliver_reading(reading_id)
+        except Exception as e:
+            print(f"[ERROR] Bulk send {reading_id}: {str(e)}")
+            status = 'failed'
+        with lock:
+            results[reading_id] = status
+            state['done'] += 1
+            report_progress()
+        return status
+
+    report_progress(force=True)
+    with ThreadPoolExecutor(max_workers=SEND_CONCURRENCY) as executor:
+        list(executor.map(send_one, reading_ids))
+
+    summary = {}
+    for status in results.values():
+        summary[status] = summary.get(status, 0) + 1
+    return {'total': len(reading_ids), 'summary': summary, 'results': results}
+
+
+job_queue.register('bulk_send', run_bulk_send)
+
+
+@app.route('/api/send-reports', methods=['POST'])
+def send_reports():
     """
+    批量发送报告（后台任务），立即返回 202 + job_id，进度通过 /api/jobs/<id> 查询
+    请求: {"reading_ids": [...]} 或 {"filter": {"paid": true}}（filter 只会选中未发送的订单）
+    """
+    data = request.json or {}
+    if 'reading_ids' in data:
+        if not isinstance(data['reading_ids'], list):
+            return jsonify({'error': 'reading_ids must be a list'}), 400
+        payload = {'reading_ids': [str(x) for x in data['reading_ids']]}
+    elif isinstance(data.get('filter'), dict):
+        payload = {'filter': {k: data['filter'][k] for k in ('paid', 'email', 'date_from', 'date_to') if k in data['filter']}}
+    else:
+        return jsonify({'error': 'Provide reading_ids or filter'}), 400
+
+    job_id = job_queue.submit('bulk_send', payload)
+    print(f"[QUEUED] Bulk send job {job_id}")
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/api/jobs/{job_id}'
+    }), 202
+
+
+ADMIN_PAGE_SIZE = 50
+# 后台统计（总数 / 待发送）要扫整张元数据表，按 TTL 缓存，翻页时不再每次都重算
+ADMIN_COUNTS_TTL = float(os.getenv('ADMIN_COUNTS_TTL', 30))
+admin_counts_cache = {'counts': None, 'expires_at': 0.0}
+admin_counts_lock = threading.Lock()
+
+
+def admin_counts():
+    """缓存过期时由一个请求重算，其他并发请求等它算完直接复用"""
+    with admin_counts_lock:
+        if admin_counts_cache['counts'] is None or time.time() >= admin_counts_cache['expires_at']:
+            admin_counts_cache['counts'] = store.count_meta()
+            admin_counts_cache['expires_at'] = time.time() + ADMIN_COUNTS_TTL
+        return admin_counts_cache['counts']
+
+
+# 后台页面是静态外壳，表格数据通过 /api/admin/readings 分页加载
+ADMIN_HTML = """<!DOCTYPE html>
+<html>
+<head>
+    <title>Soulmate Admin</title>
+    <meta charset="utf-8">
+    <style>
+        body { 
+            font-family: Arial, sans-serif; 
+            max-width: 1200px; 
+            margin: 50px auto; 
+            padding: 20px;
+            background: #f5f5f5;
+        }
+        h1 { color: #333; }
+        table { 
+            width: 100%; 
+            background: white;
+            border-collapse: collapse; 
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+        }
+        th, td { 
+            padding: 12px; 
+            text-align: left; 
+            border-bottom: 1px solid #ddd;
+        }
+        th { 
+            background: #6366f1; 
+            color: white;
+            font-weight: bold;
+        }
+        button { 
+            padding: 8px 16px; 
+            background: #10b981; 
+            color: white; 
+            border: none; 
+            border-radius: 4px; 
+            cursor: pointer;
+            font-size: 14px;
+        }
+        button:hover { background: #059669; }
+        button:disabled { 
+            background: #ccc; 
+            cursor: not-allowed;
+        }
+        .status { 
+            padding: 4px 8px; 
+            border-radius: 4px; 
+            font-size: 12px;
+            font-weight: bold;
+        }
+        .status.sent { background: #d1fae5; color: #065f46; }
+        .status.pending { background: #fef3c7; color: #92400e; }
+        .email { color: #6366f1; }
+        .filters { margin: 20px 0; display: flex; gap: 10px; align-items: center; }
+        .filters input, .filters select { padding: 6px; }
+        #more { margin-top: 20px; }
+    </style>
+</head>
+<body>
+    <h1>📧 Soulmate Admin - Pending Reports</h1>
+    <p>Total readings: <strong id="total">-</strong> &nbsp; Pending: <strong id="pending">-</strong></p>
+    <form class="filters" id="filters">
+        <select name="status">
+            <option value="">All</option>
+            <option value="pending">Pending</option>
+            <option value="sent">Sent</option>
+        </select>
+        <input type="date" name="from" title="Created from">
+        <input type="date" name="to" title="Created to">
+        <input type="search" name="email" placeholder="Search email">
+        <button type="submit">Filter</button>
+    </form>
+    <p>
+        <label><input type="checkbox" id="paid-only" checked> Paid only</label>
+        <button id="send-all">Send all pending</button>
+        <span id="bulk-progress"></span>
+    </p>
+    <table>
+        <thead>
+            <tr>
+                <th>Email</th>
+                <th>Name</th>
+                <th>Created</th>
+                <th>Status</th>
+                <th>Action</th>
+            </tr>
+        </thead>
+        <tbody id="rows"></tbody>
+    </table>
+    <button id="more" hidden>Load more</button>
     
-    for reading in readings:
-        sent = reading.get('sent', False)
-        status_class = 'sent' if sent else 'pending'
-        status_text = '✅ Sent' if sent else '⏳ Pending'
-        button_disabled = 'disabled' if sent else ''
-        
-        html += f"""
-                <tr>
-                    <td class="email">{reading['email']}</td>
-                    <td>{reading['name']}</td>
-                    <td>{reading['created_at'][:19]}</td>
-                    <td><span class="status {status_class}">{status_text}</span></td>
-                    <td>
-                        <button onclick="sendReport('{reading['reading_id']}')" {button_disabled}>
-                            Send Report
-                        </button>
-                    </td>
-                </tr>
-        """
-    
-    html += """
-            </tbody>
-        </table>
-        
-        <script>
-            async function sendReport(readingId) {
-                if (!confirm('Send full report to this user?')) return;
+    <script>
+        let nextCursor = null;
+
+        function cell(text, className) {
+            const td = document.createElement('td');
+            if (className) td.className = className;
+            td.textContent = text;
+            return td;
+        }
+
+        function renderRow(reading) {
+            const tr = document.createElement('tr');
+            tr.appendChild(cell(reading.email, 'email'));
+            tr.appendChild(cell(reading.name || ''));
+            tr.appendChild(cell((reading.created_at || '').slice(0, 19)));
+
+            const status = document.createElement('span');
+            status.className = 'status ' + (reading.sent ? 'sent' : 'pending');
+            status.textContent = reading.sent ? '✅ Sent' : '⏳ Pending';
+            const statusCell = document.createElement('td');
+            statusCell.appendChild(status);
+            tr.appendChild(statusCell);
+
+            const button = document.createElement('button');
+            button.textContent = 'Send Report';
+            button.disabled = reading.sent;
+            button.onclick = () => sendReport(reading.reading_id);
+            const actionCell = document.createElement('td');
+            actionCell.appendChild(button);
+            tr.appendChild(actionCell);
+            return tr;
+        }
+
+        async function loadPage(reset) {
+            const params = new URLSearchParams(new FormData(document.getElementById('filters')));
+            for (const [key, value] of [...params.entries()]) {
+                if (!value) params.delete(key);
+            }
+            if (!reset && nextCursor) params.set('cursor', nextCursor);
+
+            const response = await fetch('/api/admin/readings?' + params.toString());
+            const data = await response.json();
+            const rows = document.getElementById('rows');
+            if (reset) rows.innerHTML = '';
+            data.items.forEach(reading => rows.appendChild(renderRow(reading)));
+            document.getElementById('total').textContent = data.counts.total;
+            document.getElementById('pending').textContent = data.counts.pending;
+
+            nextCursor = data.next_cursor;
+            document.getElementById('more').hidden = !nextCursor;
+        }
+
+        async function sendReport(readingId) {
+            if (!confirm('Send full report to this user?')) return;
+            
+            try {
+                const response = await fetch(`/api/send-report/${readingId}`, {
+                    method: 'POST'
+                });
                 
-                try {
-                    const response = await fetch(`/api/send-report/${readingId}`, {
-                        method: 'POST'
-                    });
-                    
-                    if (response.ok) {
-                        alert('✅ Report sent successfully!');
-                        location.reload();
-                    } else {
-                        const error = await response.json();
-                        alert('❌ Error: ' + error.error);
-                    }
-                } catch (err) {
-                    alert('❌ Network error: ' + err.message);
+                if (response.ok) {
+                    alert('✅ Report sent successfully!');
+                    loadPage(true);
+                } else {
+                    const error = await response.json();
+                    alert('❌ Error: ' + error.error);
                 }
+            } catch (err) {
+                alert('❌ Network error: ' + err.message);
+            }
+        }
+
+        async function sendAllPending() {
+            const paidOnly = document.getElementById('paid-only').checked;
+            if (!confirm('Send reports to all pending' + (paidOnly ? ' paid' : '') + ' orders?')) return;
+
+            const filter = paidOnly ? { paid: true } : {};
+            const response = await fetch('/api/send-reports', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ filter })
+            });
+            const data = await response.json();
+            if (!response.ok) {
+                alert('❌ Error: ' + data.error);
+                return;
             }
-        </script>
-    </body>
-    </html>
+
+            const progress = document.getElementById('bulk-progress');
+            const timer = setInterval(async () => {
+                const job = await (await fetch(data.status_url)).json();
+                const p = job.progress || {};
+                progress.textContent = `${job.status}: ${p.done || 0} / ${p.total || '?'}`;
+                if (job.status === 'done' || job.status === 'failed') {
+                    clearInterval(timer);
+                    if (job.result) progress.textContent += ' ' + JSON.stringify(job.result.summary);
+                    loadPage(true);
+                }
+            }, 1000);
+        }
+
+        document.getElementById('send-all').onclick = sendAllPending;
+        document.getElementById('filters').onsubmit = (e) => { e.preventDefault(); loadPage(true); };
+        document.getElementById('more').onclick = () => loadPage(false);
+        loadPage(true);
+    </script>
+</body>
+</html>
+"""
+
+
+ADMIN_PAGE = Representation(ADMIN_HTML.encode('utf-8'), mimetype='text/html')
+
+
+@app.route('/admin', methods=['GET'])
+def admin_panel():
     """
-    
-    return html
+    简单的管理后台 - 订单列表（数据分页加载）
+    页面是常量：启动时预压缩一次，带 ETag
+    """
+    return representation_response(ADMIN_PAGE, 'no-cache')
+
+
+def admin_filters(args):
+    """status=pending|sent, paid=true|false, email, from, to (YYYY-MM-DD) -> store 的 filters"""
+    paid = args.get('paid')
+    return {
+        'status': args.get('status'),
+        'paid': None if paid is None else paid.lower() == 'true',
+        'email': args.get('email'),
+        'date_from': args.get('from'),
+        'date_to': args.get('to')
+    }
+
+
+@app.route('/api/admin/readings', methods=['GET'])
+def admin_readings():
+    """
+    后台订单列表 JSON（只读元数据索引）
+    参数: status=pending|sent, paid=true|false, email, from, to (YYYY-MM-DD), cursor, limit
+    """
+    try:
+        filters = admin_filters(request.args)
+        limit = min(max(int(request.args.get('limit', ADMIN_PAGE_SIZE)), 1), 500)
+        items, next_cursor = store.list_meta(filters, request.args.get('cursor'), limit)
+        return jsonify({
+            'items': items,
+            'next_cursor': next_cursor,
+            'counts': admin_counts()
+        })
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Invalid query: {str(e)}'}), 400
+
+
+@app.route('/api/admin/export', methods=['GET'])
+def admin_export():
+    """
+    流式导出订单（分块传输，内存占用与订单数无关）
+    参数: format=ndjson|csv, fields（逗号分隔，支持 chart.sun.sign 这样的路径和 signs 简写），
+          status, paid, email, from, to（同订单列表），since（增量导出的变更游标）
+    响应头 X-Export-Cursor 是下一次增量导出的 since；增量导出只含新增和修改，删除/归档的订单不会出现
+    """
+    fmt = request.args.get('format', 'ndjson')
+    try:
+        fields = parse_fields(request.args.get('fields'))
+        since = request.args.get('since')
+        since = int(since) if since not in (None, '') else None
+        cursor = store.change_seq()
+        chunks = export_chunks(
+            store, fmt, fields, admin_filters(request.args), since, cursor if since is not None else None
+        )
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Invalid query: {str(e)}'}), 400
+
+    def generate():
+        yield from chunks
+        metrics.inc('exports_total', format=fmt, mode='full' if since is None else 'incremental')
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'text/csv'
+    filename = f"readings-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+        'X-Export-Cursor': str(cursor)
+    })
+
+
+SYNASTRY_MAX_RESULTS = 100
+
+
+@app.route('/api/admin/readings/<reading_id>/matches', methods=['GET'])
+def admin_reading_matches(reading_id):
+    """
+    合盘匹配：该订单的星盘与全部订单星盘的相位得分，返回最高的 limit 个（不含自己）
+    结果只含 reading_id，后台按需再取详情
+    """
+    reading = get_reading(reading_id)
+    if not reading:
+        return jsonify({'error': 'Reading not found'}), 404
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), SYNASTRY_MAX_RESULTS)
+    except ValueError:
+        return jsonify({'error': 'Invalid query: limit'}), 400
+    try:
+        with timed('synastry'):
+            matches = synastry.match(reading.get('chart'), limit, exclude=reading_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 422
+    return jsonify({'reading_id': reading_id, 'indexed': len(synastry.get()), 'matches': matches})
+
+
+@app.route('/api/admin/synastry/rebuild', methods=['POST'])
+def admin_synastry_rebuild():
+    """从存储全量重建合盘索引（后台任务）"""
+    job_id = job_queue.submit('synastry_rebuild', {})
+    return jsonify({'success': True, 'job_id': job_id, 'status_url': f'/api/jobs/{job_id}'}), 202
+
+
+job_queue.register('synastry_rebuild', lambda payload, job: {'indexed': synastry.rebuild(store.iter_all())})
+
+
+@app.route('/api/admin/archive', methods=['POST'])
+def admin_archive():
+    """
+    归档已发送的旧订单（后台任务）
+    参数（JSON，可选）: days（默认 ARCHIVE_AFTER_DAYS）
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        days = int(data.get('days', ARCHIVE_AFTER_DAYS))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid value for field: days'}), 400
+    job_id = job_queue.submit('archive_readings', {'days': days})
+    return jsonify({'success': True, 'job_id': job_id, 'status_url': f'/api/jobs/{job_id}'}), 202
+
+
+@app.route('/api/admin/archive', methods=['GET'])
+def admin_archive_stats():
+    """归档段统计：段数、订单数、占用字节"""
+    return jsonify(archive.stats())
+
+
+@app.route('/api/admin/admission', methods=['GET'])
+def admin_admission_stats():
+    """准入控制状态：进行中 / 排队中的生成数、上限、平均占用时长，以及客户端限流配置"""
+    return jsonify({
+        **admission.stats(),
+        'backlog': job_queue.pending_count('create_reading'),
+        'rate_limits': {
+            'ip': CREATE_RATE_LIMIT_IP and {'burst': CREATE_RATE_LIMIT_IP[0], 'per_second': CREATE_RATE_LIMIT_IP[1]},
+            'email': CREATE_RATE_LIMIT_EMAIL and {'burst': CREATE_RATE_LIMIT_EMAIL[0], 'per_second': CREATE_RATE_LIMIT_EMAIL[1]}
+        }
+    })
+
+
+job_queue.register('archive_readings', lambda payload, job: archive_readings(
+    store, archive, payload.get('days', ARCHIVE_AFTER_DAYS), ARCHIVE_SEGMENT_SIZE
+))
+
+
+def warm_up():
+    """
+    预热：构建全部服务，计算一张星盘加载星历，预读 gazetteer
+    preload 模式下由 gunicorn master 调用一次，fork 出的 worker 以写时复制共享已导入的模块和数据；
+    swisseph 文件句柄和 SQLite 连接在 fork 前关闭，worker 重新打开时文件页仍在页缓存中
+    """
+    start = time.perf_counter()
+    for service in SERVICES:
+        service.get()
+    calculator.warm_up()
+    cities = resolver.warm_up()
+    STARTUP['warm_up_seconds'] = round(time.perf_counter() - start, 4)
+    metrics.observe('cold_start_seconds', STARTUP['warm_up_seconds'], phase='warm_up')
+    print(f"[INIT] Warm-up done in {STARTUP['warm_up_seconds']}s ({cities} gazetteer entries)")
+    return STARTUP
+
+
+def post_fork():
+    """gunicorn worker fork 之后调用：启动本进程的任务 worker"""
+    STARTUP['pid'] = os.getpid()
+    job_queue.start()
+
+
+# 本进程的冷启动耗时（模块导入 / 预热 / 首次就绪）
+STARTUP = {
+    'pid': os.getpid(),
+    'import_seconds': round(time.perf_counter() - IMPORT_STARTED, 4),
+    'warm_up_seconds': None,
+    'ready_seconds': None
+}
+metrics.observe('cold_start_seconds', STARTUP['import_seconds'], phase='import')
+print(f"[INIT] App imported in {STARTUP['import_seconds']}s")
 
 
 if __name__ == '__main__':
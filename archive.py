@@ -0,0 +1,268 @@
+"""
+已发送旧订单的归档：打包成只追加的压缩段文件，热存储只保留近期订单
+
+每次归档写一个新段（写完即不可变）：
+    segment-<时间>-<pid>.seg   每条订单单独压缩（默认 gzip；ARCHIVE_CODEC=zstd 需另装 zstandard）后首尾相接
+    segment-<时间>-<pid>.idx   文件头 + 按 reading_id 排序的定长条目 (reading_id, offset, length)
+读取时 mmap 索引二分查找，O(log n)；.idx 最后写入，存在即表示该段完整
+
+    python archive.py run --days 90      # 归档 90 天前已发送的订单
+    python archive.py stats
+"""
+import os
+import gzip
+import json
+import mmap
+import time
+import struct
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'RARC'
+VERSION = 1
+CODECS = {'gzip': 1, 'zstd': 2}
+HEADER = struct.Struct('>4sBBxxQ')      # magic, version, codec, 条目数
+ENTRY = struct.Struct('>36sQI')         # reading_id（不足 36 字节补 \0）, offset, length
+ID_SIZE = 36
+
+
+def _key(reading_id):
+    try:
+        key = reading_id.encode('ascii')
+    except UnicodeEncodeError:
+        return None
+    return key.ljust(ID_SIZE, b'\0') if len(key) <= ID_SIZE else None
+
+
+class _Segment:
+    """一个只读段：索引和数据都 mmap，按需解压单条"""
+
+    def __init__(self, index_path):
+        self.name = os.path.basename(index_path)[:-len('.idx')]
+        self._files = []
+        index = self._map(index_path)
+        magic, version, codec, self.count = HEADER.unpack_from(index, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'Not an archive index: {index_path}')
+        self.codec = {v: k for k, v in CODECS.items()}[codec]
+        self._index = index
+        self._data = self._map(index_path[:-len('.idx')] + '.seg') if self.count else b''
+
+    def _map(self, path):
+        f = open(path, 'rb')
+        self._files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _entry(self, i):
+        return ENTRY.unpack_from(self._index, HEADER.size + i * ENTRY.size)
+
+    def find(self, key):
+        """二分查找，返回 (offset, length) 或 None"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = HEADER.size + mid * ENTRY.size
+            if self._index[start:start + ID_SIZE] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count:
+            entry_key, offset, length = self._entry(lo)
+            if entry_key == key:
+                return offset, length
+        return None
+
+    def read(self, offset, length):
+        return json.loads(decompress(self.codec, self._data[offset:offset + length]))
+
+    def close(self):
+        for data in (self._index, self._data):
+            if isinstance(data, mmap.mmap):
+                data.close()
+        for f in self._files:
+            f.close()
+
+
+def compress(codec, data):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=9).compress(data)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def decompress(codec, data):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError("Reading zstd archive segments requires zstandard (pip install zstandard)")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class ReadingArchive:
+    """
+    归档段目录：write_segment() 写入一批订单，get() 在所有段中查找（新段优先）
+    其他进程新写的段在查找未命中时通过目录 mtime 发现
+    """
+
+    def __init__(self, archive_dir, codec=None):
+        self.archive_dir = archive_dir
+        # zstandard 不在 requirements.txt 里，zstd 需要显式开启并自行安装
+        codec = codec or os.getenv('ARCHIVE_CODEC', 'gzip')
+        if codec == 'zstd' and zstandard is None:
+            print("[ARCHIVE] zstandard not installed, compressing new segments with gzip")
+            codec = 'gzip'
+        if codec not in CODECS:
+            raise ValueError(f"Unknown archive codec: {codec}")
+        self.codec = codec
+        self._segments = []
+        self._dir_mtime = None
+        self._lock = threading.Lock()
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def _refresh(self):
+        """目录有变化时打开新出现的段"""
+        mtime = os.stat(self.archive_dir).st_mtime_ns
+        if mtime == self._dir_mtime:
+            return
+        with self._lock:
+            known = {segment.name for segment in self._segments}
+            added = []
+            for filename in sorted(os.listdir(self.archive_dir)):
+                if filename.endswith('.idx') and filename[:-len('.idx')] not in known:
+                    added.append(_Segment(os.path.join(self.archive_dir, filename)))
+            # 段名以时间开头，倒序即新段优先（同一订单被重新归档时取最新版本）
+            self._segments = sorted(self._segments + added, key=lambda s: s.name, reverse=True)
+            self._dir_mtime = mtime
+
+    def get(self, reading_id):
+        key = _key(reading_id)
+        if key is None:
+            return None
+        for attempt in range(2):
+            if attempt or self._dir_mtime is None:
+                self._refresh()
+            for segment in self._segments:
+                found = segment.find(key)
+                if found:
+                    return segment.read(*found)
+        return None
+
+    def write_segment(self, readings):
+        """
+        把一批订单写成一个新段，返回写入的 reading_id 列表
+        reading_id 超过 36 字节的订单跳过（留在热存储）
+        """
+        by_key = {}
+        for reading in readings:
+            key = _key(reading.get('reading_id', ''))
+            if key:
+                by_key[key] = reading
+        records = sorted(by_key.items(), key=lambda item: item[0])
+        if not records:
+            return []
+
+        name = f"segment-{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{os.getpid()}"
+        data_path = os.path.join(self.archive_dir, name + '.seg')
+        index_path = os.path.join(self.archive_dir, name + '.idx')
+        entries = []
+        offset = 0
+        with open(data_path + '.tmp', 'wb') as f:
+            for key, reading in records:
+                blob = compress(self.codec, json.dumps(reading, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+                f.write(blob)
+                entries.append(ENTRY.pack(key, offset, len(blob)))
+                offset += len(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(index_path + '.tmp', 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, CODECS[self.codec], len(entries)))
+            f.write(b''.join(entries))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(data_path + '.tmp', data_path)
+        os.replace(index_path + '.tmp', index_path)
+        return [reading['reading_id'] for _, reading in records]
+
+    def stats(self):
+        self._refresh()
+        segments = list(self._segments)
+        return {
+            'segments': len(segments),
+            'readings': sum(segment.count for segment in segments),
+            'bytes': sum(
+                os.path.getsize(os.path.join(self.archive_dir, segment.name + suffix))
+                for segment in segments for suffix in ('.seg', '.idx')
+            ),
+            'codecs': sorted({segment.codec for segment in segments})
+        }
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
+            self._segments = []
+            self._dir_mtime = None
+
+
+def archive_readings(store, archive, older_than_days=90, segment_size=5000, page_size=500):
+    """
+    把 older_than_days 天前创建且已发送的订单写入归档段，再从热存储删除
+    每段写完并落盘后才删除，中途失败时订单仍在热存储中；返回 {'archived', 'segments', 'seconds'}
+    删除不产生变更记录：增量导出只包含新增和修改，归档的订单不会出现在变更流里
+    """
+    start = time.time()
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).date().isoformat()
+    filters = {'status': 'sent', 'date_to': cutoff}
+    archived = segments = 0
+    while True:
+        batch, cursor = [], None
+        while len(batch) < segment_size:
+            items, cursor = store.list_meta(filters, cursor, min(page_size, segment_size - len(batch)))
+            for item in items:
+                # date_to 按日期包含当天，这里再按精确时间过滤
+                if item['created_at'] >= cutoff:
+                    continue
+                reading = store.get(item['reading_id'])
+                if reading and reading.get('sent'):
+                    batch.append(reading)
+            if not cursor:
+                break
+        if not batch:
+            break
+
+        written = archive.write_segment(batch)
+        store.delete(written)
+        archived += len(written)
+        segments += 1
+        print(f"[ARCHIVE] Wrote segment with {len(written)} readings")
+        if len(written) < len(batch) or not cursor:
+            break
+    return {'archived': archived, 'segments': segments, 'seconds': round(time.time() - start, 2)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive old sent readings into compressed segments')
+    parser.add_argument('command', choices=['run', 'stats'])
+    parser.add_argument('--days', type=int, default=int(os.getenv('ARCHIVE_AFTER_DAYS', 90)))
+    parser.add_argument('--segment-size', type=int, default=int(os.getenv('ARCHIVE_SEGMENT_SIZE', 5000)))
+    parser.add_argument('--dir', default=os.path.join(os.getenv('DATA_DIR', 'data'), 'archive'))
+    parser.add_argument('--readings', default='readings')
+    args = parser.parse_args()
+
+    archive = ReadingArchive(args.dir)
+    if args.command == 'stats':
+        print(json.dumps(archive.stats(), indent=2))
+    else:
+        from dotenv import load_dotenv
+        from storage import create_store
+
+        load_dotenv()
+        result = archive_readings(create_store(readings_dir=args.readings), archive, args.days, args.segment_size)
+        print(json.dumps(result, indent=2))
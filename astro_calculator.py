@@ -1,76 +1,280 @@
-from kerykeion import AstrologicalSubject
-
-class AstroCalculator:
-    """星盘计算器"""
-    
-    def calculate_birth_chart(self, birth_data):
-        """
-        计算星盘
-        birth_data = {
-            'name': 'User',
-            'year': 1990,
-            'month': 5,
-            'day': 15,
-            'hour': 14,
-            'minute': 30,
-            'city': 'New York',
-            'nation': 'US'
-        }
-        """
-        try:
-            # 创建星盘对象
-            person = AstrologicalSubject(
-                birth_data.get('name', 'User'),
-                birth_data['year'],
-                birth_data['month'],
-                birth_data['day'],
-                birth_data['hour'],
-                birth_data['minute'],
-                birth_data['city'],
-                birth_data.get('nation', 'US')
-            )
-            
-            # 提取关键数据
-            chart_data = {
-                'sun': {
-                    'sign': person.sun['sign'],
-                    'degree': round(person.sun['position'], 2),
-                    'house': person.sun.get('house', 'Unknown')
-                },
-                'moon': {
-                    'sign': person.moon['sign'],
-                    'degree': round(person.moon['position'], 2),
-                    'house': person.moon.get('house', 'Unknown')
-                },
-                'venus': {
-                    'sign': person.venus['sign'],
-                    'degree': round(person.venus['position'], 2),
-                    'house': person.venus.get('house', 'Unknown')
-                },
-                'mars': {
-                    'sign': person.mars['sign'],
-                    'degree': round(person.mars['position'], 2),
-                    'house': person.mars.get('house', 'Unknown')
-                },
-                'mercury': {
-                    'sign': person.mercury['sign'],
-                    'degree': round(person.mercury['position'], 2)
-                },
-                'jupiter': {
-                    'sign': person.jupiter['sign'],
-                    'degree': round(person.jupiter['position'], 2)
-                },
-                'rising': {
-                    'sign': person.first_house['sign'],
-                    'degree': round(person.first_house['position'], 2)
-                },
-                'house7': {
-                    'sign': person.seventh_house['sign'],
-                    'degree': round(person.seventh_house['position'], 2)
-                }
-            }
-            
-            return chart_data
-            
-        except Exception as e:
-            raise Exception(f"Birth chart calculation failed: {str(e)}")
\ No newline at end of file
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytz
+import swisseph as swe
+import kerykeion
+from kerykeion import AstrologicalSubject
+
+# 与 kerykeion 保持一致的星座/宫位命名
+SIGNS = np.array(['Ari', 'Tau', 'Gem', 'Can', 'Leo', 'Vir', 'Lib', 'Sco', 'Sag', 'Cap', 'Aqu', 'Pis'])
+HOUSES = np.array([
+    'First_House', 'Second_House', 'Third_House', 'Fourth_House', 'Fifth_House', 'Sixth_House',
+    'Seventh_House', 'Eighth_House', 'Ninth_House', 'Tenth_House', 'Eleventh_House', 'Twelfth_House'
+])
+# chart_data 中的行星及其 swisseph 编号，house=True 表示输出宫位
+BATCH_PLANETS = [
+    ('sun', swe.SUN, True),
+    ('moon', swe.MOON, True),
+    ('venus', swe.VENUS, True),
+    ('mars', swe.MARS, True),
+    ('mercury', swe.MERCURY, False),
+    ('jupiter', swe.JUPITER, False)
+]
+BATCH_CHUNK_SIZE = 500
+BATCH_PARALLEL_THRESHOLD = 200
+
+
+class AstroCalculator:
+    """星盘计算器"""
+
+    def __init__(self, resolver=None, cache=None):
+        # resolver: GeoResolver，提供后城市解析走本地索引，kerykeion 以离线模式运行
+        # cache: ChartCache，相同出生数据直接复用已计算的星盘
+        self.resolver = resolver
+        self.cache = cache
+    
+    def calculate_birth_chart(self, birth_data):
+        """
+        计算星盘
+        birth_data = {
+            'name': 'User',
+            'year': 1990,
+            'month': 5,
+            'day': 15,
+            'hour': 14,
+            'minute': 30,
+            'city': 'New York',
+            'nation': 'US'
+        }
+        """
+        try:
+            location = None
+            if self.resolver:
+                location = self.resolver.resolve(birth_data['city'], birth_data.get('nation', 'US'))
+
+            cache_key = None
+            if self.cache:
+                cache_key = self.cache.make_key(birth_data, location)
+                cached = self.cache.get(cache_key)
+                if cached:
+                    return cached
+
+            # 创建星盘对象
+            if location:
+                person = AstrologicalSubject(
+                    birth_data.get('name', 'User'),
+                    birth_data['year'],
+                    birth_data['month'],
+                    birth_data['day'],
+                    birth_data['hour'],
+                    birth_data['minute'],
+                    location['city'],
+                    location['nation'],
+                    lng=location['lng'],
+                    lat=location['lat'],
+                    tz_str=location['tz_str'],
+                    online=False
+                )
+            else:
+                person = AstrologicalSubject(
+                    birth_data.get('name', 'User'),
+                    birth_data['year'],
+                    birth_data['month'],
+                    birth_data['day'],
+                    birth_data['hour'],
+                    birth_data['minute'],
+                    birth_data['city'],
+                    birth_data.get('nation', 'US')
+                )
+            
+            # 提取关键数据
+            chart_data = {
+                'sun': {
+                    'sign': person.sun['sign'],
+                    'degree': round(person.sun['position'], 2),
+                    'house': person.sun.get('house', 'Unknown')
+                },
+                'moon': {
+                    'sign': person.moon['sign'],
+                    'degree': round(person.moon['position'], 2),
+                    'house': person.moon.get('house', 'Unknown')
+                },
+                'venus': {
+                    'sign': person.venus['sign'],
+                    'degree': round(person.venus['position'], 2),
+                    'house': person.venus.get('house', 'Unknown')
+                },
+                'mars': {
+                    'sign': person.mars['sign'],
+                    'degree': round(person.mars['position'], 2),
+                    'house': person.mars.get('house', 'Unknown')
+                },
+                'mercury': {
+                    'sign': person.mercury['sign'],
+                    'degree': round(person.mercury['position'], 2)
+                },
+                'jupiter': {
+                    'sign': person.jupiter['sign'],
+                    'degree': round(person.jupiter['position'], 2)
+                },
+                'rising': {
+                    'sign': person.first_house['sign'],
+                    'degree': round(person.first_house['position'], 2)
+                },
+                'house7': {
+                    'sign': person.seventh_house['sign'],
+                    'degree': round(person.seventh_house['position'], 2)
+                }
+            }
+
+            if self.cache:
+                self.cache.set(cache_key, chart_data)
+            
+            return chart_data
+            
+        except Exception as e:
+            raise Exception(f"Birth chart calculation failed: {str(e)}")
+
+    def warm_up(self):
+        """
+        预热：计算一张固定坐标的星盘（不经过解析和缓存），把 kerykeion 的内部数据和星历文件读进内存/页缓存
+        随后关闭 swisseph 的文件句柄，避免 fork 出的进程共享同一个文件偏移
+        """
+        AstrologicalSubject(
+            'Warmup', 2000, 1, 1, 12, 0, 'London', 'GB',
+            lng=-0.12574, lat=51.50853, tz_str='Europe/London', online=False
+        )
+        swe.close()
+
+    def calculate_birth_charts(self, records, processes=None):
+        """
+        批量计算星盘，返回与 records 一一对应的 chart_data 列表（失败项为 {'error': ...}）
+        按地点分组，星历在进程池中计算，星座/度数/宫位用 NumPy 数组一次性分配
+        """
+        results = [None] * len(records)
+        groups = {}
+
+        for i, record in enumerate(records):
+            try:
+                if not self.resolver:
+                    # 没有本地解析器时只能逐条走 kerykeion 在线解析
+                    results[i] = self.calculate_birth_chart(record)
+                    continue
+                location = self.resolver.resolve(record['city'], record.get('nation', 'US'))
+                if self.cache:
+                    cached = self.cache.get(self.cache.make_key(record, location))
+                    if cached:
+                        results[i] = cached
+                        continue
+                key = (location['lat'], location['lng'], location['tz_str'])
+                groups.setdefault(key, []).append(i)
+            except Exception as e:
+                results[i] = {'error': str(e)}
+
+        tasks = []
+        for (lat, lng, tz_str), indices in groups.items():
+            for start in range(0, len(indices), BATCH_CHUNK_SIZE):
+                chunk = indices[start:start + BATCH_CHUNK_SIZE]
+                times = [tuple(int(records[i][f]) for f in ('year', 'month', 'day', 'hour', 'minute')) for i in chunk]
+                tasks.append((chunk, (lat, lng, tz_str, times)))
+
+        total = sum(len(chunk) for chunk, _ in tasks)
+        if total >= BATCH_PARALLEL_THRESHOLD and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                outputs = list(pool.map(_compute_chart_chunk, [args for _, args in tasks]))
+        else:
+            outputs = [_compute_chart_chunk(args) for _, args in tasks]
+
+        for (chunk, (lat, lng, tz_str, _)), charts in zip(tasks, outputs):
+            location = {'lat': lat, 'lng': lng, 'tz_str': tz_str}
+            for i, chart_data in zip(chunk, charts):
+                if chart_data is None:
+                    results[i] = {'error': 'Birth chart calculation failed: invalid local time'}
+                    continue
+                if self.cache:
+                    self.cache.set(self.cache.make_key(records[i], location), chart_data)
+                results[i] = chart_data
+
+        return results
+
+
+def _compute_chart_chunk(args):
+    """
+    计算同一地点的一组出生时间（可在子进程中运行）
+    args = (lat, lng, tz_str, [(year, month, day, hour, minute), ...])
+    与 kerykeion.AstrologicalSubject 的计算方式保持一致（回归黄道、Placidus 宫位）
+    """
+    lat, lng, tz_str, times = args
+    swe.set_ephe_path(str(Path(kerykeion.__file__).parent.absolute() / "sweph"))
+
+    # kerykeion 的边界行为：纬度为 0 时回落到伦敦，极圈内截断到 ±66°
+    lat = lat or 51.5074
+    lat = max(-66.0, min(66.0, lat))
+    lng = lng or 0
+
+    tz = pytz.timezone(tz_str)
+    iflag = swe.FLG_SWIEPH + swe.FLG_SPEED
+    valid = []
+    julian_days = []
+    for year, month, day, hour, minute in times:
+        try:
+            local_dt = tz.localize(datetime(year, month, day, hour, minute, 0), is_dst=None)
+        except Exception:
+            valid.append(False)
+            continue
+        utc = local_dt.astimezone(pytz.utc)
+        julian_days.append(float(swe.julday(utc.year, utc.month, utc.day, utc.hour + utc.minute / 60)))
+        valid.append(True)
+
+    n = len(julian_days)
+    longitudes = np.empty((n, len(BATCH_PLANETS)))
+    cusps = np.empty((n, 12))
+    for row, jd in enumerate(julian_days):
+        for col, (_, planet_id, _) in enumerate(BATCH_PLANETS):
+            longitudes[row, col] = swe.calc(jd, planet_id, iflag)[0][0]
+        cusps[row] = swe.houses(jd, lat, lng)[0]
+
+    # 星座与星座内度数
+    sign_idx = np.minimum((longitudes // 30).astype(int), 11)
+    positions = longitudes - 30 * sign_idx
+    cusp_sign_idx = np.minimum((cusps // 30).astype(int), 11)
+    cusp_positions = cusps - 30 * cusp_sign_idx
+
+    # 宫位：与 kerykeion.utilities.check_if_point_between 相同的圆周判断，取第一个命中的宫
+    starts = cusps[:, None, :]
+    ends = np.roll(cusps, -1, axis=1)[:, None, :]
+    points = longitudes[:, :, None]
+    span = np.fmod(ends - starts + 360, 360)
+    offset = np.fmod(points - starts + 360, 360)
+    inside = (span <= 180) != (offset > span)
+    house_idx = np.argmax(inside, axis=2)
+
+    charts = []
+    row = 0
+    for ok in valid:
+        if not ok:
+            charts.append(None)
+            continue
+        chart_data = {}
+        for col, (name, _, with_house) in enumerate(BATCH_PLANETS):
+            chart_data[name] = {
+                'sign': str(SIGNS[sign_idx[row, col]]),
+                'degree': round(float(positions[row, col]), 2)
+            }
+            if with_house:
+                chart_data[name]['house'] = str(HOUSES[house_idx[row, col]]) if inside[row, col].any() else 'Unknown'
+        chart_data['rising'] = {
+            'sign': str(SIGNS[cusp_sign_idx[row, 0]]),
+            'degree': round(float(cusp_positions[row, 0]), 2)
+        }
+        chart_data['house7'] = {
+            'sign': str(SIGNS[cusp_sign_idx[row, 6]]),
+            'degree': round(float(cusp_positions[row, 6]), 2)
+        }
+        charts.append(chart_data)
+        row += 1
+
+    return charts
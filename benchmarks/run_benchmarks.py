@@ -0,0 +1,626 @@
+"""
+压测 / 基准脚本：在本进程里启动 OpenAI / SendGrid 替身服务和完整的 Flask 应用（真实 HTTP），
+按场景施压，输出吞吐、p50/p95/p99 延迟和内存，并与 JSON 基线对比
+
+    python benchmarks/run_benchmarks.py                                  # 全部场景，与 baseline.json 对比
+    python benchmarks/run_benchmarks.py --scenarios create_burst --requests 500 --concurrency 50
+    python benchmarks/run_benchmarks.py --chat-latency lognormal:1500,0.5 --error-rate chat=0.05
+    python benchmarks/run_benchmarks.py --save-baseline                  # 更新 benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --scenarios create_burst --report-format json   # 对比结构化输出模式
+
+场景：
+    create_burst  并发创建报告（星盘 + 流式报告 + 图片，全部走替身服务）
+    admin_100k    10 万订单下的后台页面和分页接口
+    bulk_send     批量发送任务（SendGrid 替身，检查重复发送）
+    cold_start    新进程导入应用 + warm_up() 的耗时
+    synastry_1m   100 万张星盘的合盘索引：加载、匹配接口、增量追加
+    report_cache_warm  report_cache.py warm 命令（独立进程）对着替身服务预热报告缓存
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+import threading
+import contextlib
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.serving import make_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from stub_servers import add_stub_arguments, stub_from_args
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+SCENARIOS = ['create_burst', 'admin_100k', 'bulk_send', 'cold_start', 'synastry_1m', 'report_cache_warm']
+
+# 压测用的小型 gazetteer（GeoNames 格式）：name, country, lat, lng, timezone
+CITIES = [
+    ('New York', 'US', 40.71427, -74.00597, 'America/New_York'),
+    ('Los Angeles', 'US', 34.05223, -118.24368, 'America/Los_Angeles'),
+    ('Chicago', 'US', 41.85003, -87.65005, 'America/Chicago'),
+    ('London', 'GB', 51.50853, -0.12574, 'Europe/London'),
+    ('Paris', 'FR', 48.85341, 2.3488, 'Europe/Paris'),
+    ('Tokyo', 'JP', 35.6895, 139.69171, 'Asia/Tokyo'),
+    ('Sydney', 'AU', -33.86785, 151.20732, 'Australia/Sydney')
+]
+
+# 延迟回归判定的绝对噪声下限（毫秒）
+NOISE_FLOOR_MS = 5.0
+
+
+def log(message):
+    # 应用自身的日志被重定向到文件，进度信息直接写终端
+    sys.__stdout__.write(message + '\n')
+    sys.__stdout__.flush()
+
+
+def percentile(sorted_values, pct):
+    """nearest-rank 百分位"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, wall_seconds, errors=0):
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'errors': errors,
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_rps': round(len(values) / wall_seconds, 2) if wall_seconds else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'max_ms': round(values[-1] * 1000, 2) if values else 0.0
+    }
+
+
+def memory_mb():
+    """(当前 RSS, 峰值 RSS)，单位 MB；包含替身服务和压测线程"""
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return round(int(fields['VmRSS'].split()[0]) / 1024, 1), round(int(fields['VmHWM'].split()[0]) / 1024, 1)
+    except (OSError, KeyError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+        return None, round(peak, 1)
+
+
+def reset_peak_memory():
+    # Linux 上写 5 到 clear_refs 会重置 VmHWM，使峰值按场景统计
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def run_load(request_fn, count, concurrency):
+    """并发执行 request_fn(i)，返回延迟汇总；request_fn 返回 False 记为错误"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            ok = request_fn(i)
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(count)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+class Harness:
+    """替身服务 + 应用服务 + 每线程一个 keep-alive 会话"""
+
+    def __init__(self, args):
+        self.args = args
+        self.workdir = args.workdir or tempfile.mkdtemp(prefix='soulmate-bench-')
+        self.stub = None
+        self.app = None
+        self.server = None
+        self.base_url = None
+        self._local = threading.local()
+
+    def start(self):
+        self.stub = stub_from_args(self.args).start()
+        os.makedirs(self.workdir, exist_ok=True)
+        os.chdir(self.workdir)
+        data_dir = os.path.join(self.workdir, 'data')
+        os.makedirs(data_dir, exist_ok=True)
+
+        gazetteer_path = os.path.join(data_dir, 'gazetteer.db')
+        self._build_gazetteer(gazetteer_path)
+
+        os.environ.update({
+            'DATA_DIR': data_dir,
+            'STORAGE_BACKEND': self.args.storage,
+            'GAZETTEER_PATH': gazetteer_path,
+            'GEOCODER_ONLINE_FALLBACK': 'false',
+            'OPENAI_API_KEY': 'bench',
+            'OPENAI_BASE_URL': self.stub.openai_base_url,
+            'OPENAI_POOL_SIZE': str(self.args.concurrency * 2 + 4),
+            'SENDGRID_API_KEY': 'bench',
+            'SENDGRID_HOST': self.stub.sendgrid_host,
+            'SENDGRID_RATE_PER_SEC': str(self.args.send_rate),
+            'SEND_CONCURRENCY': str(self.args.send_concurrency),
+            'PUBLIC_BASE_URL': '',
+            # 压测流量都来自本机：关闭客户端限流，并发上限与压测并发一致
+            'CREATE_RATE_LIMIT_IP': '0',
+            'CREATE_RATE_LIMIT_EMAIL': '0',
+            'ADMISSION_MAX_INFLIGHT': str(self.args.concurrency)
+        })
+
+        # 环境变量就绪后再导入应用
+        import app as app_module
+        self.app = app_module
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self.server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, name='bench-app', daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+        if self.stub:
+            self.stub.stop()
+
+    @staticmethod
+    def _build_gazetteer(path):
+        from geocoder import Gazetteer
+        source = path + '.txt'
+        with open(source, 'w', encoding='utf-8') as f:
+            for i, (name, country, lat, lng, tz) in enumerate(CITIES):
+                cols = [str(i), name, name, '', str(lat), str(lng), 'P', 'PPLA', country, '', '', '', '', '',
+                        '1000000', '', '', tz, '2024-01-01']
+                f.write('\t'.join(cols) + '\n')
+        Gazetteer.build(source, path)
+
+    @property
+    def session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def get(self, path, **kwargs):
+        return self.session.get(self.base_url + path, timeout=300, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.session.post(self.base_url + path, timeout=300, **kwargs)
+
+    def wait_for_jobs(self, timeout=300):
+        deadline = time.time() + timeout
+        while self.app.job_queue.pending_count() and time.time() < deadline:
+            time.sleep(0.2)
+
+    def upstream_delta(self, before):
+        after = self.stub.snapshot()
+        return {
+            'requests': {k: after['requests'][k] - before['requests'][k] for k in after['requests']},
+            'errors': {k: after['errors'][k] - before['errors'][k] for k in after['errors']},
+            'emails': after['emails'] - before['emails'],
+            'duplicate_emails': after['duplicate_emails'] - before['duplicate_emails']
+        }
+
+
+def scenario_create_burst(h, args):
+    """并发创建报告：每个请求的出生数据都不同，星盘缓存不会命中"""
+    def one(i):
+        name, nation = CITIES[i % len(CITIES)][:2]
+        response = h.post('/api/create-reading', json={
+            'name': f'Bench {i}',
+            'email': f'bench{i}@example.com',
+            'year': 1960 + i % 45,
+            'month': 1 + i % 12,
+            'day': 1 + i % 28,
+            'hour': i % 24,
+            'minute': (i * 7) % 60,
+            'city': name,
+            'nation': nation,
+            'gender': 'female' if i % 2 else 'male',
+            'format': args.report_format
+        })
+        return response.status_code == 200
+
+    before = h.stub.snapshot()
+    result = {'create_reading': run_load(one, args.requests, args.concurrency)}
+    h.wait_for_jobs()
+    result['upstream'] = h.upstream_delta(before)
+    return result
+
+
+def _seed_readings(count, start_index=0, paid_ratio=0.5, sent_ratio=0.3, extra=None):
+    now = datetime.now()
+    rng = random.Random(start_index)
+    for i in range(start_index, start_index + count):
+        reading = {
+            'reading_id': str(uuid.uuid4()),
+            'email': f'user{i}@example.com',
+            'name': f'User {i}',
+            'created_at': (now - timedelta(minutes=rng.randint(0, 365 * 24 * 60))).isoformat(),
+            'paid': rng.random() < paid_ratio,
+            'sent': rng.random() < sent_ratio,
+            'gender': 'female',
+            'preview': {'personality_analysis': 'Seeded reading'}
+        }
+        if extra:
+            reading.update(extra)
+        yield reading
+
+
+def scenario_admin_100k(h, args):
+    """后台：静态页 + 元数据分页接口（首页、筛选、邮箱搜索、深翻页）"""
+    start = time.perf_counter()
+    seeded = h.app.store.import_readings(_seed_readings(args.admin_readings, start_index=10 ** 7))
+    seed_seconds = round(time.perf_counter() - start, 2)
+    log(f"  seeded {seeded} readings in {seed_seconds}s")
+
+    def ok(response):
+        return response.status_code == 200
+
+    result = {
+        'seed': {'readings': seeded, 'seconds': seed_seconds},
+        'admin_page': run_load(lambda i: ok(h.get('/admin')), args.admin_requests, args.concurrency),
+        'first_page': run_load(lambda i: ok(h.get('/api/admin/readings')), args.admin_requests, args.concurrency),
+        'pending_paid_filter': run_load(
+            lambda i: ok(h.get('/api/admin/readings', params={'status': 'pending', 'paid': 'true'})),
+            args.admin_requests, args.concurrency
+        ),
+        'email_search': run_load(
+            lambda i: ok(h.get('/api/admin/readings', params={'email': f'user{10 ** 7 + i * 37}@'})),
+            args.admin_requests, args.concurrency
+        )
+    }
+
+    # 顺序翻页，每页都带上一页返回的 cursor
+    cursor = {'value': None}
+
+    def next_page(i):
+        params = {'limit': 100}
+        if cursor['value']:
+            params['cursor'] = cursor['value']
+        response = h.get('/api/admin/readings', params=params)
+        cursor['value'] = response.json().get('next_cursor')
+        return response.status_code == 200
+
+    result['deep_pagination'] = run_load(next_page, args.admin_pages, 1)
+    return result
+
+
+def scenario_bulk_send(h, args):
+    """批量发送任务：统计每封邮件的发送耗时、总吞吐，以及替身服务看到的重复收件人"""
+    from email_templates import render_report_email
+    from stub_servers import REPORT_TEMPLATE
+
+    report = {name.lower(): content for name, content in REPORT_TEMPLATE.items()}
+    digest = h.app.image_store.put(h.stub._portrait)
+    report['email_image_url'] = h.app.image_url(digest, 'email')
+    payload = render_report_email('Bench', report)
+    readings = list(_seed_readings(
+        args.bulk_readings, start_index=2 * 10 ** 7, paid_ratio=1.0, sent_ratio=0.0,
+        extra={'full_report': report, 'email_payload': payload, 'image_digest': digest}
+    ))
+    for reading in readings:
+        reading['sent'] = False
+    h.app.store.import_readings(readings)
+
+    # 计时包装：run_bulk_send 在调用时按名字查找 deliver_reading
+    original = h.app.deliver_reading
+    latencies = []
+    lock = threading.Lock()
+
+    def timed_deliver(reading_id):
+        start = time.perf_counter()
+        try:
+            return original(reading_id)
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    before = h.stub.snapshot()
+    h.app.deliver_reading = timed_deliver
+    try:
+        start = time.perf_counter()
+        response = h.post('/api/send-reports', json={'reading_ids': [r['reading_id'] for r in readings]})
+        job_url = response.json()['status_url']
+        while True:
+            job = h.get(job_url).json()
+            if job['status'] in ('done', 'failed'):
+                break
+            time.sleep(0.1)
+        wall = time.perf_counter() - start
+    finally:
+        h.app.deliver_reading = original
+
+    summary = job.get('result', {}).get('summary', {})
+    errors = sum(count for status, count in summary.items() if status != 'sent')
+    return {
+        'send': summarize(latencies, wall, errors),
+        'job': {'status': job['status'], 'summary': summary},
+        'upstream': h.upstream_delta(before)
+    }
+
+
+def scenario_cold_start(h, args):
+    """在新的解释器进程里导入应用并预热（与 gunicorn preload 的 master 相同），重复 --cold-starts 次"""
+    snippet = 'import json, app; app.warm_up(); print(json.dumps(app.STARTUP))'
+    env = {**os.environ, 'PYTHONPATH': REPO_ROOT, 'JOB_AUTOSTART': 'false'}
+    imports, warm_ups, processes = [], [], []
+    for _ in range(args.cold_starts):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, '-c', snippet], cwd=h.workdir, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+        processes.append(time.perf_counter() - start)
+        startup = json.loads(output.strip().splitlines()[-1])
+        imports.append(startup['import_seconds'])
+        warm_ups.append(startup['warm_up_seconds'])
+    return {
+        'import': summarize(imports, sum(imports)),
+        'warm_up': summarize(warm_ups, sum(warm_ups)),
+        'process': summarize(processes, sum(processes))
+    }
+
+
+def _random_chart(rng):
+    from synastry import POINTS, SIGNS
+    return {point: {'sign': SIGNS[rng.randrange(12)], 'degree': round(rng.uniform(0, 30), 2)} for point in POINTS}
+
+
+def scenario_synastry_1m(h, args):
+    """合盘索引：直接写入 --synastry-charts 条随机记录，测加载耗时、匹配接口延迟和保存时的增量追加"""
+    import numpy as np
+    from synastry import RECORD, CIRCLE, POINTS
+
+    index = h.app.synastry.get()
+    rng = np.random.default_rng(0)
+    records = np.zeros(args.synastry_charts, dtype=RECORD)
+    records['id'] = np.char.encode(np.char.add('bench-', np.arange(args.synastry_charts).astype(str)), 'ascii')
+    records['lon'] = rng.integers(0, CIRCLE, size=(args.synastry_charts, len(POINTS)), dtype=np.uint16)
+    with open(index.path, 'ab') as f:
+        f.write(records.tobytes())
+
+    start = time.perf_counter()
+    index.refresh()
+    load_seconds = round(time.perf_counter() - start, 3)
+    log(f"  loaded {len(index)} charts in {load_seconds}s")
+
+    chart_rng = random.Random(1)
+    readings = [
+        {**reading, 'chart': _random_chart(chart_rng)}
+        for reading in _seed_readings(args.synastry_queries, start_index=3 * 10 ** 7)
+    ]
+    h.app.store.import_readings(readings)
+
+    def add(i):
+        return index.add(readings[i]['reading_id'], readings[i]['chart']) and index.refresh() is None
+
+    def match(i):
+        response = h.get(f"/api/admin/readings/{readings[i % len(readings)]['reading_id']}/matches")
+        return response.status_code == 200 and len(response.json()['matches']) == 10
+
+    return {
+        'index': {'charts': len(index), 'load_seconds': load_seconds},
+        'add': run_load(add, len(readings), 1),
+        'match': run_load(match, args.synastry_queries, 1)
+    }
+
+
+def scenario_report_cache_warm(h, args):
+    """
+    预热命令：--warm-top 个高频签名（各出现 3 次）+ 同样多的低频签名（各 1 次），
+    第一次运行应只为高频签名各生成 --warm-variants 个版本，第二次运行不再请求上游
+    """
+    from report_cache import ReportCache, chart_signature
+    from storage import SQLiteStore
+
+    warm_dir = os.path.join(h.workdir, 'warm')
+    os.makedirs(warm_dir, exist_ok=True)
+    db_path = os.path.join(warm_dir, 'report_cache.db')
+    readings_path = os.path.join(warm_dir, 'readings.db')
+
+    chart_rng = random.Random(2)
+    charts = {}
+    while len(charts) < args.warm_top * 2:
+        chart = _random_chart(chart_rng)
+        charts.setdefault(chart_signature(chart, 'female'), chart)
+    readings = []
+    for rank, chart in enumerate(charts.values()):
+        copies = 3 if rank < args.warm_top else 1
+        readings += [
+            {**reading, 'chart': chart}
+            for reading in _seed_readings(copies, start_index=4 * 10 ** 7 + rank * 10)
+        ]
+    SQLiteStore(readings_path).import_readings(readings)
+
+    command = [
+        sys.executable, os.path.join(REPO_ROOT, 'report_cache.py'), 'warm',
+        '--top', str(args.warm_top), '--variants', str(args.warm_variants),
+        '--db', db_path, '--base-url', h.stub.openai_base_url, '--format', args.report_format
+    ]
+    env = {**os.environ, 'STORAGE_BACKEND': 'sqlite', 'SQLITE_PATH': readings_path}
+    runs = {}
+    for run in ('cold', 'rerun'):
+        before = h.stub.snapshot()
+        start = time.perf_counter()
+        completed = subprocess.run(command, cwd=warm_dir, env=env, capture_output=True, text=True)
+        runs[run] = (time.perf_counter() - start, completed.returncode, h.upstream_delta(before)['requests'].get('chat', 0))
+        if completed.returncode:
+            log(f"  report_cache.py warm failed:\n{completed.stderr}")
+
+    expected = args.warm_top * args.warm_variants
+    stats = ReportCache(db_path, variants=args.warm_variants).stats()
+    failed = [
+        check for check, ok in (
+            ('exit status', runs['cold'][1] == 0 and runs['rerun'][1] == 0),
+            ('signatures', stats['signatures'] == args.warm_top),
+            ('reports', stats['reports'] == expected),
+            ('chat requests', runs['cold'][2] == expected),
+            ('rerun chat requests', runs['rerun'][2] == 0)
+        ) if not ok
+    ]
+    for check in failed:
+        log(f"  report cache warm check failed: {check}")
+    return {
+        'cold': summarize([runs['cold'][0]], runs['cold'][0], len(failed)),
+        'rerun': summarize([runs['rerun'][0]], runs['rerun'][0]),
+        'cache': {**stats, 'chat_requests': runs['cold'][2], 'rerun_chat_requests': runs['rerun'][2]}
+    }
+
+
+SCENARIO_FUNCTIONS = {
+    'create_burst': scenario_create_burst,
+    'admin_100k': scenario_admin_100k,
+    'bulk_send': scenario_bulk_send,
+    'cold_start': scenario_cold_start,
+    'synastry_1m': scenario_synastry_1m,
+    'report_cache_warm': scenario_report_cache_warm
+}
+
+
+def compare(results, baseline, tolerance):
+    """与基线对比：吞吐下降或 p95 上升超过 tolerance 记为回归"""
+    regressions = []
+    for scenario, measurements in results.items():
+        for name, current in measurements.items():
+            base = baseline.get('results', {}).get(scenario, {}).get(name)
+            if not isinstance(base, dict) or 'p95_ms' not in base or 'p95_ms' not in current:
+                continue
+            if current['p95_ms'] > base['p95_ms'] * (1 + tolerance) and current['p95_ms'] - base['p95_ms'] > NOISE_FLOOR_MS:
+                regressions.append(f"{scenario}.{name}: p95 {base['p95_ms']}ms -> {current['p95_ms']}ms")
+            if base['throughput_rps'] and current['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+                regressions.append(
+                    f"{scenario}.{name}: throughput {base['throughput_rps']}/s -> {current['throughput_rps']}/s"
+                )
+            if current['errors'] > base['errors']:
+                regressions.append(f"{scenario}.{name}: errors {base['errors']} -> {current['errors']}")
+    return regressions
+
+
+def print_table(results):
+    log(f"{'measurement':<36}{'count':>7}{'err':>5}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for scenario, measurements in results.items():
+        for name, m in measurements.items():
+            if isinstance(m, dict) and 'p95_ms' in m:
+                log(f"{scenario + '.' + name:<36}{m['count']:>7}{m['errors']:>5}{m['throughput_rps']:>10}"
+                    f"{m['p50_ms']:>10}{m['p95_ms']:>10}{m['p99_ms']:>10}")
+        memory = measurements.get('memory', {})
+        log(f"{scenario + '.memory':<36} rss {memory.get('rss_mb')} MB, peak {memory.get('peak_mb')} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Soulmate backend benchmarks against local stand-ins')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='create_burst request count')
+    parser.add_argument('--report-format', default='markdown', choices=['markdown', 'json'],
+                        help='Report output format requested by create_burst')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--admin-readings', type=int, default=100000)
+    parser.add_argument('--admin-requests', type=int, default=200)
+    parser.add_argument('--admin-pages', type=int, default=100)
+    parser.add_argument('--bulk-readings', type=int, default=1000)
+    parser.add_argument('--send-rate', type=float, default=500, help='SENDGRID_RATE_PER_SEC for the app')
+    parser.add_argument('--send-concurrency', type=int, default=16)
+    parser.add_argument('--cold-starts', type=int, default=5, help='cold_start process count')
+    parser.add_argument('--synastry-charts', type=int, default=1000000)
+    parser.add_argument('--synastry-queries', type=int, default=50)
+    parser.add_argument('--warm-top', type=int, default=10, help='report_cache_warm signature count')
+    parser.add_argument('--warm-variants', type=int, default=3)
+    parser.add_argument('--storage', default='sqlite', choices=['sqlite', 'json'])
+    parser.add_argument('--workdir', help='Scratch directory (default: a new temp dir)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--output', help='Also write the results JSON here')
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIO_FUNCTIONS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    harness = Harness(args)
+    app_log = io.StringIO()
+    results = {}
+    with contextlib.redirect_stdout(app_log):
+        harness.start()
+        log(f"[BENCH] app {harness.base_url}, stubs {harness.stub.url}, workdir {harness.workdir}")
+        try:
+            for scenario in scenarios:
+                log(f"[BENCH] {scenario}")
+                reset_peak_memory()
+                results[scenario] = SCENARIO_FUNCTIONS[scenario](harness, args)
+                rss, peak = memory_mb()
+                results[scenario]['memory'] = {'rss_mb': rss, 'peak_mb': peak}
+        finally:
+            harness.stop()
+
+    with open(os.path.join(harness.workdir, 'app.log'), 'w', encoding='utf-8') as f:
+        f.write(app_log.getvalue())
+
+    print_table(results)
+    report = {
+        'generated_at': datetime.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'config': {k: v for k, v in vars(args).items() if k not in ('baseline', 'save_baseline', 'output', 'workdir')},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        log(f"[BENCH] Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        log("[BENCH] No baseline to compare against (run with --save-baseline)")
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('config') != report['config']:
+        log("[BENCH] Warning: baseline was recorded with a different configuration")
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        log(f"[REGRESSION] {regression}")
+    if not regressions:
+        log(f"[BENCH] No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""
+本地压测用的 OpenAI / SendGrid 替身服务
+
+    python benchmarks/stub_servers.py --port 8900 --chat-latency lognormal:800,0.4 --error-rate chat=0.02
+
+然后把服务指向它：
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 SENDGRID_HOST=http://127.0.0.1:8900
+
+延迟写法（毫秒）：fixed:100 / uniform:200,900 / lognormal:中位数,sigma
+"""
+import io
+import re
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+# 与 ReportGenerator 的 ## SECTION ## 格式一致的固定报告
+REPORT_TEMPLATE = {
+    'PERSONALITY_ANALYSIS': 'You love with quiet intensity and a need for emotional honesty. Your chart favors slow trust that becomes unshakable.',
+    'LOVE_APPROACH': 'You notice small gestures before grand ones. You test the waters with humor, then commit fully once you feel safe. Consistency matters more to you than fireworks. You give generously and expect the same care in return.',
+    'SOULMATE_APPEARANCE': 'Tall with an easy posture and dark, slightly unruly hair. Warm brown eyes that crinkle when they laugh. A strong jawline softened by a ready smile. Dresses simply but with one signature detail, like a vintage watch.',
+    'SOULMATE_PERSONALITY': 'Patient. Curious. Loyal. Dry sense of humor. Protective without being controlling. Quietly ambitious.',
+    'SOULMATE_CAREER': 'Architecture. Music production. Medicine. Environmental science. Independent consulting.',
+    'MEETING_PLACES': 'A friend\'s dinner party. A bookstore cafe. A weekend hiking trail. A live music venue. A volunteering event. An airport lounge.',
+    'BEST_TIMING': 'Late April brings an unexpected introduction. Early September deepens a connection that began casually.',
+    'COMPATIBILITY_TIPS': 'Say what you need instead of hinting. Make room for their solitude. Plan small rituals together. Celebrate progress, not perfection.'
+}
+REPORT_TEXT = '\n'.join(f'## {name} ##\n{content}' for name, content in REPORT_TEMPLATE.items())
+
+_WORD_BUDGET = re.compile(r'At most (\d+) words')
+
+
+def structured_report(schema, missing_rate=0.0):
+    """按 response_format 的 JSON schema 返回结构化报告：每段按 description 里的字数上限截断，
+    missing_rate 的概率把某段留空（模拟模型漏写，触发补请求）"""
+    report = {}
+    for name, spec in schema.get('properties', {}).items():
+        words = REPORT_TEMPLATE.get(name.upper(), '').split(' ')
+        budget = _WORD_BUDGET.search(spec.get('description', ''))
+        if budget:
+            words = words[:int(budget.group(1))]
+        report[name] = '' if random.random() < missing_rate else ' '.join(words)
+    return json.dumps(report)
+
+
+def parse_latency(spec):
+    """把延迟写法解析成返回秒数的函数"""
+    if not spec:
+        return lambda: 0.0
+    kind, _, args = str(spec).partition(':')
+    if not args:
+        kind, args = 'fixed', kind
+    values = [float(v) for v in args.split(',')]
+    if kind == 'fixed':
+        return lambda: values[0] / 1000
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == 'lognormal':
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma) / 1000
+    raise ValueError(f'Unknown latency spec: {spec}')
+
+
+def _portrait_png():
+    bands = [Image.linear_gradient('L'), Image.radial_gradient('L'), Image.linear_gradient('L').rotate(90)]
+    image = Image.merge('RGB', [band.resize((1024, 1024)) for band in bands])
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端关闭 keep-alive 连接属于正常情况
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+class StubServer:
+    """
+    在后台线程里运行的替身服务：
+    POST /v1/chat/completions（含 stream=true 的 SSE）、POST /v1/images/generations、
+    GET /files/portrait.png、POST /v3/mail/send
+    每个路由可单独配置延迟分布和错误率
+    """
+
+    ROUTES = ('chat', 'image', 'file', 'sendgrid')
+
+    def __init__(self, host='127.0.0.1', port=0, latency=None, token_delay=None, error_rate=None,
+                 error_status=500, retry_after=None, json_missing_rate=0.0):
+        latency = latency or {}
+        error_rate = error_rate or {}
+        self.latency = {route: parse_latency(latency.get(route)) for route in self.ROUTES}
+        self.token_delay = parse_latency(token_delay)
+        self.error_rate = {route: float(error_rate.get(route, 0)) for route in self.ROUTES}
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.json_missing_rate = json_missing_rate
+        self.counts = {route: 0 for route in self.ROUTES}
+        self.errors = {route: 0 for route in self.ROUTES}
+        self.recipients = []
+        self._lock = threading.Lock()
+        self._portrait = _portrait_png()
+        self._server = _QuietServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def openai_base_url(self):
+        return f'{self.url}/v1'
+
+    @property
+    def sendgrid_host(self):
+        return self.url
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': dict(self.counts),
+                'errors': dict(self.errors),
+                'emails': len(self.recipients),
+                'duplicate_emails': len(self.recipients) - len(set(self.recipients))
+            }
+
+    def _chat_content(self, body):
+        response_format = body.get('response_format') or {}
+        if response_format.get('type') == 'json_schema':
+            return structured_report(response_format['json_schema']['schema'], self.json_missing_rate)
+        return REPORT_TEXT
+
+    def _begin(self, route):
+        """记一次请求，按配置等待；返回是否应当返回错误"""
+        with self._lock:
+            self.counts[route] += 1
+        time.sleep(self.latency[route]())
+        failed = random.random() < self.error_rate[route]
+        if failed:
+            with self._lock:
+                self.errors[route] += 1
+        return failed
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def _send(self, status, body=b'', content_type='application/json', headers=None):
+                if isinstance(body, (dict, list)):
+                    body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _error(self):
+                headers = {}
+                if stub.retry_after is not None:
+                    headers['Retry-After'] = str(stub.retry_after)
+                self._send(stub.error_status, {'error': {'message': 'stub error'}}, headers=headers)
+
+            def _chunk(self, data):
+                self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                self.wfile.flush()
+
+            def do_POST(self):
+                if self.path == '/v1/chat/completions':
+                    body = self._body()
+                    if stub._begin('chat'):
+                        return self._error()
+                    content = stub._chat_content(body)
+                    if body.get('stream'):
+                        return self._stream_chat(content)
+                    time.sleep(sum(stub.token_delay() for _ in content.split(' ')))
+                    return self._send(200, {
+                        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}}]
+                    })
+
+                if self.path == '/v1/images/generations':
+                    self._body()
+                    if stub._begin('image'):
+                        return self._error()
+                    return self._send(200, {'data': [{'url': f'{stub.url}/files/portrait.png?{random.random()}'}]})
+
+                if self.path == '/v3/mail/send':
+                    body = self._body()
+                    if stub._begin('sendgrid'):
+                        return self._error()
+                    for personalization in body.get('personalizations', []):
+                        with stub._lock:
+                            stub.recipients.extend(to['email'] for to in personalization.get('to', []))
+                    return self._send(202)
+
+                self._send(404, {'error': 'not found'})
+
+            def do_GET(self):
+                if self.path.startswith('/files/portrait.png'):
+                    if stub._begin('file'):
+                        return self._error()
+                    return self._send(200, stub._portrait, content_type='image/png')
+                self._send(404, {'error': 'not found'})
+
+            def _stream_chat(self, content):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                words = content.split(' ')
+                for i, word in enumerate(words):
+                    delta = word if i == len(words) - 1 else word + ' '
+                    event = {'choices': [{'index': 0, 'delta': {'content': delta}}]}
+                    self._chunk(f'data: {json.dumps(event)}\n\n'.encode())
+                    time.sleep(stub.token_delay())
+                self._chunk(b'data: [DONE]\n\n')
+                self._chunk(b'')
+
+        return Handler
+
+
+def parse_route_values(items):
+    """chat=0.02 image=0.1 -> {'chat': '0.02', 'image': '0.1'}"""
+    values = {}
+    for item in items or []:
+        route, _, value = item.partition('=')
+        values[route] = value
+    return values
+
+
+def add_stub_arguments(parser):
+    parser.add_argument('--chat-latency', default='lognormal:400,0.3', help='Time to first token (ms)')
+    parser.add_argument('--token-delay', default='fixed:1', help='Delay between streamed words (ms)')
+    parser.add_argument('--image-latency', default='lognormal:1500,0.3')
+    parser.add_argument('--sendgrid-latency', default='lognormal:80,0.3')
+    parser.add_argument('--error-rate', nargs='*', default=[], help='route=fraction, e.g. chat=0.02 sendgrid=0.01')
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--retry-after', type=float, default=None, help='Retry-After seconds sent with errors')
+    parser.add_argument('--json-missing-rate', type=float, default=0.0,
+                        help='Chance that a structured-output section comes back empty')
+
+
+def stub_from_args(args, host='127.0.0.1', port=0):
+    return StubServer(
+        host=host,
+        port=port,
+        latency={'chat': args.chat_latency, 'image': args.image_latency, 'sendgrid': args.sendgrid_latency},
+        token_delay=args.token_delay,
+        error_rate=parse_route_values(args.error_rate),
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        json_missing_rate=args.json_missing_rate
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='OpenAI / SendGrid stand-ins for load testing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    stub = stub_from_args(args, args.host, args.port).start()
+    print(f"[STUB] Listening on {stub.url}")
+    print(f"[STUB] OPENAI_BASE_URL={stub.openai_base_url} SENDGRID_HOST={stub.sendgrid_host}")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"[STUB] {json.dumps(stub.snapshot())}")
+    except KeyboardInterrupt:
+        stub.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
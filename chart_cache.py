@@ -0,0 +1,141 @@
+import os
+import json
+import copy
+import time
+import random
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class ChartCache:
+    """
+    星盘结果缓存：进程内 LRU + 可选的共享磁盘层（SQLite，所有 worker 可读写）
+    磁盘层最多保留 max_disk_entries 条，按最近使用时间淘汰最旧的
+    """
+
+    def __init__(self, max_entries=4096, disk_path=None, metrics=None, max_disk_entries=200000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.disk_path = disk_path
+        self.metrics = metrics
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if disk_path:
+            disk_dir = os.path.dirname(disk_path)
+            if disk_dir:
+                os.makedirs(disk_dir, exist_ok=True)
+            conn = self._connect()
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS charts (key TEXT PRIMARY KEY, chart TEXT NOT NULL)")
+                # 淘汰用的最近使用时间（旧库补列，已有条目视为最旧）
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(charts)")}
+                if 'last_used' not in columns:
+                    try:
+                        conn.execute("ALTER TABLE charts ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+                    except sqlite3.OperationalError:
+                        pass
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_charts_used ON charts (last_used)")
+            finally:
+                conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.disk_path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def make_key(birth_data, location=None):
+        """归一化的缓存键：出生时间 + 解析后的地点"""
+        parts = [int(birth_data[f]) for f in ('year', 'month', 'day', 'hour', 'minute')]
+        if location:
+            parts += [round(float(location['lat']), 4), round(float(location['lng']), 4), location['tz_str']]
+        else:
+            parts += [' '.join(str(birth_data['city']).lower().split()), str(birth_data.get('nation', 'US')).upper()]
+        return '|'.join(str(p) for p in parts)
+
+    def get(self, key):
+        with self._lock:
+            chart = self._memory.get(key)
+            if chart is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+        if chart is not None:
+            self._record('memory_hit')
+            return copy.deepcopy(chart)
+
+        if self.disk_path:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT chart FROM charts WHERE key = ?", (key,)).fetchone()
+                if row:
+                    conn.execute("UPDATE charts SET last_used = ? WHERE key = ?", (time.time(), key))
+            finally:
+                conn.close()
+            if row:
+                chart = json.loads(row[0])
+                with self._lock:
+                    self.disk_hits += 1
+                self._record('disk_hit')
+                self._remember(key, chart)
+                return copy.deepcopy(chart)
+
+        with self._lock:
+            self.misses += 1
+        self._record('miss')
+        return None
+
+    def _record(self, result):
+        if self.metrics:
+            self.metrics.inc('cache_lookups_total', cache='chart', result=result)
+
+    def set(self, key, chart):
+        self._remember(key, copy.deepcopy(chart))
+        if self.disk_path:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO charts (key, chart, last_used) VALUES (?, ?, ?)",
+                    (key, json.dumps(chart, ensure_ascii=False), time.time())
+                )
+            finally:
+                conn.close()
+            # 写入时偶尔做一次淘汰，避免单独的定时任务
+            if random.random() < 0.01:
+                self.evict()
+
+    def evict(self):
+        """磁盘层超出上限时按最近使用时间删除最旧的条目"""
+        if not self.disk_path:
+            return
+        conn = self._connect()
+        try:
+            conn.execute(
+                "DELETE FROM charts WHERE key IN ("
+                "SELECT key FROM charts ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,)
+            )
+        finally:
+            conn.close()
+
+    def _remember(self, key, chart):
+        with self._lock:
+            self._memory[key] = chart
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'pid': os.getpid(),
+                'entries': len(self._memory),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+            }
@@ -2,26 +2,32 @@ from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail, Email, To, Content
 import os
 
+from email_templates import render_report_email
+
 class EmailSender:
     """邮件发送服务"""
     
-    def __init__(self, api_key=None, from_email=None):
+    def __init__(self, api_key=None, from_email=None, host=None):
         self.api_key = api_key or os.getenv('SENDGRID_API_KEY')
         self.from_email = from_email or os.getenv('FROM_EMAIL', 'noreply@soulmate.app')
-        self.sg = SendGridAPIClient(self.api_key)
+        # host 可指向本地压测桩服务
+        self.host = host or os.getenv('SENDGRID_HOST') or 'https://api.sendgrid.com'
+        self.sg = SendGridAPIClient(self.api_key, host=self.host)
     
     def send_full_report(self, to_email, name, report_data, chart_data):
         """发送完整报告"""
         
-        subject = f"Your Soulmate Reading is Ready, {name}!"
-        
-        html_content = self._build_email_html(name, report_data, chart_data)
+        return self.send_payload(to_email, render_report_email(name, report_data))
+
+    def send_payload(self, to_email, payload):
+        """发送已渲染好的邮件 {'subject', 'html', 'text'}（可在订单创建时预渲染）"""
         
         message = Mail(
             from_email=Email(self.from_email),
             to_emails=To(to_email),
-            subject=subject,
-            html_content=Content("text/html", html_content)
+            subject=payload['subject'],
+            plain_text_content=Content("text/plain", payload['text']),
+            html_content=Content("text/html", payload['html'])
         )
         
         try:
@@ -33,102 +39,5 @@ class EmailSender:
             return False
     
     def _build_email_html(self, name, report_data, chart_data):
-        """构建邮件HTML"""
-        return f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-    <style>
-        body {{
-            font-family: Georgia, serif;
-            line-height: 1.8;
-            color: #333;
-            max-width: 600px;
-            margin: 0 auto;
-            padding: 20px;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        }}
-        .container {{
-            background: white;
-            border-radius: 12px;
-            padding: 40px;
-            box-shadow: 0 10px 40px rgba(0,0,0,0.2);
-        }}
-        h1 {{
-            color: #667eea;
-            text-align: center;
-            font-size: 32px;
-            margin-bottom: 10px;
-        }}
-        .section {{
-            margin: 30px 0;
-        }}
-        .section-title {{
-            color: #667eea;
-            font-size: 20px;
-            font-weight: bold;
-            margin-bottom: 15px;
-        }}
-        img {{
-            max-width: 100%;
-            border-radius: 12px;
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>Your Soulmate Reading</h1>
-        <p style="text-align:center">Personalized for {name}</p>
-        
-        <div style="text-align:center; margin:20px 0">
-            <img src="{report_data['hd_image_url']}" alt="Soulmate Portrait">
-        </div>
-        
-        <div class="section">
-            <div class="section-title">Your Love Style</div>
-            <p>{report_data['personality_analysis']}</p>
-        </div>
-        
-        <div class="section">
-            <div class="section-title">How You Approach Love</div>
-            <p>{report_data['love_approach']}</p>
-        </div>
-        
-        <div class="section">
-            <div class="section-title">Physical Appearance</div>
-            <p>{report_data['soulmate_appearance']}</p>
-        </div>
-        
-        <div class="section">
-            <div class="section-title">Personality Traits</div>
-            <p>{report_data['soulmate_personality']}</p>
-        </div>
-        
-        <div class="section">
-            <div class="section-title">Career and Lifestyle</div>
-            <p>{report_data['soulmate_career']}</p>
-        </div>
-        
-        <div class="section">
-            <div class="section-title">Where You Will Meet</div>
-            <p>{report_data['meeting_places']}</p>
-        </div>
-        
-        <div class="section">
-            <div class="section-title">Best Timing in 2025</div>
-            <p>{report_data['best_timing']}</p>
-        </div>
-        
-        <div class="section">
-            <div class="section-title">Compatibility Tips</div>
-            <p>{report_data['compatibility_tips']}</p>
-        </div>
-        
-        <p style="text-align:center; color:#888; margin-top:40px">
-            2025 Soulmate Astrology
-        </p>
-    </div>
-</body>
-</html>
-        """
+        """构建邮件HTML（模板在启动时已编译）"""
+        return render_report_email(name, report_data)['html']
@@ -0,0 +1,177 @@
+import re
+import html
+from string import Template
+
+# 邮件里展示的报告段落（字段名, 标题）
+EMAIL_SECTIONS = [
+    ('personality_analysis', 'Your Love Style'),
+    ('love_approach', 'How You Approach Love'),
+    ('soulmate_appearance', 'Physical Appearance'),
+    ('soulmate_personality', 'Personality Traits'),
+    ('soulmate_career', 'Career and Lifestyle'),
+    ('meeting_places', 'Where You Will Meet'),
+    ('best_timing', 'Best Timing in 2025'),
+    ('compatibility_tips', 'Compatibility Tips')
+]
+
+EMAIL_CSS = """
+body {
+    font-family: Georgia, serif;
+    line-height: 1.8;
+    color: #333;
+    max-width: 600px;
+    margin: 0 auto;
+    padding: 20px;
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+}
+.container {
+    background: white;
+    border-radius: 12px;
+    padding: 40px;
+    box-shadow: 0 10px 40px rgba(0,0,0,0.2);
+}
+h1 {
+    color: #667eea;
+    text-align: center;
+    font-size: 32px;
+    margin-bottom: 10px;
+}
+.section {
+    margin: 30px 0;
+}
+.section-title {
+    color: #667eea;
+    font-size: 20px;
+    font-weight: bold;
+    margin-bottom: 15px;
+}
+img {
+    max-width: 100%;
+    border-radius: 12px;
+}
+"""
+
+EMAIL_LAYOUT = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+</head>
+<body>
+    <div class="container">
+        <h1>Your Soulmate Reading</h1>
+        <p style="text-align:center">Personalized for $name</p>
+
+        <div style="text-align:center; margin:20px 0">
+            <img src="$image_url" alt="Soulmate Portrait">
+        </div>
+        $sections
+        <p style="text-align:center; color:#888; margin-top:40px">
+            2025 Soulmate Astrology
+        </p>
+    </div>
+</body>
+</html>
+"""
+
+SECTION_LAYOUT = """
+        <div class="section">
+            <div class="section-title">$title</div>
+            <p>$content</p>
+        </div>
+"""
+
+
+def minify_css(css):
+    """去掉注释和多余空白"""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{}:;,])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def parse_css(css):
+    """把简单选择器（tag / .class）的规则解析成 {selector: declarations}"""
+    rules = {}
+    for selector, body in re.findall(r'([^{}]+)\{([^}]*)\}', minify_css(css)):
+        for sel in selector.split(','):
+            sel = sel.strip()
+            rules[sel] = (rules.get(sel, '') + ';' + body).strip(';')
+    return rules
+
+
+def inline_css(markup, css):
+    """编译期把 CSS 规则写进元素的 style 属性（邮件客户端普遍不支持 <style>）"""
+    rules = parse_css(css)
+
+    def apply(match):
+        tag, attrs = match.group(1), match.group(2) or ''
+        declarations = []
+        if tag in rules:
+            declarations.append(rules[tag])
+        class_match = re.search(r'class="([^"]*)"', attrs)
+        if class_match:
+            for cls in class_match.group(1).split():
+                if f'.{cls}' in rules:
+                    declarations.append(rules[f'.{cls}'])
+        if not declarations:
+            return match.group(0)
+
+        style_match = re.search(r'style="([^"]*)"', attrs)
+        if style_match:
+            # 元素自带的 style 优先级最高，放在最后
+            declarations.append(minify_css(style_match.group(1)))
+            attrs = attrs.replace(style_match.group(0), '')
+        attrs = re.sub(r'\s*class="[^"]*"', '', attrs)
+        style = ';'.join(d for d in declarations if d)
+        return f'<{tag}{attrs.rstrip()} style="{style}">'
+
+    return re.sub(r'<([a-z0-9]+)((?:\s[^<>]*?)?)\s*/?>', apply, markup)
+
+
+def minify_html(markup):
+    markup = re.sub(r'>\s+<', '><', markup)
+    # 占位符两侧的空白也去掉
+    markup = re.sub(r'>\s+(\$\w+)\s+<', r'>\1<', markup)
+    return markup.strip()
+
+
+def _compile(markup):
+    return Template(minify_html(inline_css(markup, EMAIL_CSS)))
+
+
+# 启动时编译一次
+COMPILED_LAYOUT = _compile(EMAIL_LAYOUT)
+COMPILED_SECTION = _compile(SECTION_LAYOUT)
+
+
+def _escape(text):
+    return html.escape(str(text or '')).replace('\n', '<br>')
+
+
+def render_report_email(name, report_data):
+    """渲染完整报告邮件，返回 {'subject', 'html', 'text'}"""
+    # 图片已本地化时使用邮件尺寸的派生图
+    image_url = report_data.get('email_image_url') or report_data.get('hd_image_url') or ''
+    sections = ''.join(
+        COMPILED_SECTION.substitute(title=html.escape(title), content=_escape(report_data.get(field)))
+        for field, title in EMAIL_SECTIONS
+    )
+    html_content = COMPILED_LAYOUT.substitute(
+        name=_escape(name),
+        image_url=html.escape(image_url, quote=True),
+        sections=sections
+    )
+
+    text_parts = ["Your Soulmate Reading", f"Personalized for {name}", '']
+    if image_url:
+        text_parts += [f"Soulmate portrait: {image_url}", '']
+    for field, title in EMAIL_SECTIONS:
+        text_parts += [title.upper(), str(report_data.get(field) or ''), '']
+    text_parts.append('2025 Soulmate Astrology')
+
+    return {
+        'subject': f"Your Soulmate Reading is Ready, {name}!",
+        'html': html_content,
+        'text': '\n'.join(text_parts)
+    }
@@ -0,0 +1,208 @@
+"""
+订单流式导出（NDJSON / CSV），供数据分析与对账
+
+整条链路都是生成器：元数据分页 -> 按需读取完整订单 -> 字段投影 -> 编码成行 -> 合并成块，
+内存占用与订单总数无关。只投影元数据列时不读取报告正文
+
+全量导出按创建时间倒序；增量导出（since=变更游标）按变更序号升序，只导出游标之后新增或修改的订单，
+导出开始时取当前最大序号作为本次的上界和下一次的游标。变更流只记录新增和修改：
+删除（包括归档时从热存储移走）不产生变更记录，下游需要时用全量导出对账
+
+    python export.py --format csv --fields email,created_at,paid,sent,signs --from 2025-01-01 > readings.csv
+    python export.py --since-file data/export.cursor > changes.ndjson   # 增量：读取并更新游标文件
+"""
+import io
+import os
+import re
+import csv
+import sys
+import json
+import argparse
+
+from storage import COLUMN_FIELDS
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+CHART_POINTS = ['sun', 'moon', 'venus', 'mars', 'mercury', 'jupiter', 'rising', 'house7']
+# 字段简写：signs 展开为各点的星座
+FIELD_PRESETS = {
+    'signs': [f'chart.{point}.sign' for point in CHART_POINTS]
+}
+FIELD_PATTERN = re.compile(r'^[A-Za-z0-9_]+(\.[A-Za-z0-9_]+)*$')
+# 不需要读取完整订单的字段（change_seq 仅增量导出时有值）
+META_FIELDS = set(COLUMN_FIELDS) | {'change_seq'}
+CHUNK_SIZE = 64 * 1024
+PAGE_SIZE = 500
+
+
+def parse_fields(spec):
+    """'email,created_at,signs' -> 字段列表（点号表示嵌套路径）；为空时导出全部元数据列"""
+    if not spec:
+        return list(COLUMN_FIELDS)
+    fields = []
+    for name in (part.strip() for part in spec.split(',')):
+        if not name:
+            continue
+        if not FIELD_PATTERN.match(name):
+            raise ValueError(f'Invalid field: {name}')
+        for field in FIELD_PRESETS.get(name, [name]):
+            if field not in fields:
+                fields.append(field)
+    if not fields:
+        raise ValueError('No fields to export')
+    return fields
+
+
+def project(reading, fields):
+    """按字段路径取值，缺失的字段为 None"""
+    record = {}
+    for field in fields:
+        value = reading
+        for key in field.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        record[field] = value
+    return record
+
+
+def iter_meta(store, filters=None, page_size=PAGE_SIZE):
+    """全量：按创建时间倒序逐页读取元数据"""
+    cursor = None
+    while True:
+        items, cursor = store.list_meta(filters, cursor, page_size)
+        yield from items
+        if not cursor:
+            return
+
+
+def iter_changes(store, since, until, filters=None, page_size=PAGE_SIZE):
+    """增量：按变更序号升序读取 (since, until] 之间的元数据"""
+    while True:
+        items = store.list_changes(since, until, filters, page_size)
+        yield from items
+        if len(items) < page_size:
+            return
+        since = items[-1]['change_seq']
+
+
+def iter_records(store, fields, filters=None, since=None, until=None, page_size=PAGE_SIZE):
+    """投影后的订单字典；导出过程中被删除（归档）的订单跳过"""
+    if since is None:
+        items = iter_meta(store, filters, page_size)
+    else:
+        items = iter_changes(store, since, until, filters, page_size)
+    needs_body = any(field not in META_FIELDS for field in fields)
+    for item in items:
+        if needs_body:
+            reading = store.get(item['reading_id'])
+            if reading is None:
+                continue
+            reading['change_seq'] = item.get('change_seq')
+        else:
+            reading = item
+        yield project(reading, fields)
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    return value
+
+
+def csv_lines(records, fields):
+    """表头 + 每条一行；嵌套值编码为 JSON 字符串"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def take(row):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        return buffer.getvalue()
+
+    yield take(fields)
+    for record in records:
+        yield take([csv_value(record[field]) for field in fields])
+
+
+def chunked(lines, size=CHUNK_SIZE):
+    """把小行合并成约 size 字节的块，减少写出次数"""
+    parts, length = [], 0
+    for line in lines:
+        parts.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(parts)
+            parts, length = [], 0
+    if parts:
+        yield ''.join(parts)
+
+
+def export_chunks(store, fmt='ndjson', fields=None, filters=None, since=None, until=None):
+    """导出管道：返回文本块生成器"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid format: {fmt}. Expected one of: {', '.join(EXPORT_FORMATS)}")
+    fields = fields or list(COLUMN_FIELDS)
+    records = iter_records(store, fields, filters, since, until)
+    lines = ndjson_lines(records) if fmt == 'ndjson' else csv_lines(records, fields)
+    return chunked(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stream readings as NDJSON or CSV')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson')
+    parser.add_argument('--fields', help='Comma-separated fields, dotted paths or presets (signs)')
+    parser.add_argument('--status', choices=['pending', 'sent'])
+    parser.add_argument('--paid', choices=['true', 'false'])
+    parser.add_argument('--from', dest='date_from', help='YYYY-MM-DD')
+    parser.add_argument('--to', dest='date_to', help='YYYY-MM-DD')
+    parser.add_argument('--since', type=int, help='Export only readings changed after this cursor')
+    parser.add_argument('--since-file', help='Read the cursor from this file and write the next cursor back')
+    parser.add_argument('--output', help='Output file (default: stdout)')
+    parser.add_argument('--readings', default='readings')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from storage import create_store
+
+    load_dotenv()
+    store = create_store(readings_dir=args.readings)
+    since = args.since
+    if args.since_file and since is None:
+        try:
+            with open(args.since_file, 'r', encoding='utf-8') as f:
+                since = int(f.read().strip() or 0)
+        except FileNotFoundError:
+            since = 0
+    # 先取游标再开始读，导出期间的新变更留给下一次
+    cursor = store.change_seq()
+    filters = {
+        'status': args.status,
+        'paid': None if args.paid is None else args.paid == 'true',
+        'date_from': args.date_from,
+        'date_to': args.date_to
+    }
+    chunks = export_chunks(
+        store, args.format, parse_fields(args.fields), filters, since, cursor if since is not None else None
+    )
+
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    if args.since_file:
+        tmp_path = f'{args.since_file}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(str(cursor))
+        os.replace(tmp_path, args.since_file)
+    print(f"[EXPORT] Done, next cursor: {cursor}", file=sys.stderr)
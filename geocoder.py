@@ -0,0 +1,270 @@
+import os
+import re
+import sys
+import time
+import sqlite3
+import difflib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_city(name):
+    """城市名归一化：去重音、小写、去标点、合并空白"""
+    if not name:
+        return ''
+    text = unicodedata.normalize('NFKD', str(name))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r'[^0-9a-z]+', ' ', text.lower())
+    text = re.sub(r'\bst\b', 'saint', text)
+    return ' '.join(text.split())
+
+
+def normalize_nation(nation):
+    return (nation or 'US').strip().upper()
+
+
+class Gazetteer:
+    """本地城市索引（由 GeoNames cities 文件预构建的 SQLite 库，只读）"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    @property
+    def available(self):
+        return os.path.exists(self.db_path)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f'file:{self.db_path}?mode=ro&immutable=1', uri=True, check_same_thread=False)
+            conn.execute('PRAGMA mmap_size=268435456')
+            self._local.conn = conn
+        return conn
+
+    def warm_up(self):
+        """顺序读一遍索引（进入操作系统页缓存），返回城市条目数"""
+        if not self.available:
+            return 0
+        count = self._conn().execute("SELECT COUNT(*) FROM cities INDEXED BY idx_cities_name").fetchone()[0]
+        self._conn().execute("SELECT SUM(lat) FROM cities").fetchone()
+        return count
+
+    def close(self):
+        """关闭当前线程的连接（fork 之前调用）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def lookup(self, city, nation):
+        """精确匹配归一化名称，失败时在同国家同前缀的候选中做模糊匹配"""
+        if not self.available:
+            return None
+
+        key = normalize_city(city)
+        if not key:
+            return None
+        conn = self._conn()
+
+        row = conn.execute(
+            "SELECT name, country, lat, lng, tz FROM cities WHERE name_norm = ? AND country = ? "
+            "ORDER BY population DESC LIMIT 1",
+            (key, nation)
+        ).fetchone()
+
+        if not row:
+            candidates = conn.execute(
+                "SELECT DISTINCT name_norm FROM cities WHERE country = ? AND name_norm >= ? AND name_norm < ?",
+                (nation, key[:2], key[:2] + '\uffff')
+            ).fetchall()
+            matches = difflib.get_close_matches(key, [c[0] for c in candidates], n=1, cutoff=0.85)
+            if matches:
+                row = conn.execute(
+                    "SELECT name, country, lat, lng, tz FROM cities WHERE name_norm = ? AND country = ? "
+                    "ORDER BY population DESC LIMIT 1",
+                    (matches[0], nation)
+                ).fetchone()
+
+        if not row:
+            return None
+        return {'city': row[0], 'nation': row[1], 'lat': row[2], 'lng': row[3], 'tz_str': row[4]}
+
+    @staticmethod
+    def build(source_path, db_path, min_population=0):
+        """
+        从 GeoNames 导出文件（如 cities15000.txt）构建索引
+        列：geonameid, name, asciiname, alternatenames, lat, lng, ..., country(8), ..., population(14), ..., timezone(17)
+        """
+        tmp_path = db_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        conn.execute("""
+            CREATE TABLE cities (
+                name_norm TEXT NOT NULL,
+                name TEXT NOT NULL,
+                country TEXT NOT NULL,
+                lat REAL NOT NULL,
+                lng REAL NOT NULL,
+                tz TEXT NOT NULL,
+                population INTEGER NOT NULL
+            )
+        """)
+
+        count = 0
+        with open(source_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                cols = line.rstrip('\n').split('\t')
+                if len(cols) < 18 or not cols[17]:
+                    continue
+                population = int(cols[14] or 0)
+                if population < min_population:
+                    continue
+                names = {normalize_city(cols[1]), normalize_city(cols[2])}
+                for name_norm in names:
+                    if name_norm:
+                        conn.execute(
+                            "INSERT INTO cities VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (name_norm, cols[1], cols[8], float(cols[4]), float(cols[5]), cols[17], population)
+                        )
+                count += 1
+
+        conn.execute("CREATE INDEX idx_cities_name ON cities (country, name_norm)")
+        conn.commit()
+        conn.execute("VACUUM")
+        conn.close()
+        os.replace(tmp_path, db_path)
+        return count
+
+
+class GeoResolver:
+    """
+    城市 -> 经纬度/时区 解析层
+    顺序：内存LRU -> 持久化缓存 -> 本地 gazetteer -> （可选）在线 GeoNames
+    """
+
+    def __init__(self, gazetteer_path, cache_path, max_entries=10000, online_fallback=True, geonames_username=None):
+        self.gazetteer = Gazetteer(gazetteer_path)
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.online_fallback = online_fallback
+        self.geonames_username = geonames_username
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS resolutions (
+                    key TEXT PRIMARY KEY,
+                    city TEXT NOT NULL,
+                    nation TEXT NOT NULL,
+                    lat REAL NOT NULL,
+                    lng REAL NOT NULL,
+                    tz_str TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_resolutions_used ON resolutions (last_used)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.cache_path, timeout=30, isolation_level=None)
+
+    def warm_up(self):
+        """预读 gazetteer，然后关闭连接，fork 出的 worker 各自重新打开（文件页仍在页缓存中）"""
+        count = self.gazetteer.warm_up()
+        self.gazetteer.close()
+        return count
+
+    def resolve(self, city, nation='US'):
+        """返回 {'city', 'nation', 'lat', 'lng', 'tz_str'}，找不到时抛出异常"""
+        nation = normalize_nation(nation)
+        key = f"{normalize_city(city)}|{nation}"
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return dict(self._memory[key])
+
+        location = self._load_cached(key)
+        if not location:
+            location = self.gazetteer.lookup(city, nation)
+            if not location and self.online_fallback:
+                location = self._fetch_online(city, nation)
+            if not location:
+                raise Exception(f"Unknown city: {city}, {nation}")
+            self._store_cached(key, location)
+
+        self._remember(key, location)
+        return dict(location)
+
+    def _remember(self, key, location):
+        with self._lock:
+            self._memory[key] = location
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _load_cached(self, key):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT city, nation, lat, lng, tz_str FROM resolutions WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute("UPDATE resolutions SET last_used = ? WHERE key = ?", (time.time(), key))
+        finally:
+            conn.close()
+        return {'city': row[0], 'nation': row[1], 'lat': row[2], 'lng': row[3], 'tz_str': row[4]}
+
+    def _store_cached(self, key, location):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, location['city'], location['nation'], location['lat'], location['lng'],
+                 location['tz_str'], time.time())
+            )
+            # 超出容量时淘汰最久未使用的记录
+            conn.execute(
+                "DELETE FROM resolutions WHERE key IN ("
+                "SELECT key FROM resolutions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        finally:
+            conn.close()
+
+    def _fetch_online(self, city, nation):
+        from kerykeion.fetch_geonames import FetchGeonames
+        from kerykeion.astrological_subject import DEFAULT_GEONAMES_USERNAME
+
+        print(f"[GEO] Online lookup for {city}, {nation}")
+        data = FetchGeonames(city, nation, username=self.geonames_username or DEFAULT_GEONAMES_USERNAME).get_serialized_data()
+        if not all(k in data for k in ('countryCode', 'timezonestr', 'lat', 'lng')):
+            return None
+        return {
+            'city': city,
+            'nation': data['countryCode'],
+            'lat': float(data['lat']),
+            'lng': float(data['lng']),
+            'tz_str': data['timezonestr']
+        }
+
+
+if __name__ == '__main__':
+    # 用法: python geocoder.py build cities15000.txt [data/gazetteer.db]
+    if len(sys.argv) < 3 or sys.argv[1] != 'build':
+        print("Usage: python geocoder.py build <geonames_cities.txt> [output.db]")
+        sys.exit(1)
+    output = sys.argv[3] if len(sys.argv) > 3 else os.path.join(os.getenv('DATA_DIR', 'data'), 'gazetteer.db')
+    total = Gazetteer.build(sys.argv[2], output)
+    print(f"Indexed {total} cities into {output}")
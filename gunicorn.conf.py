@@ -0,0 +1,26 @@
+import os
+
+# gunicorn 会自动读取当前目录下的 gunicorn.conf.py
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 180))
+# 线程 worker：SSE 进度流（每个约 30 秒）只占一个线程而不是整个 worker 进程，
+# 同时打开的流 + 普通请求总数不超过 workers * threads
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+# master 导入应用并预热一次，worker fork 后共享已加载的模块和星历/gazetteer 页
+preload_app = os.getenv('PRELOAD_APP', 'true').lower() == 'true'
+
+# 任务 worker 只在 gunicorn worker 进程中运行，master 不消费任务
+os.environ.setdefault('JOB_AUTOSTART', 'false')
+
+
+def when_ready(server):
+    if preload_app:
+        import app
+        app.warm_up()
+
+
+def post_fork(server, worker):
+    import app
+    app.post_fork()
@@ -0,0 +1,144 @@
+"""
+预序列化 + 预压缩的响应体，强 ETag / If-None-Match 条件请求，以及按 Accept-Encoding 协商压缩
+
+RepresentationStore 按内容寻址保存响应体（与 ImageStore 相同的思路）：
+    <dir>/ab/abcdef....json      原始 JSON
+    <dir>/ab/abcdef....json.gz   gzip（最高压缩级别，只压一次）
+    <dir>/ab/abcdef....json.br   brotli（安装了 brotli 时）
+内容不变时 digest 不变，订单里只记录 digest
+"""
+import os
+import gzip
+import json
+import uuid
+import hashlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 协商时的优先顺序
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+# 小于此大小的动态响应不压缩（压缩收益抵不过开销）
+MIN_COMPRESS_SIZE = 1024
+
+
+def compress(body, encoding, static=False):
+    """static=True 用于只压一次的预压缩内容，取最高压缩级别"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=11 if static else 4)
+    return gzip.compress(body, compresslevel=9 if static else 5, mtime=0)
+
+
+def choose_encoding(accept_encoding, available=ENCODINGS):
+    """按 Accept-Encoding（含 q 值）从 available 中选择编码，都不接受时返回 None（不压缩）"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            weights[name] = q
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match 用弱比较：忽略 W/ 前缀，* 匹配任意"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == f'"{etag}"':
+            return True
+    return False
+
+
+def serialize(payload):
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class Representation:
+    """一份响应体及其预压缩版本；etag 按编码区分（强 ETag 要求字节完全一致）"""
+
+    def __init__(self, body, mimetype='application/json', bodies=None, digest=None):
+        self.body = body
+        self.mimetype = mimetype
+        self.digest = digest or hashlib.sha256(body).hexdigest()
+        self.bodies = bodies if bodies is not None else {
+            encoding: compress(body, encoding, static=True) for encoding in ENCODINGS
+        }
+
+    def select(self, accept_encoding):
+        """返回 (encoding 或 None, body, etag)"""
+        encoding = choose_encoding(accept_encoding, [e for e in ENCODINGS if e in self.bodies])
+        if encoding:
+            return encoding, self.bodies[encoding], f'{self.digest}-{encoding}'
+        return None, self.body, self.digest
+
+
+class RepresentationStore:
+    """内容寻址的预压缩响应体存储（写入后不再变化，多进程共享）"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], f'{digest}.json')
+
+    def put(self, payload):
+        """保存 JSON 负载，返回 digest（已存在时不重复压缩）"""
+        body = serialize(payload)
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            representation = Representation(body, digest=digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 压缩版本先落盘，原始文件最后出现即表示完整
+            for encoding, compressed in representation.bodies.items():
+                self._write(path + SUFFIXES[encoding], compressed)
+            self._write(path, body)
+        return digest
+
+    @staticmethod
+    def _write(path, data):
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, digest):
+        """读取一份表示，不存在时返回 None；缺少的压缩版本按需跳过"""
+        path = self._path(digest)
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        bodies = {}
+        for encoding in ENCODINGS:
+            try:
+                with open(path + SUFFIXES[encoding], 'rb') as f:
+                    bodies[encoding] = f.read()
+            except FileNotFoundError:
+                pass
+        return Representation(body, bodies=bodies, digest=digest)
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import uuid
+import random
+import hashlib
+import sqlite3
+
+
+def request_fingerprint(data):
+    """邮箱 + 出生数据 + 性别的摘要：内容相同的请求得到相同的指纹"""
+    parts = [str(data.get('email', '')).strip().lower()]
+    parts += [str(int(data[f])) for f in ('year', 'month', 'day', 'hour', 'minute')]
+    parts += [
+        ' '.join(str(data.get('city', '')).lower().split()),
+        str(data.get('nation', 'US')).strip().upper(),
+        str(data.get('gender', 'female')).strip().lower()
+    ]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+class IdempotencyConflict(Exception):
+    """同一个 Idempotency-Key 被用于内容不同的请求"""
+
+
+class IdempotencyStore:
+    """
+    跨进程的幂等记录（SQLite）：
+    第一个请求成为 owner 负责计算（pending，带租约），并发的相同请求等待同一个结果（singleflight），
+    完成后在 ttl 内的重复请求直接返回保存的结果；owner 失败或租约过期时由下一个请求接手
+    """
+
+    def __init__(self, db_path, ttl_seconds=3600, lease_seconds=600, poll_interval=0.25):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    job_id TEXT,
+                    result TEXT,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys (expires_at)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _row_to_record(row):
+        if not row:
+            return None
+        record = dict(row)
+        record['result'] = json.loads(row['result']) if row['result'] else None
+        return record
+
+    def begin(self, key, fingerprint):
+        """
+        返回 (state, record)：
+        owner   - 由调用方计算，完成后调用 complete / fail（record['owner'] 为凭证）
+        pending - 其他请求正在计算（record['job_id'] 可能指向后台任务）
+        done    - 已有结果（record['result']）
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if random.random() < 0.01:
+                conn.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
+
+            row = conn.execute("SELECT * FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+            if row and row['fingerprint'] != fingerprint:
+                conn.execute("ROLLBACK")
+                raise IdempotencyConflict(f"Idempotency key reused with a different request: {key}")
+            if row and row['expires_at'] > now:
+                conn.execute("COMMIT")
+                return row['status'], self._row_to_record(row)
+
+            owner = str(uuid.uuid4())
+            conn.execute(
+                "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, status, owner, created_at, expires_at) "
+                "VALUES (?, ?, 'pending', ?, ?, ?)",
+                (key, fingerprint, owner, now, now + self.lease_seconds)
+            )
+            conn.execute("COMMIT")
+            return 'owner', {'key': key, 'fingerprint': fingerprint, 'status': 'pending', 'owner': owner, 'job_id': None}
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def attach_job(self, key, owner, job_id):
+        """记录负责计算的后台任务，重复的异步请求返回同一个 job_id"""
+        self._execute(
+            "UPDATE idempotency_keys SET job_id = ? WHERE key = ? AND owner = ?",
+            (job_id, key, owner)
+        )
+
+    def complete(self, key, owner, result):
+        self._execute(
+            "UPDATE idempotency_keys SET status = 'done', result = ?, expires_at = ? WHERE key = ? AND owner = ?",
+            (json.dumps(result, ensure_ascii=False), time.time() + self.ttl_seconds, key, owner)
+        )
+
+    def fail(self, key, owner):
+        """计算失败：删除记录，下一个请求重新计算"""
+        self._execute("DELETE FROM idempotency_keys WHERE key = ? AND owner = ?", (key, owner))
+
+    def get(self, key):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT * FROM idempotency_keys WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        finally:
+            conn.close()
+        return self._row_to_record(row)
+
+    def wait(self, key, timeout):
+        """等待 pending 的记录完成；返回最新记录（done / 仍为 pending），owner 失败时返回 None"""
+        deadline = time.time() + timeout
+        while True:
+            record = self.get(key)
+            if not record or record['status'] == 'done' or time.time() >= deadline:
+                return record
+            time.sleep(self.poll_interval)
+
+    def _execute(self, sql, params):
+        conn = self._connect()
+        try:
+            conn.execute(sql, params)
+        finally:
+            conn.close()
@@ -0,0 +1,89 @@
+import os
+import io
+import hashlib
+import threading
+
+import requests
+from PIL import Image, ImageFilter
+
+# 派生图规格：(最长边, 格式, 质量, 模糊半径)
+VARIANTS = {
+    'blur': (512, 'JPEG', 70, 24),
+    'thumb': (256, 'WEBP', 75, 0),
+    'email': (600, 'JPEG', 82, 0),
+    'email_webp': (600, 'WEBP', 80, 0)
+}
+MIMETYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+
+
+class ImageStore:
+    """按内容寻址（sha256）的本地图片存储，派生图按需生成并缓存"""
+
+    def __init__(self, root_dir, download_timeout=30):
+        self.root_dir = os.path.abspath(root_dir)
+        self.download_timeout = download_timeout
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _dir(self, digest):
+        return os.path.join(self.root_dir, digest[:2], digest)
+
+    def _path(self, digest, variant):
+        return os.path.join(self._dir(digest), variant)
+
+    @staticmethod
+    def is_digest(value):
+        return len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+    def put(self, data):
+        """保存原图，返回 digest（相同内容只存一份）"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest, 'original')
+        if not os.path.exists(path):
+            os.makedirs(self._dir(digest), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def mirror(self, url):
+        """下载一次远程图片（如 DALL-E 的临时 URL）并生成全部派生图"""
+        response = requests.get(url, timeout=self.download_timeout)
+        response.raise_for_status()
+        digest = self.put(response.content)
+        for variant in VARIANTS:
+            self.derive(digest, variant)
+        return digest
+
+    def derive(self, digest, variant):
+        """返回派生图路径，不存在时生成"""
+        path = self._path(digest, variant)
+        if os.path.exists(path):
+            return path
+
+        size, fmt, quality, blur_radius = VARIANTS[variant]
+        with Image.open(self._path(digest, 'original')) as image:
+            image = image.convert('RGB')
+            image.thumbnail((size, size), Image.LANCZOS)
+            if blur_radius:
+                image = image.filter(ImageFilter.GaussianBlur(blur_radius))
+            buffer = io.BytesIO()
+            image.save(buffer, fmt, quality=quality, optimize=True)
+
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+        return path
+
+    def open(self, digest, variant):
+        """返回 (文件路径, mimetype)，不存在时返回 None"""
+        if not self.is_digest(digest) or not os.path.exists(self._path(digest, 'original')):
+            return None
+        if variant == 'original':
+            with Image.open(self._path(digest, 'original')) as image:
+                mimetype = MIMETYPES.get(image.format, 'application/octet-stream')
+            return self._path(digest, 'original'), mimetype
+        if variant not in VARIANTS:
+            return None
+        return self.derive(digest, variant), MIMETYPES[VARIANTS[variant][1]]
@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import threading
+import traceback
+from datetime import datetime
+
+
+class RetryJob(Exception):
+    """处理函数抛出后任务在 delay 秒后重新排队；总次数不超过 max_attempts（默认沿用队列设置）"""
+
+    def __init__(self, message='', delay=30.0, max_attempts=None):
+        super().__init__(message)
+        self.delay = delay
+        self.max_attempts = max_attempts
+
+
+class JobQueue:
+    """基于SQLite的持久化任务队列 + 后台工作线程池"""
+
+    def __init__(self, db_path, num_workers=2, poll_interval=0.5, lease_seconds=600, max_attempts=3, events_ttl=3600):
+        self.db_path = db_path
+        # 任务结束超过 events_ttl 秒后删除它的事件（SSE 重放只需要最近的任务）
+        self.events_ttl = events_ttl
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.handlers = {}
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    progress TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT,
+                    lease_until REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+            # 延迟重试：run_after 之前不会被领取（旧库补列）
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if 'run_after' not in columns:
+                try:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN run_after REAL")
+                except sqlite3.OperationalError:
+                    pass
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    event TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, id)")
+        finally:
+            conn.close()
+
+    def register(self, kind, handler):
+        """注册任务处理函数 handler(payload, job) -> result"""
+        self.handlers[kind] = handler
+
+    def submit(self, kind, payload):
+        """入队，返回 job_id"""
+        job_id = str(uuid.uuid4())
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, created_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(payload, ensure_ascii=False), datetime.now().isoformat())
+            )
+        finally:
+            conn.close()
+        self.start()
+        # 同进程提交时立即唤醒空闲 worker，不必等下一次轮询
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """查询任务状态"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+
+        job = {
+            'job_id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'attempts': row['attempts'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at']
+        }
+        if row['progress']:
+            job['progress'] = json.loads(row['progress'])
+        if row['result']:
+            job['result'] = json.loads(row['result'])
+        if row['error']:
+            job['error'] = row['error']
+        if row['status'] == 'queued' and row['run_after']:
+            job['retry_at'] = datetime.fromtimestamp(row['run_after']).isoformat()
+        return job
+
+    def set_progress(self, job_id, progress):
+        """更新任务进度"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET progress = ?, lease_until = ? WHERE id = ?",
+                (json.dumps(progress, ensure_ascii=False), time.time() + self.lease_seconds, job_id)
+            )
+        finally:
+            conn.close()
+
+    def add_event(self, job_id, event, data):
+        """追加任务事件（供 SSE 等流式接口读取）"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO job_events (job_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, event, json.dumps(data, ensure_ascii=False), time.time())
+            )
+        finally:
+            conn.close()
+
+    def events(self, job_id, after_id=0):
+        """读取 after_id 之后的事件，返回 [(id, event, data), ...]"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id, event, data FROM job_events WHERE job_id = ? AND id > ? ORDER BY id",
+                (job_id, after_id)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [(row['id'], row['event'], json.loads(row['data'])) for row in rows]
+
+    def prune_events(self):
+        """删除已结束且超过 events_ttl 的任务的事件，返回删除条数"""
+        cutoff = datetime.fromtimestamp(time.time() - self.events_ttl).isoformat()
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "DELETE FROM job_events WHERE job_id IN ("
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?)",
+                (cutoff,)
+            ).rowcount
+        finally:
+            conn.close()
+
+    def pending_count(self, kind=None):
+        conn = self._connect()
+        try:
+            if kind:
+                return conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running') AND kind = ?", (kind,)
+                ).fetchone()[0]
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+        finally:
+            conn.close()
+
+    def start(self):
+        """启动工作线程（fork 之后会在子进程中重新启动）"""
+        if self.num_workers <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._threads:
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._threads = []
+            for i in range(self.num_workers):
+                t = threading.Thread(target=self._worker_loop, name=f'job-worker-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+        print(f"[JOBS] Started {self.num_workers} workers (pid {self._pid})")
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def _claim(self):
+        """原子地领取一个任务；租约过期的 running 任务视为崩溃后遗留，重新入队"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND lease_until < ? AND attempts < ?",
+                (now, self.max_attempts)
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Lease expired too many times', finished_at = ? "
+                "WHERE status = 'running' AND lease_until < ?",
+                (datetime.now().isoformat(), now)
+            )
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND (run_after IS NULL OR run_after <= ?) "
+                "ORDER BY created_at LIMIT 1",
+                (now,)
+            ).fetchone()
+            if not row:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, lease_until = ? WHERE id = ?",
+                (datetime.now().isoformat(), now + self.lease_seconds, row['id'])
+            )
+            conn.execute("COMMIT")
+            return row
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _finish(self, job_id, status, result=None, error=None):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL WHERE id = ?",
+                (
+                    status,
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    error,
+                    datetime.now().isoformat(),
+                    job_id
+                )
+            )
+        finally:
+            conn.close()
+        # 结束时偶尔清理一次旧事件，避免单独的定时任务
+        if random.random() < 0.01:
+            try:
+                self.prune_events()
+            except sqlite3.OperationalError as e:
+                print(f"[JOBS] Pruning events failed: {str(e)}")
+
+    def _retry_later(self, job_id, delay, error):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', error = ?, run_after = ?, lease_until = NULL WHERE id = ?",
+                (error, time.time() + delay, job_id)
+            )
+        finally:
+            conn.close()
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                row = self._claim()
+            except sqlite3.OperationalError as e:
+                print(f"[JOBS] Claim failed: {str(e)}")
+                row = None
+
+            if not row:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            job_id = row['id']
+            handler = self.handlers.get(row['kind'])
+            if not handler:
+                self._finish(job_id, 'failed', error=f"No handler for job kind: {row['kind']}")
+                continue
+
+            print(f"[JOBS] Running {row['kind']} job {job_id}")
+            try:
+                result = handler(json.loads(row['payload']), Job(self, job_id, row['attempts'] + 1))
+                self._finish(job_id, 'done', result=result)
+                print(f"[JOBS] Job {job_id} done")
+            except RetryJob as e:
+                if row['attempts'] + 1 < (e.max_attempts or self.max_attempts):
+                    print(f"[JOBS] Job {job_id} retrying in {e.delay:.0f}s: {str(e)}")
+                    self._retry_later(job_id, e.delay, str(e))
+                else:
+                    print(f"[JOBS] Job {job_id} failed after {row['attempts'] + 1} attempts: {str(e)}")
+                    self._finish(job_id, 'failed', error=str(e))
+            except Exception as e:
+                print(f"[JOBS] Job {job_id} failed: {str(e)}")
+                traceback.print_exc()
+                self._finish(job_id, 'failed', error=str(e))
+
+
+class Job:
+    """传给处理函数的任务句柄"""
+
+    def __init__(self, queue, job_id, attempt=1):
+        self.queue = queue
+        self.id = job_id
+        # 第几次执行（从 1 开始）
+        self.attempt = attempt
+
+    def progress(self, **progress):
+        self.queue.set_progress(self.id, progress)
+
+    def emit(self, event, **data):
+        self.queue.add_event(self.id, event, data)
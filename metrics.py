@@ -0,0 +1,187 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# 直方图分桶（秒），覆盖从缓存命中到 DALL-E 生成的范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _label_key(labels):
+    return ','.join(f'{k}="{labels[k]}"' for k in sorted(labels)) if labels else ''
+
+
+def _sort_key(row):
+    """同一直方图的分桶按 le 数值排序"""
+    name, labels, _ = row
+    head, sep, le = labels.rpartition('le="')
+    if name.endswith('_bucket') and sep:
+        le = le.rstrip('"')
+        return name, head, float('inf') if le == '+Inf' else float(le)
+    return name, labels, 0.0
+
+
+class Metrics:
+    """
+    计数器 + 直方图，进程内累加后定期把增量写入共享 SQLite，
+    任一 gunicorn worker 都能导出所有进程的汇总（Prometheus 文本格式）
+    """
+
+    def __init__(self, db_path, prefix='soulmate', flush_interval=1.0, buckets=DEFAULT_BUCKETS):
+        self.db_path = db_path
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._pid = None
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS samples (
+                    name TEXT NOT NULL,
+                    labels TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    PRIMARY KEY (name, labels)
+                )
+            """)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA synchronous=OFF")
+        return conn
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        self._ensure_flusher()
+        key = (f'{self.prefix}_{name}', _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        self._ensure_flusher()
+        full_name = f'{self.prefix}_{name}'
+        label_key = _label_key(labels)
+        with self._lock:
+            hist = self._histograms.setdefault((full_name, label_key), [[0] * len(self.buckets), 0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist[0][i] += 1
+            hist[1] += 1
+            hist[2] += seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def _ensure_flusher(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # fork 出的子进程（gunicorn preload）：继承来的未写入增量属于父进程，由父进程自己写入，
+                # 子进程再写一次会让总数乘以 worker 数
+                self._counters, self._histograms = {}, {}
+            self._pid = os.getpid()
+            self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flusher', daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.OperationalError as e:
+                print(f"[METRICS] Flush failed: {str(e)}")
+
+    def flush(self):
+        """把本进程累计的增量合并到共享库"""
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            histograms, self._histograms = self._histograms, {}
+        if not counters and not histograms:
+            return
+
+        rows = [(name, labels, value) for (name, labels), value in counters.items()]
+        for (name, labels), (bucket_counts, count, total) in histograms.items():
+            sep = ',' if labels else ''
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                rows.append((f'{name}_bucket', f'{labels}{sep}le="{bound}"', bucket_count))
+            rows.append((f'{name}_bucket', f'{labels}{sep}le="+Inf"', count))
+            rows.append((f'{name}_count', labels, count))
+            rows.append((f'{name}_sum', labels, total))
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO samples (name, labels, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                rows
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def render(self):
+        """导出 Prometheus 文本格式（包含所有 worker 进程的数据）"""
+        self.flush()
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT name, labels, value FROM samples").fetchall()
+        finally:
+            conn.close()
+        rows.sort(key=_sort_key)
+
+        lines = []
+        described = set()
+        for name, labels, value in rows:
+            base = name
+            for suffix in ('_bucket', '_count', '_sum'):
+                if name.endswith(suffix) and name[:-len(suffix)] in self._help:
+                    base = name[:-len(suffix)]
+            if base not in described and base in self._help:
+                kind, help_text = self._help[base]
+                lines.append(f'# HELP {base} {help_text}')
+                lines.append(f'# TYPE {base} {kind}')
+                described.add(base)
+            value_text = repr(value) if isinstance(value, float) and not value.is_integer() else str(int(value))
+            lines.append(f'{name}{{{labels}}} {value_text}' if labels else f'{name} {value_text}')
+        return '\n'.join(lines) + '\n'
+
+
+def register_default_metrics(metrics):
+    """声明本服务使用的指标（HELP / TYPE）"""
+    p = metrics.prefix
+    metrics.describe(f'{p}_stage_duration_seconds', 'histogram', 'Latency of each reading pipeline stage')
+    metrics.describe(f'{p}_upstream_request_duration_seconds', 'histogram', 'Latency of each external call attempt')
+    metrics.describe(f'{p}_http_request_duration_seconds', 'histogram', 'Latency of HTTP requests by endpoint')
+    metrics.describe(f'{p}_errors_total', 'counter', 'Errors by stage')
+    metrics.describe(f'{p}_upstream_retries_total', 'counter', 'Retried external call attempts')
+    metrics.describe(f'{p}_cache_lookups_total', 'counter', 'Cache lookups by cache and result')
+    metrics.describe(f'{p}_cold_start_seconds', 'histogram', 'Process import, service init and warm-up time')
+    metrics.describe(f'{p}_idempotency_total', 'counter', 'Duplicate create-reading requests by outcome')
+    metrics.describe(f'{p}_upstream_hedges_total', 'counter', 'Hedged external calls by winning request')
+    metrics.describe(f'{p}_circuit_state_changes_total', 'counter', 'Circuit breaker transitions by endpoint and new state')
+    metrics.describe(f'{p}_circuit_rejections_total', 'counter', 'Calls rejected while a circuit breaker was open')
+    metrics.describe(f'{p}_exports_total', 'counter', 'Completed reading exports by format and mode')
+    metrics.describe(f'{p}_admission_rejections_total', 'counter', 'Create-reading requests rejected by admission control or rate limits')
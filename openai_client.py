@@ -0,0 +1,404 @@
+import time
+import queue
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# 每类接口的 (连接超时, 读取超时)，单位秒
+DEFAULT_TIMEOUTS = {
+    'chat': (5, 60),
+    'image': (5, 90),
+    'default': (5, 60)
+}
+
+
+def parse_retry_after(value):
+    """解析 Retry-After（秒数或 HTTP 日期），返回秒数或 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开期间直接拒绝请求，不再等待上游超时"""
+
+    def __init__(self, endpoint, retry_in):
+        super().__init__(f"Circuit open for {endpoint}, retry in {retry_in:.1f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    单个上游接口的熔断器（进程内）：
+    closed    - 正常放行，连续失败 failure_threshold 次（重试用尽后才算一次）后打开
+    open      - 直接抛 CircuitOpenError，reset_timeout 秒后进入 half_open
+    half_open - 只放行 half_open_max 个探测请求，成功则关闭，失败则重新打开
+    """
+
+    def __init__(self, endpoint, failure_threshold=5, reset_timeout=30.0, half_open_max=1, on_change=None):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+        self.on_change = on_change
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.opened_count = 0
+        self.rejected = 0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """放行则返回，否则抛 CircuitOpenError"""
+        with self._lock:
+            if self.state == 'open':
+                remaining = self.opened_at + self.reset_timeout - time.time()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.endpoint, remaining)
+                self._transition('half_open')
+            if self.state == 'half_open':
+                if self._probes >= self.half_open_max:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.endpoint, self.reset_timeout)
+                self._probes += 1
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != 'closed':
+                self._transition('closed')
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                self._transition('open')
+
+    def _transition(self, state):
+        self.state = state
+        self._probes = 0
+        if state == 'open':
+            self.opened_at = time.time()
+            self.opened_count += 1
+        print(f"[CIRCUIT] {self.endpoint} -> {state}")
+        if self.on_change:
+            self.on_change(self.endpoint, state)
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'opened_count': self.opened_count,
+                'rejected': self.rejected
+            }
+            if self.state == 'open':
+                snapshot['retry_in'] = round(max(0.0, self.opened_at + self.reset_timeout - time.time()), 2)
+            return snapshot
+
+
+class _RetryPolicy:
+    """指数退避 + 抖动，优先遵守 Retry-After；同时记录每次尝试的耗时"""
+
+    def __init__(self, max_retries=3, backoff_base=0.5, backoff_max=20.0, timeouts=None, metrics=None):
+        self.metrics = metrics
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.attempts = deque(maxlen=1000)
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def timeout_for(self, endpoint):
+        return self.timeouts.get(endpoint, self.timeouts['default'])
+
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def record(self, endpoint, attempt, latency, status=None, error=None):
+        with self._lock:
+            self.attempts.append({
+                'endpoint': endpoint,
+                'attempt': attempt,
+                'latency': round(latency, 4),
+                'status': status,
+                'error': error,
+                'at': time.time()
+            })
+            counter = self.counters.setdefault(endpoint, {
+                'requests': 0, 'attempts': 0, 'retries': 0, 'failures': 0, 'latency_total': 0.0
+            })
+            counter['attempts'] += 1
+            counter['latency_total'] += latency
+            if attempt == 0:
+                counter['requests'] += 1
+            else:
+                counter['retries'] += 1
+        if self.metrics:
+            self.metrics.observe('upstream_request_duration_seconds', latency, endpoint=endpoint)
+            if attempt:
+                self.metrics.inc('upstream_retries_total', endpoint=endpoint)
+
+    def record_failure(self, endpoint):
+        with self._lock:
+            self.counters.setdefault(endpoint, {
+                'requests': 0, 'attempts': 0, 'retries': 0, 'failures': 0, 'latency_total': 0.0
+            })['failures'] += 1
+        if self.metrics:
+            self.metrics.inc('errors_total', stage=f'openai_{endpoint}')
+
+    def latency_percentile(self, endpoint, percentile, min_samples=20):
+        """最近成功请求的耗时分位数（流式请求为首字节时间）；样本不足时返回 None"""
+        with self._lock:
+            samples = sorted(
+                a['latency'] for a in self.attempts
+                if a['endpoint'] == endpoint and a['status'] is not None and a['status'] < 400
+            )
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+    def stats(self):
+        with self._lock:
+            return {
+                endpoint: {**c, 'latency_avg': round(c['latency_total'] / c['attempts'], 4) if c['attempts'] else 0.0}
+                for endpoint, c in self.counters.items()
+            }
+
+
+class _Resilience:
+    """
+    每个接口一个熔断器，以及对冲请求的时机
+    hedge_percentiles={'chat': 95}：请求超过最近 p95 耗时仍未返回时再发一路，两路中先成功的一路胜出，一路失败时用另一路的结果；
+    对冲请求数不超过普通请求的 hedge_budget 比例，避免上游变慢时流量翻倍
+    """
+
+    def _init_resilience(self, metrics, hedge_percentiles, hedge_min_delay, hedge_budget,
+                         breaker_threshold, breaker_reset, half_open_max):
+        self.metrics = metrics
+        self.hedge_percentiles = hedge_percentiles or {}
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_budget = hedge_budget
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.half_open_max = half_open_max
+        self.breakers = {}
+        self._hedges = {}
+        self._breaker_lock = threading.Lock()
+
+    def breaker(self, endpoint):
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            with self._breaker_lock:
+                breaker = self.breakers.setdefault(endpoint, CircuitBreaker(
+                    endpoint, self.breaker_threshold, self.breaker_reset, self.half_open_max,
+                    on_change=self._on_breaker_change
+                ))
+        return breaker
+
+    def _on_breaker_change(self, endpoint, state):
+        if self.metrics:
+            self.metrics.inc('circuit_state_changes_total', endpoint=endpoint, state=state)
+
+    def _allow(self, endpoint):
+        try:
+            self.breaker(endpoint).allow()
+        except CircuitOpenError:
+            if self.metrics:
+                self.metrics.inc('circuit_rejections_total', endpoint=endpoint)
+            raise
+
+    def _record_outcome(self, endpoint, status=None, error=None):
+        """只有上游故障（连接错误/超时/429/5xx）计入熔断，其余 4xx 说明上游正常"""
+        if error is not None or status is None or status in RETRY_STATUSES:
+            self.breaker(endpoint).failure()
+        else:
+            self.breaker(endpoint).success()
+
+    def record_stream_end(self, endpoint, error=None):
+        """流式响应读完或中途出错（读取超时、连接断开）后调用，计入失败统计和熔断"""
+        if error is None:
+            self.breaker(endpoint).success()
+            return
+        self.policy.record_failure(endpoint)
+        self.breaker(endpoint).failure()
+
+    def hedge_delay(self, endpoint):
+        """需要对冲时返回等待秒数，否则返回 None"""
+        percentile = self.hedge_percentiles.get(endpoint)
+        if not percentile:
+            return None
+        delay = self.policy.latency_percentile(endpoint, percentile)
+        if delay is None:
+            return None
+        requests_made = self.policy.counters.get(endpoint, {}).get('requests', 0)
+        if self._hedges.get(endpoint, 0) >= self.hedge_budget * requests_made:
+            return None
+        return max(delay, self.hedge_min_delay)
+
+    def _record_hedge(self, endpoint, winner=None):
+        if winner is None:
+            with self._breaker_lock:
+                self._hedges[endpoint] = self._hedges.get(endpoint, 0) + 1
+        elif self.metrics:
+            self.metrics.inc('upstream_hedges_total', endpoint=endpoint, winner=winner)
+
+    def breaker_states(self):
+        return {endpoint: breaker.snapshot() for endpoint, breaker in list(self.breakers.items())}
+
+    def stats(self):
+        stats = self.policy.stats()
+        for endpoint, hedges in self._hedges.items():
+            stats.setdefault(endpoint, {})['hedges'] = hedges
+        return stats
+
+
+class OpenAIClient(_Resilience):
+    """共享的 OpenAI HTTP 客户端：keep-alive 连接池 + 429/5xx 重试 + 对冲请求 + 熔断"""
+
+    def __init__(self, pool_size=10, max_retries=3, backoff_base=0.5, backoff_max=20.0, timeouts=None, metrics=None,
+                 hedge_percentiles=None, hedge_min_delay=1.0, hedge_budget=0.1, hedge_pool_size=4,
+                 breaker_threshold=5, breaker_reset=30.0, half_open_max=1):
+        self.policy = _RetryPolicy(max_retries, backoff_base, backoff_max, timeouts, metrics)
+        self._init_resilience(metrics, hedge_percentiles, hedge_min_delay, hedge_budget,
+                              breaker_threshold, breaker_reset, half_open_max)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # 对冲请求专用的有界线程池；主请求不经过这个池，不会排在对冲后面
+        self._hedge_executor = ThreadPoolExecutor(max_workers=hedge_pool_size, thread_name_prefix='openai-hedge')
+        self._hedge_slots = threading.BoundedSemaphore(hedge_pool_size)
+
+    def post(self, url, endpoint='default', **kwargs):
+        """
+        发送 POST，失败时按策略重试；返回最后一次的 Response（已 raise_for_status）
+        熔断器打开时抛 CircuitOpenError；stream=True 时读完响应后须调用 record_stream_end
+        """
+        self._allow(endpoint)
+        try:
+            response = self._hedged_post(url, endpoint, kwargs)
+        except requests.HTTPError as e:
+            self._record_outcome(endpoint, status=e.response.status_code if e.response is not None else None)
+            raise
+        except requests.RequestException as e:
+            self._record_outcome(endpoint, error=e)
+            raise
+        if not kwargs.get('stream'):
+            # 流式响应中途也可能卡住/断开，读完才算成功，见 record_stream_end
+            self._record_outcome(endpoint, status=response.status_code)
+        return response
+
+    def _hedged_post(self, url, endpoint, kwargs):
+        """
+        对冲模式下主请求在独立线程执行（不占对冲线程池，不会排在对冲后面），调用方线程等待两路结果：
+        delay 秒后仍无结果时把对冲请求提交到对冲线程池（池满时放弃对冲，不排队）。
+        先成功的一路胜出，落败一路的响应到达后直接关闭；先结束的一路失败时才等待另一路
+        """
+        delay = self.hedge_delay(endpoint)
+        if delay is None:
+            return self._post_with_retries(url, endpoint, **kwargs)
+
+        outcomes = queue.Queue()
+        lock = threading.Lock()
+        state = {'winner': None}
+
+        def run(path):
+            try:
+                response = self._post_with_retries(url, endpoint, **kwargs)
+            except Exception as e:
+                outcomes.put((path, None, e))
+                return
+            with lock:
+                lost = state['winner'] is not None
+                if not lost:
+                    state['winner'] = path
+            if lost:
+                response.close()
+            else:
+                outcomes.put((path, response, None))
+
+        threading.Thread(target=run, args=('primary',), name=f'openai-{endpoint}', daemon=True).start()
+        pending = 1
+        try:
+            outcome = outcomes.get(timeout=delay)
+        except queue.Empty:
+            outcome = None
+            if self._hedge_slots.acquire(blocking=False):
+                print(f"[OPENAI] {endpoint} slower than {delay:.2f}s, sending hedged request")
+                self._record_hedge(endpoint)
+                self._hedge_executor.submit(run, 'hedge').add_done_callback(lambda _: self._hedge_slots.release())
+                pending += 1
+        hedged = pending == 2
+
+        errors = {}
+        while True:
+            if outcome is None:
+                outcome = outcomes.get()
+            path, response, error = outcome
+            outcome = None
+            if response is not None:
+                if hedged:
+                    self._record_hedge(endpoint, path)
+                return response
+            errors[path] = error
+            pending -= 1
+            if not pending:
+                # 两路都失败：抛出主请求的错误
+                raise errors['primary']
+
+    def _post_with_retries(self, url, endpoint, **kwargs):
+        kwargs.setdefault('timeout', self.policy.timeout_for(endpoint))
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                response = self.session.post(url, **kwargs)
+            except requests.ReadTimeout as e:
+                # 请求已经发出，上游可能仍在生成（并计费）；补全/生图不是幂等的，读取超时不重试
+                self.policy.record(endpoint, attempt, time.time() - start, error=type(e).__name__)
+                self.policy.record_failure(endpoint)
+                raise
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.policy.record(endpoint, attempt, time.time() - start, error=type(e).__name__)
+                if attempt >= self.policy.max_retries:
+                    self.policy.record_failure(endpoint)
+                    raise
+                time.sleep(self.policy.delay(attempt))
+                attempt += 1
+                continue
+
+            self.policy.record(endpoint, attempt, time.time() - start, status=response.status_code)
+            if response.status_code in RETRY_STATUSES and attempt < self.policy.max_retries:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                response.close()
+                print(f"[OPENAI] {endpoint} returned {response.status_code}, retry {attempt + 1}/{self.policy.max_retries}")
+                time.sleep(self.policy.delay(attempt, retry_after))
+                attempt += 1
+                continue
+
+            if response.status_code >= 400:
+                self.policy.record_failure(endpoint)
+            response.raise_for_status()
+            return response
@@ -0,0 +1,127 @@
+import os
+import time
+import sqlite3
+import threading
+
+
+class TokenBucket:
+    """进程内令牌桶：rate 个/秒，最多积累 capacity 个"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """非阻塞获取，返回 (是否成功, 需要等待的秒数)"""
+        with self._lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True, 0.0
+            return False, (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """阻塞直到拿到令牌"""
+        while True:
+            ok, wait = self.try_acquire(tokens)
+            if ok:
+                return
+            time.sleep(wait)
+
+
+def parse_rate(spec):
+    """'20/h' -> (capacity 20, 每秒补充 20/3600)；单位 s/m/h/d，空或 0 表示不限制（返回 None）"""
+    spec = (spec or '').strip().lower()
+    if not spec or spec in ('0', 'off', 'none'):
+        return None
+    count, _, unit = spec.partition('/')
+    seconds = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}.get(unit or 's')
+    if seconds is None:
+        raise ValueError(f"Invalid rate: {spec} (expected N/s, N/m, N/h or N/d)")
+    count = float(count)
+    if count <= 0:
+        return None
+    return count, count / seconds
+
+
+class SharedTokenBuckets:
+    """
+    跨进程令牌桶（SQLite）：每个 key 一行 (tokens, updated)，所有 gunicorn worker 共用
+    try_acquire 在一个写事务里检查并扣减多个桶，全部有余量才扣减
+    桶会在 full_at 时刻补满，此后的行等同于新桶，定期清理
+    """
+
+    PRUNE_EVERY = 500
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._calls = 0
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS token_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    full_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_token_buckets_full ON token_buckets (full_at)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def try_acquire(self, limits, tokens=1):
+        """
+        limits: [(key, capacity, rate), ...]
+        返回 (是否成功, 需要等待的秒数, 不足的 key)
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            levels = []
+            for key, capacity, rate in limits:
+                row = conn.execute("SELECT tokens, updated FROM token_buckets WHERE key = ?", (key,)).fetchone()
+                level = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+                if level < tokens:
+                    conn.execute("ROLLBACK")
+                    return False, (tokens - level) / rate, key
+                levels.append((key, level - tokens, now + (capacity - level + tokens) / rate))
+            conn.executemany(
+                "INSERT OR REPLACE INTO token_buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                [(key, level, now, full_at) for key, level, full_at in levels]
+            )
+            self._calls += 1
+            if self._calls % self.PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM token_buckets WHERE full_at < ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return True, 0.0, None
+
+    def acquire(self, limits, tokens=1):
+        """阻塞直到 limits 里的所有桶都拿到令牌"""
+        while True:
+            ok, wait, _ = self.try_acquire(limits, tokens)
+            if ok:
+                return
+            time.sleep(wait)
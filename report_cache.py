@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import argparse
+from collections import Counter
+
+SIGNATURE_POINTS = ['sun', 'moon', 'venus', 'mars', 'rising', 'house7']
+
+
+def chart_signature(chart_data, gender, report_format='markdown'):
+    """报告签名：_build_prompt 实际用到的六个星座 + 性别 + 报告格式（不同格式的提示词和篇幅不同，不能互相复用）"""
+    return '|'.join([chart_data[p]['sign'] for p in SIGNATURE_POINTS] + [gender or 'female', report_format])
+
+
+class ReportCache:
+    """按星盘签名缓存文字报告，每个签名保存 N 个不同版本随机返回；TTL + 签名数量上限淘汰，SQLite 持久化"""
+
+    def __init__(self, db_path, variants=3, ttl_seconds=30 * 86400, max_signatures=50000, metrics=None):
+        self.db_path = db_path
+        self.metrics = metrics
+        self.variants = variants
+        self.ttl_seconds = ttl_seconds
+        self.max_signatures = max_signatures
+        self.hits = 0
+        self.misses = 0
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reports (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    signature TEXT NOT NULL,
+                    report TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_signature ON reports (signature, created_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS signatures (
+                    signature TEXT PRIMARY KEY,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_signatures_used ON signatures (last_used)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def get(self, signature):
+        """签名下的有效版本已满 N 个时随机返回一个，否则返回 None（继续生成以积累多样性）"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT report FROM reports WHERE signature = ? AND created_at > ?",
+                (signature, time.time() - self.ttl_seconds)
+            ).fetchall()
+            if len(rows) < self.variants:
+                self.misses += 1
+                if self.metrics:
+                    self.metrics.inc('cache_lookups_total', cache='report', result='miss')
+                return None
+            conn.execute("UPDATE signatures SET last_used = ? WHERE signature = ?", (time.time(), signature))
+        finally:
+            conn.close()
+        self.hits += 1
+        if self.metrics:
+            self.metrics.inc('cache_lookups_total', cache='report', result='hit')
+        return json.loads(random.choice(rows)[0])
+
+    def variant_count(self, signature):
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT COUNT(*) FROM reports WHERE signature = ? AND created_at > ?",
+                (signature, time.time() - self.ttl_seconds)
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def put(self, signature, report):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO reports (signature, report, created_at) VALUES (?, ?, ?)",
+                (signature, json.dumps(report, ensure_ascii=False), now)
+            )
+            conn.execute("INSERT OR REPLACE INTO signatures (signature, last_used) VALUES (?, ?)", (signature, now))
+            # 每个签名只保留最新的 N 个版本
+            conn.execute(
+                "DELETE FROM reports WHERE signature = ? AND id NOT IN ("
+                "SELECT id FROM reports WHERE signature = ? ORDER BY created_at DESC LIMIT ?)",
+                (signature, signature, self.variants)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        # 写入时偶尔做一次全局淘汰，避免单独的定时任务
+        if random.random() < 0.01:
+            self.evict()
+
+    def evict(self):
+        """清理过期版本，并按最近使用时间淘汰超出上限的签名"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM reports WHERE created_at <= ?", (time.time() - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM signatures WHERE signature IN ("
+                "SELECT signature FROM signatures ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_signatures,)
+            )
+            conn.execute("DELETE FROM reports WHERE signature NOT IN (SELECT signature FROM signatures)")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            signatures = conn.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+            reports = conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+        finally:
+            conn.close()
+        return {'signatures': signatures, 'reports': reports, 'hits': self.hits, 'misses': self.misses}
+
+
+def most_common_signatures(readings, top, report_format='markdown'):
+    """从已有订单中统计出现最多的签名"""
+    counter = Counter()
+    examples = {}
+    for reading in readings:
+        chart = reading.get('chart')
+        if not chart:
+            continue
+        signature = chart_signature(chart, reading.get('gender', 'female'), report_format)
+        counter[signature] += 1
+        examples.setdefault(signature, (chart, reading.get('gender', 'female')))
+    return [(signature, examples[signature], count) for signature, count in counter.most_common(top)]
+
+
+def warm_up(cache, generator, readings, top=100, report_format=None):
+    """为最常见的签名预生成报告（默认用 generator 的报告格式），直到每个签名都有 N 个版本"""
+    report_format = report_format or generator.report_format
+    generated = 0
+    for signature, (chart, gender), count in most_common_signatures(readings, top, report_format):
+        missing = cache.variants - cache.variant_count(signature)
+        for _ in range(max(0, missing)):
+            report = generator._generate_text_report(chart, gender, report_format)
+            if all(report.values()):
+                cache.put(signature, report)
+                generated += 1
+        print(f"[WARM] {signature} (seen {count}x): {max(0, missing)} generated")
+    cache.evict()
+    return generated
+
+
+if __name__ == '__main__':
+    # 用法: python report_cache.py warm --top 100 [--format markdown|json] [--base-url http://127.0.0.1:8000/v1]
+    parser = argparse.ArgumentParser(description='Report cache maintenance')
+    parser.add_argument('command', choices=['warm', 'evict', 'stats'])
+    parser.add_argument('--top', type=int, default=100)
+    parser.add_argument('--variants', type=int, default=int(os.getenv('REPORT_CACHE_VARIANTS', 3)))
+    parser.add_argument('--db', default=os.path.join(os.getenv('DATA_DIR', 'data'), 'report_cache.db'))
+    parser.add_argument('--readings', default='readings')
+    parser.add_argument('--base-url', default=None, help='OpenAI-compatible endpoint, e.g. a local mock')
+    parser.add_argument('--format', choices=['markdown', 'json'], default=None, help='Report format to warm (default: REPORT_FORMAT)')
+    args = parser.parse_args()
+
+    cache = ReportCache(args.db, variants=args.variants)
+    if args.command == 'stats':
+        print(json.dumps(cache.stats(), indent=2))
+    elif args.command == 'evict':
+        cache.evict()
+        print(json.dumps(cache.stats(), indent=2))
+    else:
+        from dotenv import load_dotenv
+        from report_generator import ReportGenerator
+        from storage import create_store
+
+        load_dotenv()
+        generator = ReportGenerator(api_key=os.getenv('OPENAI_API_KEY'))
+        if args.base_url:
+            generator.base_url = args.base_url.rstrip('/')
+        total = warm_up(cache, generator, create_store(readings_dir=args.readings).iter_all(), args.top, args.format)
+        print(f"Generated {total} reports")
@@ -1,131 +1,430 @@
-import requests
-import os
-import json
-
-class ReportGenerator:
-    def __init__(self, api_key=None):
-        self.api_key = api_key or os.getenv('OPENAI_API_KEY')
-        self.base_url = "https://api.openai.com/v1"
-    
-    def generate_full_report_with_image(self, chart_data, gender='female'):
-        text_report = self._generate_text_report(chart_data, gender)
-        image_url = self._generate_soulmate_image(text_report['soulmate_appearance'], gender)
-        return {**text_report, 'hd_image_url': image_url, 'blur_image_url': image_url}
-    
-    def _generate_text_report(self, chart_data, gender):
-        prompt = self._build_prompt(chart_data, gender)
-        try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            data = {
-                "model": "gpt-4o-mini",
-                "messages": [
-                    {"role": "system", "content": "You are a professional astrologer. Be specific, warm, mystical. Output in English only."},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.8,
-                "max_tokens": 2000
-            }
-            response = requests.post(f"{self.base_url}/chat/completions", headers=headers, json=data, timeout=60)
-            response.raise_for_status()
-            content = response.json()['choices'][0]['message']['content']
-            return self._parse_response(content)
-        except Exception as e:
-            raise Exception(f"AI report generation failed: {str(e)}")
-    
-    def _build_prompt(self, chart_data, gender):
-        return f"""Based on this birth chart, create a soulmate profile.
-
-Chart: Sun {chart_data['sun']['sign']}, Moon {chart_data['moon']['sign']}, Venus {chart_data['venus']['sign']}, Mars {chart_data['mars']['sign']}, Rising {chart_data['rising']['sign']}, 7th House {chart_data['house7']['sign']}
-
-User gender: {gender}
-
-Format:
-## PERSONALITY_ANALYSIS ##
-(2-3 sentences)
-## LOVE_APPROACH ##
-(3-4 sentences)
-## SOULMATE_APPEARANCE ##
-(4-5 sentences, specific)
-## SOULMATE_PERSONALITY ##
-(5-6 traits)
-## SOULMATE_CAREER ##
-(4-5 fields)
-## MEETING_PLACES ##
-(5-6 places)
-## BEST_TIMING ##
-(2-3 months in 2025)
-## COMPATIBILITY_TIPS ##
-(3-4 tips)"""
-    
-    def _parse_response(self, content):
-        sections = {}
-        current_section = None
-        current_content = []
-        for line in content.split('\n'):
-            line = line.strip()
-            if line.startswith('##') and line.endswith('##'):
-                if current_section:
-                    sections[current_section] = '\n'.join(current_content).strip()
-                current_section = line.replace('#', '').strip().lower().replace(' ', '_')
-                current_content = []
-            else:
-                if line:
-                    current_content.append(line)
-        if current_section:
-            sections[current_section] = '\n'.join(current_content).strip()
-        return {
-            'personality_analysis': sections.get('personality_analysis', ''),
-            'love_approach': sections.get('love_approach', ''),
-            'soulmate_appearance': sections.get('soulmate_appearance', ''),
-            'soulmate_personality': sections.get('soulmate_personality', ''),
-            'soulmate_career': sections.get('soulmate_career', ''),
-            'meeting_places': sections.get('meeting_places', ''),
-            'best_timing': sections.get('best_timing', ''),
-            'compatibility_tips': sections.get('compatibility_tips', '')
-        }
-    
-    def _generate_soulmate_image(self, appearance_description, gender):
-        base_prompt = "Portrait photo of an attractive man, " if gender == 'female' else "Portrait photo of an attractive woman, "
-        key_features = appearance_description[:200] if appearance_description else "warm smile, kind eyes"
-        full_prompt = f"{base_prompt}{key_features} Professional photography, natural lighting, warm smile, soft bokeh background, cinematic quality, photo-realistic"
-        try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            data = {
-                "model": "dall-e-3",
-                "prompt": full_prompt,
-                "size": "1024x1024",
-                "quality": "standard",
-                "n": 1
-            }
-            response = requests.post(f"{self.base_url}/images/generations", headers=headers, json=data, timeout=60)
-            response.raise_for_status()
-            return response.json()['data'][0]['url']
-        except Exception as e:
-            print(f"Image generation failed: {str(e)}")
-            return "https://via.placeholder.com/1024x1024?text=Soulmate"
-    
-    def create_preview_from_full(self, full_data):
-        return {
-            'personality_analysis': full_data['personality_analysis'],
-            'love_approach': full_data['love_approach'][:200] + "..." if len(full_data.get('love_approach', '')) > 200 else full_data.get('love_approach', ''),
-            'soulmate_appearance': self._blur_text(full_data['soulmate_appearance']),
-            'soulmate_personality': self._blur_text(full_data['soulmate_personality']),
-            'soulmate_career': "Unlock to reveal",
-            'meeting_places': "Unlock to reveal",
-            'best_timing': "2025 (Unlock to reveal)",
-            'compatibility_tips': self._blur_text(full_data.get('compatibility_tips', ''), 0.3),
-            'blur_image_url': full_data['blur_image_url']
-        }
-    
-    def _blur_text(self, text, keep_ratio=0.4):
-        if not text:
-            return "Unlock to reveal"
-        words = text.split()
-        keep_count = max(3, int(len(words) * keep_ratio))
-        return ' '.join(words[:keep_count]) + " (Unlock to reveal)"
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from openai_client import OpenAIClient, CircuitOpenError
+from report_cache import chart_signature
+
+REPORT_SECTIONS = [
+    'personality_analysis',
+    'love_approach',
+    'soulmate_appearance',
+    'soulmate_personality',
+    'soulmate_career',
+    'meeting_places',
+    'best_timing',
+    'compatibility_tips'
+]
+
+REPORT_FORMATS = ('markdown', 'json')
+
+# 结构化输出模式的段落：(字段, 字数上限, 内容说明)
+# soulmate_appearance 放在最前，流式生成时可以尽早发起图片请求
+STRUCTURED_SECTIONS = [
+    ('soulmate_appearance', 60, "the soulmate's physical appearance, specific"),
+    ('personality_analysis', 45, "the user's love personality"),
+    ('love_approach', 55, 'how the user approaches love'),
+    ('soulmate_personality', 35, "5-6 of the soulmate's personality traits"),
+    ('soulmate_career', 30, "4-5 of the soulmate's likely career fields"),
+    ('meeting_places', 40, '5-6 places where they may meet'),
+    ('best_timing', 35, '2-3 months in 2025'),
+    ('compatibility_tips', 50, '3-4 compatibility tips')
+]
+SECTION_WORD_BUDGETS = {name: budget for name, budget, _ in STRUCTURED_SECTIONS}
+SECTION_GUIDES = {name: guide for name, _, guide in STRUCTURED_SECTIONS}
+
+_JSON_FIELD_START = re.compile(r'"(\w+)"\s*:\s*"')
+
+
+def report_schema(sections):
+    """只包含指定段落的 JSON schema（字数上限写在 description 里）"""
+    return {
+        'type': 'object',
+        'properties': {
+            name: {'type': 'string', 'description': f'{SECTION_GUIDES[name]}. At most {SECTION_WORD_BUDGETS[name]} words.'}
+            for name in sections
+        },
+        'required': list(sections),
+        'additionalProperties': False
+    }
+
+
+def _string_end(text, start):
+    """从 start 开始找 JSON 字符串的结束引号，未结束时返回 None"""
+    i = start
+    while i < len(text):
+        if text[i] == '\\':
+            i += 2
+        elif text[i] == '"':
+            return i
+        else:
+            i += 1
+    return None
+
+
+class JsonSectionParser:
+    """
+    结构化输出的解析：feed 时增量识别已完整的字符串字段并回调 on_section（流式下尽早拿到段落），
+    close 时对整个 JSON 做一次解析和校验，返回 (sections, missing)
+    """
+
+    def __init__(self, sections, on_section=None):
+        self.sections = list(sections)
+        self.on_section = on_section
+        self._buffer = ''
+        self._pos = 0
+        self._scanned = {}
+
+    def feed(self, text):
+        self._buffer += text
+        while True:
+            match = _JSON_FIELD_START.search(self._buffer, self._pos)
+            if not match:
+                return
+            end = _string_end(self._buffer, match.end())
+            if end is None:
+                return
+            self._pos = end + 1
+            name = match.group(1)
+            if name in self.sections and name not in self._scanned:
+                try:
+                    value = json.loads(self._buffer[match.end() - 1:end + 1]).strip()
+                except ValueError:
+                    continue
+                self._scanned[name] = value
+                if value and self.on_section:
+                    self.on_section(name, value)
+
+    def close(self):
+        try:
+            data = json.loads(self._buffer)
+        except ValueError:
+            # 输出被截断时保留已经完整的字段
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+
+        sections = {}
+        for name in self.sections:
+            value = data.get(name, self._scanned.get(name))
+            if isinstance(value, str) and value.strip():
+                sections[name] = value.strip()
+                if name not in self._scanned and self.on_section:
+                    self.on_section(name, sections[name])
+        missing = [name for name in self.sections if name not in sections]
+        return sections, missing
+
+
+class SectionParser:
+    """增量解析 ## SECTION ## 格式，每个 section 结束时回调 on_section(name, content)"""
+
+    def __init__(self, on_section=None):
+        self.on_section = on_section
+        self.sections = {}
+        self._buffer = ''
+        self._current_section = None
+        self._current_content = []
+
+    def feed(self, text):
+        self._buffer += text
+        while '\n' in self._buffer:
+            line, self._buffer = self._buffer.split('\n', 1)
+            self._process_line(line)
+
+    def close(self):
+        if self._buffer:
+            self._process_line(self._buffer)
+            self._buffer = ''
+        self._close_section()
+        return self.sections
+
+    def _process_line(self, line):
+        line = line.strip()
+        if line.startswith('##') and line.endswith('##'):
+            self._close_section()
+            self._current_section = line.replace('#', '').strip().lower().replace(' ', '_')
+            self._current_content = []
+        elif line:
+            self._current_content.append(line)
+
+    def _close_section(self):
+        if self._current_section:
+            content = '\n'.join(self._current_content).strip()
+            self.sections[self._current_section] = content
+            if self.on_section:
+                self.on_section(self._current_section, content)
+        self._current_section = None
+        self._current_content = []
+
+
+class ReportGenerator:
+    def __init__(self, api_key=None, stream=False, client=None, report_cache=None, base_url=None, report_format=None):
+        self.api_key = api_key or os.getenv('OPENAI_API_KEY')
+        # 可指向兼容 OpenAI 的代理或本地压测桩服务
+        self.base_url = (base_url or os.getenv('OPENAI_BASE_URL') or "https://api.openai.com/v1").rstrip('/')
+        # 共享连接池 + 重试的 HTTP 客户端
+        self.client = client or OpenAIClient()
+        # 可选：按星盘签名缓存文字报告（ReportCache）
+        self.report_cache = report_cache
+        # 流式模式：SOULMATE_APPEARANCE 一生成完就并行发起图片请求
+        self.stream = stream
+        # markdown：## SECTION ## 自由文本；json：JSON schema 结构化输出，每段有字数上限
+        self.report_format = report_format or os.getenv('REPORT_FORMAT', 'markdown')
+    
+    def generate_full_report_with_image(self, chart_data, gender='female', stream=None, on_section=None, report_format=None):
+        if stream is None:
+            stream = self.stream
+        report_format = report_format or self.report_format
+        if report_format not in REPORT_FORMATS:
+            raise ValueError(f"Unknown report format: {report_format}")
+
+        signature = chart_signature(chart_data, gender, report_format) if self.report_cache else None
+        cached = self.report_cache.get(signature) if signature else None
+        if cached:
+            text_report = self._normalize_sections(cached)
+            if on_section:
+                for name in REPORT_SECTIONS:
+                    on_section(name, text_report[name])
+            image_url = self._generate_soulmate_image(text_report['soulmate_appearance'], gender)
+            return self._with_image(text_report, image_url)
+
+        if not stream:
+            text_report = self._generate_text_report(chart_data, gender, report_format)
+            self._cache_text_report(signature, text_report)
+            if on_section:
+                for name in REPORT_SECTIONS:
+                    on_section(name, text_report[name])
+            image_url = self._generate_soulmate_image(text_report['soulmate_appearance'], gender)
+            return self._with_image(text_report, image_url)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            image_future = None
+
+            def handle_section(name, content):
+                nonlocal image_future
+                if name == 'soulmate_appearance' and image_future is None:
+                    image_future = executor.submit(self._generate_soulmate_image, content, gender)
+                if on_section:
+                    on_section(name, content)
+
+            text_report = self._stream_text_report(chart_data, gender, handle_section, report_format)
+            self._cache_text_report(signature, text_report)
+            if image_future is None:
+                image_future = executor.submit(self._generate_soulmate_image, text_report['soulmate_appearance'], gender)
+            image_url = image_future.result()
+        return self._with_image(text_report, image_url)
+
+    @staticmethod
+    def _with_image(text_report, image_url):
+        """图片生成失败时不再用占位图：image_status=pending，由调用方排队稍后生成（见 generate_image）"""
+        return {
+            **text_report,
+            'hd_image_url': image_url,
+            'blur_image_url': image_url,
+            'image_status': 'ready' if image_url else 'pending'
+        }
+    
+    def _cache_text_report(self, signature, text_report):
+        # 只缓存完整的报告
+        if signature and all(text_report.values()):
+            self.report_cache.put(signature, text_report)
+
+    def _generate_text_report(self, chart_data, gender, report_format='markdown'):
+        if report_format == 'json':
+            return self._structured_text_report(chart_data, gender)
+        prompt = self._build_prompt(chart_data, gender)
+        try:
+            content = self._complete(self._chat_payload(prompt))
+            return self._parse_response(content)
+        except CircuitOpenError:
+            # 熔断中：原样抛出，调用方据此快速返回 503
+            raise
+        except Exception as e:
+            raise Exception(f"AI report generation failed: {str(e)}")
+
+    def _stream_text_report(self, chart_data, gender, on_section=None, report_format='markdown'):
+        if report_format == 'json':
+            return self._structured_text_report(chart_data, gender, on_section, stream=True)
+        prompt = self._build_prompt(chart_data, gender)
+        try:
+            parser = SectionParser(on_section)
+            self._stream_completion(self._chat_payload(prompt), parser.feed)
+            return self._normalize_sections(parser.close())
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            raise Exception(f"AI report generation failed: {str(e)}")
+
+    def _structured_text_report(self, chart_data, gender, on_section=None, stream=False):
+        """结构化输出：一次请求全部段落，缺失或为空的段落只补请求一次"""
+        report = {}
+        sections = [name for name, _, _ in STRUCTURED_SECTIONS]
+        try:
+            for attempt in range(2):
+                data = self._chat_payload(
+                    self._build_structured_prompt(chart_data, gender, sections),
+                    max_tokens=self._structured_max_tokens(sections),
+                    response_format={
+                        "type": "json_schema",
+                        "json_schema": {"name": "soulmate_report", "strict": True, "schema": report_schema(sections)}
+                    }
+                )
+                parser = JsonSectionParser(sections, on_section)
+                if stream:
+                    self._stream_completion(data, parser.feed)
+                else:
+                    parser.feed(self._complete(data))
+                parsed, missing = parser.close()
+                report.update(parsed)
+                if not missing:
+                    break
+                print(f"[REPORT] Structured output missing {missing}" + (", re-requesting" if attempt == 0 else ""))
+                sections = missing
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            raise Exception(f"AI report generation failed: {str(e)}")
+        return self._normalize_sections(report)
+
+    @staticmethod
+    def _structured_max_tokens(sections):
+        # 约 1.4 token/词，另加 JSON 键名和标点
+        return int(sum(SECTION_WORD_BUDGETS[name] for name in sections) * 1.4) + 20 * len(sections)
+
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _complete(self, data):
+        response = self.client.post(f"{self.base_url}/chat/completions", endpoint='chat', headers=self._headers(), json=data)
+        return response.json()['choices'][0]['message']['content']
+
+    def _stream_completion(self, data, on_delta):
+        """流式请求，逐个 delta 回调 on_delta(text)"""
+        data = {**data, "stream": True}
+        with self.client.post(f"{self.base_url}/chat/completions", endpoint='chat', headers=self._headers(), json=data, stream=True) as response:
+            error = None
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    payload = line[len('data:'):].strip()
+                    if payload == '[DONE]':
+                        break
+                    choices = json.loads(payload).get('choices') or [{}]
+                    delta = choices[0].get('delta', {}).get('content')
+                    if delta:
+                        on_delta(delta)
+            except requests.RequestException as e:
+                # 读取超时在 iter_lines 里表现为 ConnectionError；上游卡住的流也要让熔断器看到
+                error = e
+                raise
+            finally:
+                self.client.record_stream_end('chat', error)
+
+    def _chat_payload(self, prompt, max_tokens=2000, response_format=None):
+        payload = {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {"role": "system", "content": "You are a professional astrologer. Be specific, warm, mystical. Output in English only."},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.8,
+            "max_tokens": max_tokens
+        }
+        if response_format:
+            payload["response_format"] = response_format
+        return payload
+    
+    def _build_prompt(self, chart_data, gender):
+        return f"""Based on this birth chart, create a soulmate profile.
+
+Chart: Sun {chart_data['sun']['sign']}, Moon {chart_data['moon']['sign']}, Venus {chart_data['venus']['sign']}, Mars {chart_data['mars']['sign']}, Rising {chart_data['rising']['sign']}, 7th House {chart_data['house7']['sign']}
+
+User gender: {gender}
+
+Format:
+## PERSONALITY_ANALYSIS ##
+(2-3 sentences)
+## LOVE_APPROACH ##
+(3-4 sentences)
+## SOULMATE_APPEARANCE ##
+(4-5 sentences, specific)
+## SOULMATE_PERSONALITY ##
+(5-6 traits)
+## SOULMATE_CAREER ##
+(4-5 fields)
+## MEETING_PLACES ##
+(5-6 places)
+## BEST_TIMING ##
+(2-3 months in 2025)
+## COMPATIBILITY_TIPS ##
+(3-4 tips)"""
+    
+    def _build_structured_prompt(self, chart_data, gender, sections):
+        fields = '\n'.join(
+            f"- {name}: {SECTION_GUIDES[name]} (at most {SECTION_WORD_BUDGETS[name]} words)" for name in sections
+        )
+        return f"""Based on this birth chart, create a soulmate profile.
+
+Chart: Sun {chart_data['sun']['sign']}, Moon {chart_data['moon']['sign']}, Venus {chart_data['venus']['sign']}, Mars {chart_data['mars']['sign']}, Rising {chart_data['rising']['sign']}, 7th House {chart_data['house7']['sign']}
+
+User gender: {gender}
+
+Return a JSON object with these fields and stay within the word limits:
+{fields}"""
+
+    def _parse_response(self, content):
+        parser = SectionParser()
+        parser.feed(content)
+        return self._normalize_sections(parser.close())
+
+    def _normalize_sections(self, sections):
+        return {name: sections.get(name, '') for name in REPORT_SECTIONS}
+    
+    def _generate_soulmate_image(self, appearance_description, gender):
+        try:
+            return self.generate_image(appearance_description, gender)
+        except Exception as e:
+            print(f"[IMAGE] Generation failed, image left pending: {str(e)}")
+            return None
+
+    def generate_image(self, appearance_description, gender):
+        """生成画像，返回临时 URL；失败时抛出（熔断打开时为 CircuitOpenError）"""
+        base_prompt = "Portrait photo of an attractive man, " if gender == 'female' else "Portrait photo of an attractive woman, "
+        key_features = appearance_description[:200] if appearance_description else "warm smile, kind eyes"
+        full_prompt = f"{base_prompt}{key_features} Professional photography, natural lighting, warm smile, soft bokeh background, cinematic quality, photo-realistic"
+        data = {
+            "model": "dall-e-3",
+            "prompt": full_prompt,
+            "size": "1024x1024",
+            "quality": "standard",
+            "n": 1
+        }
+        response = self.client.post(f"{self.base_url}/images/generations", endpoint='image', headers=self._headers(), json=data)
+        return response.json()['data'][0]['url']
+    
+    def create_preview_from_full(self, full_data):
+        return {
+            'personality_analysis': full_data['personality_analysis'],
+            'love_approach': full_data['love_approach'][:200] + "..." if len(full_data.get('love_approach', '')) > 200 else full_data.get('love_approach', ''),
+            'soulmate_appearance': self._blur_text(full_data['soulmate_appearance']),
+            'soulmate_personality': self._blur_text(full_data['soulmate_personality']),
+            'soulmate_career': "Unlock to reveal",
+            'meeting_places': "Unlock to reveal",
+            'best_timing': "2025 (Unlock to reveal)",
+            'compatibility_tips': self._blur_text(full_data.get('compatibility_tips', ''), 0.3),
+            'blur_image_url': full_data['blur_image_url']
+        }
+    
+    def _blur_text(self, text, keep_ratio=0.4):
+        if not text:
+            return "Unlock to reveal"
+        words = text.split()
+        keep_count = max(3, int(len(words) * keep_ratio))
+        return ' '.join(words[:keep_count]) + " (Unlock to reveal)"
@@ -0,0 +1,40 @@
+import time
+import threading
+
+
+class LazyService:
+    """
+    首次使用时才构建的服务（线程安全，只构建一次）
+    属性访问透明转发给真实对象，调用方不需要区分；构建耗时记录在 init_seconds
+    """
+
+    def __init__(self, name, factory, on_ready=None):
+        self.name = name
+        self._factory = factory
+        self._on_ready = on_ready
+        self._instance = None
+        self._lock = threading.Lock()
+        self.init_seconds = None
+
+    @property
+    def ready(self):
+        return self._instance is not None
+
+    def get(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    start = time.perf_counter()
+                    instance = self._factory()
+                    self.init_seconds = time.perf_counter() - start
+                    self._instance = instance
+                    print(f"[INIT] {self.name} ready in {self.init_seconds:.3f}s")
+                    if self._on_ready:
+                        self._on_ready(self)
+                instance = self._instance
+        return instance
+
+    def __getattr__(self, attr):
+        # 只有常规属性查找失败时才会进入这里
+        return getattr(self.get(), attr)
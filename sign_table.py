@@ -0,0 +1,286 @@
+"""
+行星换座表：太阳/月亮/水星/金星/火星/木星在 1900–2100 年间每次进入新星座的时刻
+只需要行星星座（不需要度数、宫位、上升）时，二分查找代替构建完整的 AstrologicalSubject；
+查询只用标准库（mmap + memoryview），不导入 kerykeion / swisseph / numpy
+
+文件格式（小端，8 字节对齐）：
+    文件头    magic 'SIGN', version, 行星数, start_jd, end_jd
+    目录      每个行星 (名称 8 字节, 条目数, 时刻数组偏移, 星座数组偏移)
+    数据      每个行星 count 个 float64 时刻 + count 个 uint8 星座序号
+从 times[i]（含）起行星处于星座 signs[i]，直到 times[i+1]
+时刻与 kerykeion 一致：由出生时间换算的 UTC 儒略日（直接作为 swe.calc 的参数）
+
+    python sign_table.py build               # 生成 data/sign_ingress.bin（约一分钟）
+    python sign_table.py verify --samples 500
+"""
+import os
+import sys
+import mmap
+import random
+import struct
+import bisect
+import argparse
+from datetime import datetime, timedelta, timezone
+
+# 与 kerykeion 的星座缩写一致
+SIGNS = ['Ari', 'Tau', 'Gem', 'Can', 'Leo', 'Vir', 'Lib', 'Sco', 'Sag', 'Cap', 'Aqu', 'Pis']
+# (名称, swisseph 编号, 扫描步长/天)：步长内行星最多换座一次（月亮每天约 13°）
+PLANETS = [
+    ('sun', 0, 1.0),
+    ('moon', 1, 0.25),
+    ('mercury', 2, 0.5),
+    ('venus', 3, 0.5),
+    ('mars', 4, 1.0),
+    ('jupiter', 5, 1.0)
+]
+MAGIC = b'SIGN'
+VERSION = 1
+HEADER = struct.Struct('<4sHHdd')      # magic, version, 行星数, start_jd, end_jd
+DIRECTORY = struct.Struct('<8sIQQ')    # 名称, 条目数, 时刻偏移, 星座偏移
+# 换座时刻的二分精度（天），约 0.01 秒
+PRECISION = 1e-7
+UNIX_EPOCH_JD = 2440587.5
+DEFAULT_PATH = os.path.join(os.getenv('DATA_DIR', 'data'), 'sign_ingress.bin')
+
+
+def julian_day(utc):
+    """UTC datetime -> 儒略日（与 swe.julday(年, 月, 日, 时 + 分/60) 相同）"""
+    if utc.tzinfo is not None:
+        utc = utc.astimezone(timezone.utc).replace(tzinfo=None)
+    return UNIX_EPOCH_JD + (utc - datetime(1970, 1, 1)).total_seconds() / 86400
+
+
+def birth_julian_day(birth_data, tz_str):
+    """出生地本地时间 -> 儒略日；时区换算与 kerykeion 相同（夏令时切换时不存在/有歧义的时刻会抛异常）"""
+    import pytz
+
+    local = pytz.timezone(tz_str).localize(datetime(
+        int(birth_data['year']), int(birth_data['month']), int(birth_data['day']),
+        int(birth_data['hour']), int(birth_data['minute']), 0
+    ), is_dst=None)
+    return julian_day(local)
+
+
+class SignIngressTable:
+    """只读的换座表（mmap，多进程共享页缓存）"""
+
+    def __init__(self, path=DEFAULT_PATH):
+        if sys.byteorder != 'little':
+            raise RuntimeError('Sign ingress table requires a little-endian platform')
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, self.start_jd, self.end_jd = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'Not a sign ingress table: {path}')
+
+        view = memoryview(self._map)
+        self._planets = {}
+        for i in range(count):
+            name, entries, times_offset, signs_offset = DIRECTORY.unpack_from(self._map, HEADER.size + i * DIRECTORY.size)
+            self._planets[name.rstrip(b'\0').decode('ascii')] = (
+                view[times_offset:times_offset + entries * 8].cast('d'),
+                view[signs_offset:signs_offset + entries]
+            )
+
+    @property
+    def planets(self):
+        return list(self._planets)
+
+    def covers(self, jd):
+        return self.start_jd <= jd < self.end_jd
+
+    def sign(self, planet, jd):
+        """某一时刻行星所在星座；超出表的范围时抛出 ValueError"""
+        if not self.covers(jd):
+            raise ValueError(f'Julian day {jd} is outside the sign table range')
+        times, signs = self._planets[planet]
+        return SIGNS[signs[bisect.bisect_right(times, jd) - 1]]
+
+    def signs(self, jd):
+        """{'sun': 'Leo', 'moon': ..., ...}"""
+        return {planet: self.sign(planet, jd) for planet in self._planets}
+
+    def birth_signs(self, birth_data, tz_str):
+        """出生数据（本地时间）-> 各行星星座"""
+        return self.signs(birth_julian_day(birth_data, tz_str))
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'bytes': len(self._map),
+            'start_jd': self.start_jd,
+            'end_jd': self.end_jd,
+            'ingresses': {planet: len(times) for planet, (times, _) in self._planets.items()}
+        }
+
+
+def _ingresses(planet_id, step, start_jd, end_jd):
+    """
+    逐步扫描行星所在星座，星座变化时在步长内二分出换座时刻
+    步长内黄经速度变号（留/逆行折返）时先二分出折返点，把步长切成两段单调区间，
+    折返点贴着星座边界、只在另一个星座停留很短时间的情况也不会漏掉
+    """
+    import swisseph as swe
+
+    flags = swe.FLG_SWIEPH + swe.FLG_SPEED
+
+    def state(jd):
+        position = swe.calc(jd, planet_id, flags)[0]
+        return min(int(position[0] // 30), 11), position[3] >= 0
+
+    def bisect_until(lo, hi, same):
+        while hi - lo > PRECISION:
+            mid = (lo + hi) / 2
+            if same(state(mid)):
+                lo = mid
+            else:
+                hi = mid
+        return hi
+
+    current, direct = state(start_jd)
+    times, signs = [start_jd], [current]
+    jd = start_jd
+    while jd < end_jd:
+        nxt = min(jd + step, end_jd)
+        sign, nxt_direct = state(nxt)
+        if nxt_direct != direct:
+            nxt = bisect_until(jd, nxt, lambda s: s[1] == direct)
+            sign, nxt_direct = state(nxt)
+        if sign == current:
+            jd, direct = nxt, nxt_direct
+            continue
+        jd = bisect_until(jd, nxt, lambda s: s[0] == current)
+        current, direct = state(jd)
+        times.append(jd)
+        signs.append(current)
+    return times, signs
+
+
+def build_table(path=DEFAULT_PATH, start_year=1900, end_year=2100):
+    """生成换座表（写临时文件后原子替换），返回各行星的换座次数"""
+    import swisseph as swe
+    import kerykeion
+    from pathlib import Path
+
+    swe.set_ephe_path(str(Path(kerykeion.__file__).parent.absolute() / "sweph"))
+    start_jd = julian_day(datetime(start_year, 1, 1))
+    end_jd = julian_day(datetime(end_year + 1, 1, 1))
+
+    tables = []
+    for name, planet_id, step in PLANETS:
+        times, signs = _ingresses(planet_id, step, start_jd, end_jd)
+        tables.append((name, times, signs))
+        print(f"[SIGNS] {name}: {len(times)} ingresses")
+
+    offset = HEADER.size + DIRECTORY.size * len(tables)
+    offset += -offset % 8
+    directory, blobs = [], []
+    for name, times, signs in tables:
+        times_offset = offset
+        signs_offset = times_offset + 8 * len(times)
+        offset = signs_offset + len(signs)
+        padding = -offset % 8
+        offset += padding
+        directory.append(DIRECTORY.pack(name.encode('ascii'), len(times), times_offset, signs_offset))
+        blobs.append(struct.pack(f'<{len(times)}d', *times) + bytes(signs) + b'\0' * padding)
+
+    head = HEADER.pack(MAGIC, VERSION, len(tables), start_jd, end_jd) + b''.join(directory)
+    head += b'\0' * (-len(head) % 8)
+
+    db_dir = os.path.dirname(path)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(head)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+    return {name: len(times) for name, times, _ in tables}
+
+
+class _FixedResolver:
+    """校验用：固定城市坐标，不依赖 gazetteer 和网络"""
+
+    LOCATIONS = {
+        'London': (51.50853, -0.12574, 'Europe/London', 'GB'),
+        'New York': (40.71427, -74.00597, 'America/New_York', 'US'),
+        'Tokyo': (35.6895, 139.69171, 'Asia/Tokyo', 'JP'),
+        'Sydney': (-33.86785, 151.20732, 'Australia/Sydney', 'AU'),
+        'Greenwich': (51.4769, 0.0005, 'UTC', 'GB')
+    }
+
+    def resolve(self, city, nation='US'):
+        lat, lng, tz_str, country = self.LOCATIONS[city]
+        return {'city': city, 'nation': country, 'lat': lat, 'lng': lng, 'tz_str': tz_str}
+
+
+def verify_table(table, samples=500, boundary_samples=200, seed=0):
+    """
+    与 AstroCalculator.calculate_birth_chart 对比：
+    随机出生时间（多个时区） + 换座时刻前后各 1 分钟（UTC），返回不一致的样本列表
+    """
+    from astro_calculator import AstroCalculator
+
+    calculator = AstroCalculator(resolver=_FixedResolver())
+    rng = random.Random(seed)
+    cases = []
+    start = datetime(1900, 1, 2)
+    span_minutes = int((datetime(2100, 12, 31) - start).total_seconds() // 60)
+    cities = [city for city in _FixedResolver.LOCATIONS if city != 'Greenwich']
+    for _ in range(samples):
+        cases.append((start + timedelta(minutes=rng.randrange(span_minutes)), rng.choice(cities)))
+
+    # 换座边界：kerykeion 的时间精度是分钟，取换座前后各 1 分钟
+    for _ in range(boundary_samples):
+        planet = rng.choice(table.planets)
+        times, _ = table._planets[planet]
+        ingress = times[rng.randrange(1, len(times))]
+        moment = datetime(1970, 1, 1) + timedelta(days=ingress - UNIX_EPOCH_JD)
+        moment = moment.replace(second=0, microsecond=0)
+        cases.append((moment, 'Greenwich'))
+        cases.append((moment + timedelta(minutes=2), 'Greenwich'))
+
+    mismatches = []
+    for moment, city in cases:
+        birth_data = {
+            'name': 'Verify', 'year': moment.year, 'month': moment.month, 'day': moment.day,
+            'hour': moment.hour, 'minute': moment.minute, 'city': city
+        }
+        try:
+            expected = calculator.calculate_birth_chart(birth_data)
+        except Exception:
+            # 夏令时切换造成的不存在/歧义时刻，两边都不支持
+            continue
+        actual = table.birth_signs(birth_data, _FixedResolver.LOCATIONS[city][2])
+        for planet, sign in actual.items():
+            if expected[planet]['sign'] != sign:
+                mismatches.append({
+                    'time': moment.isoformat(), 'city': city, 'planet': planet,
+                    'table': sign, 'chart': expected[planet]['sign']
+                })
+    return len(cases), mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Planet sign ingress table')
+    parser.add_argument('command', choices=['build', 'verify', 'stats'])
+    parser.add_argument('--path', default=DEFAULT_PATH)
+    parser.add_argument('--start-year', type=int, default=1900)
+    parser.add_argument('--end-year', type=int, default=2100)
+    parser.add_argument('--samples', type=int, default=500)
+    parser.add_argument('--boundary-samples', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        counts = build_table(args.path, args.start_year, args.end_year)
+        print(f"[SIGNS] Wrote {sum(counts.values())} ingresses to {args.path}")
+    elif args.command == 'stats':
+        print(SignIngressTable(args.path).stats())
+    else:
+        total, mismatches = verify_table(SignIngressTable(args.path), args.samples, args.boundary_samples)
+        for mismatch in mismatches[:20]:
+            print(f"[SIGNS] Mismatch: {mismatch}")
+        print(f"[SIGNS] Checked {total} charts, {len(mismatches)} mismatches")
+        sys.exit(1 if mismatches else 0)
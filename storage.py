@@ -0,0 +1,852 @@
+import os
+import sys
+import json
+import uuid
+import time
+import fcntl
+import base64
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# 报告正文等大字段单独存放，元数据表只保留列表/筛选需要的列
+BLOB_FIELDS = ['full_report', 'preview', 'chart', 'email_payload']
+COLUMN_FIELDS = ['reading_id', 'email', 'name', 'created_at', 'paid', 'sent']
+META_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS reading_meta (
+        reading_id TEXT PRIMARY KEY,
+        email TEXT NOT NULL,
+        name TEXT,
+        created_at TEXT NOT NULL,
+        paid INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        change_seq INTEGER NOT NULL DEFAULT 0
+    )
+"""
+# 全局递增的变更序号：每次写入订单时分配，增量导出按它取“某个游标之后新增或修改的订单”
+CHANGE_SEQ_SQL = """
+    CREATE TABLE IF NOT EXISTS change_seq (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        value INTEGER NOT NULL
+    )
+"""
+
+
+def encode_cursor(created_at, reading_id):
+    raw = json.dumps([created_at, reading_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    created_at, reading_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    return created_at, reading_id
+
+
+def meta_filters(filters):
+    """
+    filters: status(pending/sent), paid(bool), email(子串), date_from / date_to(ISO 日期)
+    返回 (where 条件列表, 参数列表)
+    """
+    filters = filters or {}
+    where, params = [], []
+    if filters.get('status') == 'pending':
+        where.append('sent = 0')
+    elif filters.get('status') == 'sent':
+        where.append('sent = 1')
+    if filters.get('paid') is not None:
+        where.append('paid = ?')
+        params.append(int(bool(filters['paid'])))
+    if filters.get('email'):
+        where.append('email LIKE ?')
+        params.append(f"%{filters['email']}%")
+    if filters.get('date_from'):
+        where.append('created_at >= ?')
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        where.append('created_at <= ?')
+        params.append(filters['date_to'] + '\uffff')
+    return where, params
+
+
+def query_meta(conn, table, filters=None, cursor=None, limit=50):
+    """
+    在元数据表上做 keyset 分页（created_at DESC, reading_id DESC），filters 见 meta_filters
+    返回 (items, next_cursor)
+    """
+    where, params = meta_filters(filters)
+    if cursor:
+        created_at, reading_id = decode_cursor(cursor)
+        where.append('(created_at < ? OR (created_at = ? AND reading_id < ?))')
+        params += [created_at, created_at, reading_id]
+
+    sql = f"SELECT {', '.join(COLUMN_FIELDS)} FROM {table}"
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY created_at DESC, reading_id DESC LIMIT ?'
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+
+    items = [
+        {
+            'reading_id': row[0],
+            'email': row[1],
+            'name': row[2],
+            'created_at': row[3],
+            'paid': bool(row[4]),
+            'sent': bool(row[5])
+        }
+        for row in rows[:limit]
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(items[-1]['created_at'], items[-1]['reading_id'])
+    return items, next_cursor
+
+
+def query_changes(conn, table, since=0, until=None, filters=None, limit=500):
+    """
+    按变更序号升序分页：返回 change_seq 在 (since, until] 之间的订单元数据
+    items 额外带 change_seq，调用方用最后一条的序号作为下一页的 since
+    """
+    where, params = meta_filters(filters)
+    where.append('change_seq > ?')
+    params.append(since)
+    if until is not None:
+        where.append('change_seq <= ?')
+        params.append(until)
+
+    rows = conn.execute(
+        f"SELECT {', '.join(COLUMN_FIELDS)}, change_seq FROM {table} WHERE {' AND '.join(where)} "
+        "ORDER BY change_seq LIMIT ?",
+        params + [limit]
+    ).fetchall()
+    return [
+        {
+            'reading_id': row[0],
+            'email': row[1],
+            'name': row[2],
+            'created_at': row[3],
+            'paid': bool(row[4]),
+            'sent': bool(row[5]),
+            'change_seq': row[6]
+        }
+        for row in rows
+    ]
+
+
+def ensure_change_seq(conn, table):
+    """
+    给元数据表补 change_seq 列并初始化序号表（整个过程持有写锁，多进程同时启动也只迁移一次）
+    旧库里已有的行按 rowid 编号，序号从当前最大值继续
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if 'change_seq' not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+            conn.execute(f"UPDATE {table} SET change_seq = rowid")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_change ON {table} (change_seq)")
+        conn.execute(CHANGE_SEQ_SQL)
+        conn.execute(
+            f"INSERT OR IGNORE INTO change_seq (id, value) SELECT 0, COALESCE(MAX(change_seq), 0) FROM {table}"
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def next_change_seq(conn):
+    """分配下一个变更序号；须在写事务内调用，序号顺序才与提交顺序一致"""
+    conn.execute("UPDATE change_seq SET value = value + 1 WHERE id = 0")
+    return conn.execute("SELECT value FROM change_seq WHERE id = 0").fetchone()[0]
+
+
+def current_change_seq(conn):
+    row = conn.execute("SELECT value FROM change_seq WHERE id = 0").fetchone()
+    return row[0] if row else 0
+
+
+def upsert_meta(conn, reading):
+    conn.execute(
+        "INSERT OR REPLACE INTO reading_meta (reading_id, email, name, created_at, paid, sent, change_seq) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            reading['reading_id'],
+            reading.get('email', ''),
+            reading.get('name'),
+            reading.get('created_at', ''),
+            int(bool(reading.get('paid', False))),
+            int(bool(reading.get('sent', False))),
+            next_change_seq(conn)
+        )
+    )
+
+
+def count_meta(conn, table):
+    row = conn.execute(f"SELECT COUNT(*), COALESCE(SUM(sent = 0), 0) FROM {table}").fetchone()
+    return {'total': row[0], 'pending': row[1]}
+
+
+class ReadingStore:
+    """订单存储接口"""
+
+    def save(self, reading_data):
+        """保存新订单，返回 reading_id"""
+        raise NotImplementedError
+
+    def get(self, reading_id):
+        """读取订单，不存在时返回 None"""
+        raise NotImplementedError
+
+    def update(self, reading_id, updates):
+        """更新订单字段，成功返回 True"""
+        raise NotImplementedError
+
+    def iter_all(self):
+        """逐条遍历所有订单（不保证顺序）"""
+        raise NotImplementedError
+
+    def delete(self, reading_ids):
+        """从热存储中删除订单（归档后调用），返回删除条数"""
+        raise NotImplementedError
+
+    def all(self):
+        """获取所有订单，按创建时间倒序"""
+        readings = list(self.iter_all())
+        readings.sort(key=lambda x: x.get('created_at', ''), reverse=True)
+        return readings
+
+    def import_reading(self, reading):
+        """按原样导入已有订单（保留 reading_id / created_at），用于迁移"""
+        raise NotImplementedError
+
+    def import_readings(self, readings):
+        """批量导入，返回导入条数"""
+        count = 0
+        for reading in readings:
+            self.import_reading(reading)
+            count += 1
+        return count
+
+    def list_meta(self, filters=None, cursor=None, limit=50):
+        """分页读取订单元数据（不含报告正文），返回 (items, next_cursor)"""
+        raise NotImplementedError
+
+    def count_meta(self):
+        """订单总数 / 待发送数"""
+        raise NotImplementedError
+
+    def list_changes(self, since=0, until=None, filters=None, limit=500):
+        """按变更序号升序读取 (since, until] 之间新增或修改的订单元数据（带 change_seq）；删除不产生变更记录"""
+        raise NotImplementedError
+
+    def change_seq(self):
+        """当前最大变更序号（增量导出的快照上界）"""
+        raise NotImplementedError
+
+    def claim_send(self, reading_id, ttl=600):
+        """
+        原子地占用发送权，成功返回 True；同一订单只会有一个发送者拿到
+        超过 ttl 秒的占用视为发送进程崩溃后遗留，可以被重新占用
+        """
+        raise NotImplementedError
+
+    def release_send(self, reading_id):
+        """发送失败时释放占用，允许重试"""
+        raise NotImplementedError
+
+    @staticmethod
+    def _stamp(reading_data):
+        reading_data['reading_id'] = reading_data.get('reading_id') or str(uuid.uuid4())
+        reading_data['created_at'] = datetime.now().isoformat()
+        reading_data['paid'] = False
+        reading_data['sent'] = False
+        return reading_data
+
+
+class MetadataIndex:
+    """JSON 文件存储的轻量元数据索引（SQLite），保存/更新时增量维护"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(META_TABLE_SQL)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_meta_created ON reading_meta (created_at, reading_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_meta_sent ON reading_meta (sent, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_meta_email ON reading_meta (email)")
+            ensure_change_seq(conn, 'reading_meta')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def is_empty(self):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT 1 FROM reading_meta LIMIT 1").fetchone() is None
+        finally:
+            conn.close()
+
+    def upsert(self, reading):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            upsert_meta(conn, reading)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def delete(self, reading_ids):
+        conn = self._connect()
+        try:
+            conn.executemany("DELETE FROM reading_meta WHERE reading_id = ?", [(rid,) for rid in reading_ids])
+        finally:
+            conn.close()
+
+    def rebuild(self, readings):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            conn.execute("DELETE FROM reading_meta")
+            count = 0
+            for reading in readings:
+                if 'reading_id' in reading:
+                    upsert_meta(conn, reading)
+                    count += 1
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return count
+
+    def query(self, filters=None, cursor=None, limit=50):
+        conn = self._connect()
+        try:
+            return query_meta(conn, 'reading_meta', filters, cursor, limit)
+        finally:
+            conn.close()
+
+    def counts(self):
+        conn = self._connect()
+        try:
+            return count_meta(conn, 'reading_meta')
+        finally:
+            conn.close()
+
+    def changes(self, since=0, until=None, filters=None, limit=500):
+        conn = self._connect()
+        try:
+            return query_changes(conn, 'reading_meta', since, until, filters, limit)
+        finally:
+            conn.close()
+
+    def change_seq(self):
+        conn = self._connect()
+        try:
+            return current_change_seq(conn)
+        finally:
+            conn.close()
+
+
+class JsonFileStore(ReadingStore):
+    """
+    每个订单一个 JSON 文件（可选元数据索引，供后台分页查询）
+    写入先写临时文件再原子替换，读取方不会看到写了一半的文件；
+    update 按订单加文件锁（flock），多个进程/线程同时更新同一订单时不会互相覆盖
+    """
+
+    def __init__(self, readings_dir, index_path=None):
+        self.readings_dir = readings_dir
+        os.makedirs(readings_dir, exist_ok=True)
+        self.index = MetadataIndex(index_path) if index_path else None
+        if self.index and self.index.is_empty():
+            count = self.index.rebuild(self.iter_all())
+            if count:
+                print(f"[STORE] Indexed {count} existing readings")
+
+    def _path(self, reading_id):
+        return os.path.join(self.readings_dir, f'{reading_id}.json')
+
+    def _lock_path(self, reading_id):
+        return os.path.join(self.readings_dir, '.locks', f'{reading_id}.lock')
+
+    @contextmanager
+    def _locked(self, reading_id):
+        os.makedirs(os.path.join(self.readings_dir, '.locks'), exist_ok=True)
+        with open(self._lock_path(reading_id), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write(self, reading):
+        path = self._path(reading['reading_id'])
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(reading, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        if self.index:
+            self.index.upsert(reading)
+
+    def save(self, reading_data):
+        self._write(self._stamp(reading_data))
+        return reading_data['reading_id']
+
+    def get(self, reading_id):
+        filepath = self._path(reading_id)
+        if not os.path.exists(filepath):
+            return None
+
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def update(self, reading_id, updates):
+        with self._locked(reading_id):
+            reading = self.get(reading_id)
+            if not reading:
+                return False
+
+            reading.update(updates)
+            self._write(reading)
+        return True
+
+    def iter_all(self):
+        for filename in os.listdir(self.readings_dir):
+            if filename.endswith('.json'):
+                filepath = os.path.join(self.readings_dir, filename)
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    yield json.load(f)
+
+    def import_reading(self, reading):
+        self._write(reading)
+
+    def delete(self, reading_ids):
+        count = 0
+        for reading_id in reading_ids:
+            for path in (self._path(reading_id), self._claim_path(reading_id), self._lock_path(reading_id)):
+                try:
+                    os.remove(path)
+                    count += path.endswith('.json')
+                except FileNotFoundError:
+                    pass
+        if self.index:
+            self.index.delete(reading_ids)
+        return count
+
+    def list_meta(self, filters=None, cursor=None, limit=50):
+        if self.index:
+            return self.index.query(filters, cursor, limit)
+
+        # 没有索引时退化为全量扫描
+        conn = sqlite3.connect(':memory:')
+        try:
+            conn.execute(META_TABLE_SQL)
+            ensure_change_seq(conn, 'reading_meta')
+            for reading in self.iter_all():
+                if 'reading_id' in reading:
+                    upsert_meta(conn, reading)
+            return query_meta(conn, 'reading_meta', filters, cursor, limit)
+        finally:
+            conn.close()
+
+    def count_meta(self):
+        if self.index:
+            return self.index.counts()
+        readings = list(self.iter_all())
+        return {'total': len(readings), 'pending': sum(1 for r in readings if not r.get('sent'))}
+
+    def list_changes(self, since=0, until=None, filters=None, limit=500):
+        if not self.index:
+            raise ValueError('Incremental export requires the metadata index')
+        return self.index.changes(since, until, filters, limit)
+
+    def change_seq(self):
+        if not self.index:
+            raise ValueError('Incremental export requires the metadata index')
+        return self.index.change_seq()
+
+    def _claim_path(self, reading_id):
+        return os.path.join(self.readings_dir, '.claims', f'{reading_id}.lock')
+
+    def claim_send(self, reading_id, ttl=600):
+        os.makedirs(os.path.join(self.readings_dir, '.claims'), exist_ok=True)
+        path = self._claim_path(reading_id)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self._reclaim(path, ttl):
+                return False
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(datetime.now().isoformat())
+        return True
+
+    @staticmethod
+    def _reclaim(path, ttl):
+        """移走过期的占用文件；rename 是原子的，并发时只有一个进程能移走"""
+        try:
+            if os.path.getmtime(path) >= time.time() - ttl:
+                return False
+            stale = f'{path}.{uuid.uuid4().hex}.stale'
+            os.rename(path, stale)
+        except FileNotFoundError:
+            return False
+        if os.path.getmtime(stale) >= time.time() - ttl:
+            # 检查之后别的进程已经重新占用，把它的占用放回去
+            try:
+                os.link(stale, path)
+            except FileExistsError:
+                pass
+            os.remove(stale)
+            return False
+        os.remove(stale)
+        return True
+
+    def release_send(self, reading_id):
+        try:
+            os.remove(self._claim_path(reading_id))
+        except FileNotFoundError:
+            pass
+
+
+class SQLiteStore(ReadingStore):
+    """SQLite（WAL）存储：元数据列带索引，报告正文放在单独的 blob 表"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS readings (
+                    reading_id TEXT PRIMARY KEY,
+                    email TEXT NOT NULL,
+                    name TEXT,
+                    created_at TEXT NOT NULL,
+                    paid INTEGER NOT NULL DEFAULT 0,
+                    sent INTEGER NOT NULL DEFAULT 0,
+                    extra TEXT NOT NULL DEFAULT '{}'
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reading_blobs (
+                    reading_id TEXT PRIMARY KEY REFERENCES readings (reading_id),
+                    data TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS send_claims (
+                    reading_id TEXT PRIMARY KEY,
+                    claimed_at TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_readings_created ON readings (created_at, reading_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_readings_email ON readings (email)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_readings_sent ON readings (sent, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_readings_paid ON readings (paid, created_at)")
+            ensure_change_seq(conn, 'readings')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _split(reading):
+        """拆分为 (列, extra, blobs)"""
+        columns = {k: reading[k] for k in COLUMN_FIELDS if k in reading}
+        blobs = {k: reading[k] for k in BLOB_FIELDS if k in reading}
+        extra = {k: v for k, v in reading.items() if k not in COLUMN_FIELDS and k not in BLOB_FIELDS}
+        return columns, extra, blobs
+
+    @staticmethod
+    def _row_to_reading(row, blob=None):
+        reading = json.loads(row['extra'])
+        reading.update({
+            'reading_id': row['reading_id'],
+            'email': row['email'],
+            'name': row['name'],
+            'created_at': row['created_at'],
+            'paid': bool(row['paid']),
+            'sent': bool(row['sent'])
+        })
+        if blob:
+            reading.update(json.loads(blob))
+        return reading
+
+    def _insert(self, conn, reading):
+        columns, extra, blobs = self._split(reading)
+        conn.execute(
+            "INSERT OR IGNORE INTO readings (reading_id, email, name, created_at, paid, sent, extra, change_seq) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                columns['reading_id'],
+                columns.get('email', ''),
+                columns.get('name'),
+                columns.get('created_at', datetime.now().isoformat()),
+                int(bool(columns.get('paid', False))),
+                int(bool(columns.get('sent', False))),
+                json.dumps(extra, ensure_ascii=False),
+                next_change_seq(conn)
+            )
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO reading_blobs (reading_id, data) VALUES (?, ?)",
+            (columns['reading_id'], json.dumps(blobs, ensure_ascii=False))
+        )
+
+    def save(self, reading_data):
+        self._stamp(reading_data)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            self._insert(conn, reading_data)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return reading_data['reading_id']
+
+    def get(self, reading_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM readings WHERE reading_id = ?", (reading_id,)).fetchone()
+            if not row:
+                return None
+            blob = conn.execute("SELECT data FROM reading_blobs WHERE reading_id = ?", (reading_id,)).fetchone()
+        finally:
+            conn.close()
+        return self._row_to_reading(row, blob['data'] if blob else None)
+
+    def update(self, reading_id, updates):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT * FROM readings WHERE reading_id = ?", (reading_id,)).fetchone()
+            if not row:
+                conn.execute("ROLLBACK")
+                return False
+
+            columns, extra, blobs = self._split(updates)
+            columns.pop('reading_id', None)
+            if extra:
+                merged = json.loads(row['extra'])
+                merged.update(extra)
+                columns['extra'] = json.dumps(merged, ensure_ascii=False)
+            for flag in ('paid', 'sent'):
+                if flag in columns:
+                    columns[flag] = int(bool(columns[flag]))
+            columns['change_seq'] = next_change_seq(conn)
+            if columns:
+                assignments = ', '.join(f'{k} = ?' for k in columns)
+                conn.execute(
+                    f"UPDATE readings SET {assignments} WHERE reading_id = ?",
+                    list(columns.values()) + [reading_id]
+                )
+            if blobs:
+                blob = conn.execute("SELECT data FROM reading_blobs WHERE reading_id = ?", (reading_id,)).fetchone()
+                merged = json.loads(blob['data']) if blob else {}
+                merged.update(blobs)
+                conn.execute(
+                    "INSERT OR REPLACE INTO reading_blobs (reading_id, data) VALUES (?, ?)",
+                    (reading_id, json.dumps(merged, ensure_ascii=False))
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return True
+
+    def iter_all(self):
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "SELECT r.*, b.data AS blob FROM readings r LEFT JOIN reading_blobs b USING (reading_id)"
+            )
+            for row in cursor:
+                yield self._row_to_reading(row, row['blob'])
+        finally:
+            conn.close()
+
+    def all(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT r.*, b.data AS blob FROM readings r LEFT JOIN reading_blobs b USING (reading_id) "
+                "ORDER BY r.created_at DESC"
+            ).fetchall()
+        finally:
+            conn.close()
+        return [self._row_to_reading(row, row['blob']) for row in rows]
+
+    def import_reading(self, reading):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            self._insert(conn, reading)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def import_readings(self, readings, batch_size=1000):
+        count = 0
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            for reading in readings:
+                self._insert(conn, reading)
+                count += 1
+                if count % batch_size == 0:
+                    conn.execute("COMMIT")
+                    conn.execute("BEGIN")
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return count
+
+    def delete(self, reading_ids):
+        params = [(rid,) for rid in reading_ids]
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            conn.executemany("DELETE FROM reading_blobs WHERE reading_id = ?", params)
+            conn.executemany("DELETE FROM send_claims WHERE reading_id = ?", params)
+            count = conn.executemany("DELETE FROM readings WHERE reading_id = ?", params).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return count
+
+    def list_meta(self, filters=None, cursor=None, limit=50):
+        conn = self._connect()
+        try:
+            return query_meta(conn, 'readings', filters, cursor, limit)
+        finally:
+            conn.close()
+
+    def count_meta(self):
+        conn = self._connect()
+        try:
+            return count_meta(conn, 'readings')
+        finally:
+            conn.close()
+
+    def list_changes(self, since=0, until=None, filters=None, limit=500):
+        conn = self._connect()
+        try:
+            return query_changes(conn, 'readings', since, until, filters, limit)
+        finally:
+            conn.close()
+
+    def change_seq(self):
+        conn = self._connect()
+        try:
+            return current_change_seq(conn)
+        finally:
+            conn.close()
+
+    def claim_send(self, reading_id, ttl=600):
+        now = datetime.now()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # 租约过期的占用视为崩溃后遗留，先回收
+            conn.execute(
+                "DELETE FROM send_claims WHERE reading_id = ? AND claimed_at < ?",
+                (reading_id, (now - timedelta(seconds=ttl)).isoformat())
+            )
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO send_claims (reading_id, claimed_at) VALUES (?, ?)",
+                (reading_id, now.isoformat())
+            )
+            conn.execute("COMMIT")
+            return cursor.rowcount == 1
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def release_send(self, reading_id):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM send_claims WHERE reading_id = ?", (reading_id,))
+        finally:
+            conn.close()
+
+
+def create_store(backend=None, readings_dir='readings', db_path=None):
+    """根据配置创建存储后端（json / sqlite）"""
+    backend = (backend or os.getenv('STORAGE_BACKEND', 'json')).lower()
+    data_dir = os.getenv('DATA_DIR', 'data')
+    if backend == 'sqlite':
+        return SQLiteStore(db_path or os.getenv('SQLITE_PATH', os.path.join(data_dir, 'readings.db')))
+    if backend == 'json':
+        return JsonFileStore(readings_dir, index_path=os.path.join(data_dir, 'reading_index.db'))
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def migrate_json_to_sqlite(readings_dir, db_path):
+    """一次性迁移：把 readings/ 下的 JSON 文件导入 SQLite（已存在的 reading_id 会跳过）"""
+    source = JsonFileStore(readings_dir)
+    target = SQLiteStore(db_path)
+    count = 0
+    conn = target._connect()
+    try:
+        conn.execute("BEGIN")
+        for reading in source.iter_all():
+            if 'reading_id' not in reading:
+                continue
+            target._insert(conn, reading)
+            count += 1
+            if count % 1000 == 0:
+                conn.execute("COMMIT")
+                conn.execute("BEGIN")
+                print(f"[MIGRATE] {count} readings imported...")
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return count
+
+
+if __name__ == '__main__':
+    # 用法: python storage.py migrate [readings_dir] [data/readings.db]
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print("Usage: python storage.py migrate [readings_dir] [sqlite_path]")
+        sys.exit(1)
+    readings_dir = sys.argv[2] if len(sys.argv) > 2 else 'readings'
+    db_path = sys.argv[3] if len(sys.argv) > 3 else os.getenv('SQLITE_PATH', os.path.join(os.getenv('DATA_DIR', 'data'), 'readings.db'))
+    total = migrate_json_to_sqlite(readings_dir, db_path)
+    print(f"Migrated {total} readings into {db_path}")
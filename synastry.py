@@ -0,0 +1,266 @@
+"""
+合盘匹配：把所有订单星盘的 8 个点（太阳/月亮/金星/火星/水星/木星/上升/七宫）按列存成 NumPy 数组，
+一次向量化计算一张星盘与全部 N 张星盘的相位得分，返回最匹配的 top-k
+
+磁盘上是追加写的定长记录文件（reading_id + 8 个黄经，0.1° 精度），保存订单时追加一条；
+每个进程按文件偏移增量读入新记录，多个 gunicorn worker 看到的是同一份数据
+
+    python synastry.py rebuild        # 从存储全量重建
+"""
+import os
+import argparse
+import threading
+
+import numpy as np
+
+# 与 astro_calculator 的星座缩写一致
+SIGNS = ['Ari', 'Tau', 'Gem', 'Can', 'Leo', 'Vir', 'Lib', 'Sco', 'Sag', 'Cap', 'Aqu', 'Pis']
+SIGN_INDEX = {sign: i for i, sign in enumerate(SIGNS)}
+POINTS = ['sun', 'moon', 'venus', 'mars', 'mercury', 'jupiter', 'rising', 'house7']
+
+# (相位, 角度, 容许度, 权重)：和谐相位加分，刑克减分，对分兼有吸引与张力
+ASPECTS = [
+    ('conjunction', 0, 8.0, 1.0),
+    ('opposition', 180, 8.0, 0.5),
+    ('trine', 120, 8.0, 0.8),
+    ('square', 90, 6.0, -0.6)
+]
+
+# 合盘中更重要的点对（双向），其余点对权重 1，水星/木星整体减半
+PAIR_WEIGHTS = {
+    ('sun', 'moon'): 2.0,
+    ('venus', 'mars'): 2.0,
+    ('moon', 'moon'): 1.5,
+    ('venus', 'venus'): 1.5,
+    ('sun', 'rising'): 1.5,
+    ('moon', 'rising'): 1.5,
+    ('venus', 'house7'): 1.5,
+    ('mars', 'house7'): 1.5
+}
+MINOR_POINTS = {'mercury', 'jupiter'}
+
+# 黄经以 0.1° 为单位存成 uint16
+SCALE = 10
+CIRCLE = 360 * SCALE
+RECORD = np.dtype([('id', 'S36'), ('lon', '<u2', (len(POINTS),))])
+CHUNK_ROWS = 262144
+
+
+def chart_longitudes(chart):
+    """chart_data -> 8 个点的黄经（0.1° 整数）；缺少任一点时返回 None"""
+    try:
+        values = [
+            (SIGN_INDEX[chart[point]['sign']] * 30 + float(chart[point]['degree'])) * SCALE
+            for point in POINTS
+        ]
+    except (KeyError, TypeError, ValueError):
+        return None
+    return np.array([int(round(v)) % CIRCLE for v in values], dtype=np.uint16)
+
+
+def aspect_table():
+    """黄经差（0.1°，0..2*CIRCLE-1，覆盖 a - b + CIRCLE 的全部取值）-> 单个点对的相位得分"""
+    diff = np.arange(2 * CIRCLE) % CIRCLE / SCALE
+    separation = np.minimum(diff, 360 - diff)
+    table = np.zeros(2 * CIRCLE, dtype=np.float32)
+    for _, angle, orb, weight in ASPECTS:
+        table += weight * np.clip(1 - np.abs(separation - angle) / orb, 0, None).astype(np.float32)
+    return table
+
+
+def pair_weights():
+    """weights[i, j]：查询星盘的点 i 与候选星盘的点 j 的权重"""
+    weights = np.ones((len(POINTS), len(POINTS)), dtype=np.float32)
+    for (a, b), weight in PAIR_WEIGHTS.items():
+        i, j = POINTS.index(a), POINTS.index(b)
+        weights[i, j] = weights[j, i] = weight
+    for point in MINOR_POINTS:
+        weights[POINTS.index(point), :] *= 0.5
+        weights[:, POINTS.index(point)] *= 0.5
+    return weights
+
+
+def query_tables(query, table, weights):
+    """
+    把查询星盘的 8 个点折叠进每列一张查找表：
+    tables[j, x] = sum_i weights[i, j] * table[x - query[i] + CIRCLE]，x 为候选星盘第 j 个点的黄经
+    这样每行只需 8 次查表，而不是 64 个点对各算一次
+    """
+    x = np.arange(CIRCLE)
+    tables = np.zeros((len(POINTS), CIRCLE), dtype=np.float32)
+    for i in range(len(POINTS)):
+        tables += weights[i][:, None] * table[x + CIRCLE - int(query[i])][None, :]
+    return tables
+
+
+def score_block(columns, tables):
+    """columns: (8, n) uint16 列存黄经 -> (n,) float32，64 个点对的加权相位得分之和"""
+    scores = tables[0].take(columns[0])
+    for j in range(1, len(POINTS)):
+        scores += tables[j].take(columns[j])
+    return scores
+
+
+class SynastryIndex:
+    """
+    合盘索引：内存中是 (8, capacity) 的列存数组，按需扩容；
+    add() 追加一条磁盘记录，refresh() 读入其他进程追加的记录（文件被 rebuild 替换时全量重载）
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.table = aspect_table()
+        self.weights = pair_weights()
+        self._columns = np.zeros((len(POINTS), 1024), dtype=np.uint16)
+        self._ids = np.zeros(1024, dtype='S36')
+        self._size = 0
+        self._offset = 0
+        self._inode = None
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+    def __len__(self):
+        self.refresh()
+        return self._size
+
+    def add(self, reading_id, chart):
+        """保存订单时调用；星盘不完整时跳过并返回 False"""
+        longitudes = chart_longitudes(chart)
+        if longitudes is None:
+            return False
+        record = np.zeros(1, dtype=RECORD)
+        record['id'] = reading_id.encode('ascii')
+        record['lon'] = longitudes
+        # 单条记录一次 O_APPEND 写入，并发追加不会交错
+        with open(self.path, 'ab') as f:
+            f.write(record.tobytes())
+        return True
+
+    def add_many(self, items):
+        """批量追加 (reading_id, chart)，返回写入条数"""
+        records = []
+        for reading_id, chart in items:
+            longitudes = chart_longitudes(chart)
+            if longitudes is not None:
+                records.append((reading_id.encode('ascii'), longitudes))
+        if records:
+            with open(self.path, 'ab') as f:
+                f.write(np.array(records, dtype=RECORD).tobytes())
+        return len(records)
+
+    def rebuild(self, readings):
+        """全量重建（写临时文件后原子替换），返回写入条数；重建期间追加到旧文件的记录会丢失，宜在低峰期运行"""
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        count = 0
+        batch = []
+        with open(tmp_path, 'wb') as f:
+            for reading in readings:
+                longitudes = chart_longitudes(reading.get('chart'))
+                if longitudes is None or not reading.get('reading_id'):
+                    continue
+                batch.append((reading['reading_id'].encode('ascii'), longitudes))
+                if len(batch) >= 10000:
+                    f.write(np.array(batch, dtype=RECORD).tobytes())
+                    count += len(batch)
+                    batch = []
+            if batch:
+                f.write(np.array(batch, dtype=RECORD).tobytes())
+                count += len(batch)
+        os.replace(tmp_path, self.path)
+        self.refresh()
+        return count
+
+    def refresh(self):
+        """读入文件末尾的新记录（只读完整的记录）"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if stat.st_ino != self._inode:
+                # 首次加载或文件被 rebuild 替换：换新数组，进行中的 match() 不受影响
+                self._inode = stat.st_ino
+                self._offset = 0
+                self._size = 0
+                self._columns = np.zeros((len(POINTS), 1024), dtype=np.uint16)
+                self._ids = np.zeros(1024, dtype='S36')
+            available = (stat.st_size - self._offset) // RECORD.itemsize
+            if available <= 0:
+                return
+            records = np.fromfile(self.path, dtype=RECORD, count=available, offset=self._offset)
+            self._append(records)
+            self._offset += len(records) * RECORD.itemsize
+
+    def _append(self, records):
+        needed = self._size + len(records)
+        if needed > self._ids.shape[0]:
+            capacity = max(needed, self._ids.shape[0] * 2)
+            columns = np.zeros((len(POINTS), capacity), dtype=np.uint16)
+            columns[:, :self._size] = self._columns[:, :self._size]
+            ids = np.zeros(capacity, dtype='S36')
+            ids[:self._size] = self._ids[:self._size]
+            # 新数组整体替换，进行中的 match() 仍持有旧数组
+            self._columns, self._ids = columns, ids
+        self._columns[:, self._size:needed] = records['lon'].T
+        self._ids[self._size:needed] = records['id']
+        self._size = needed
+
+    def match(self, chart, k=10, exclude=None):
+        """
+        返回与 chart 最匹配的 k 个订单 [{'reading_id', 'score'}]（得分降序）
+        exclude: 排除的 reading_id（通常是查询者自己）
+        """
+        query = chart_longitudes(chart)
+        if query is None:
+            raise ValueError('Chart is missing synastry points')
+        self.refresh()
+        with self._lock:
+            columns, ids, size = self._columns, self._ids, self._size
+        if not size:
+            return []
+
+        tables = query_tables(query, self.table, self.weights)
+        scores = np.empty(size, dtype=np.float32)
+        for start in range(0, size, CHUNK_ROWS):
+            end = min(size, start + CHUNK_ROWS)
+            scores[start:end] = score_block(columns[:, start:end], tables)
+        if exclude:
+            scores[ids[:size] == exclude.encode('ascii')] = -np.inf
+
+        # 重建与追加并发时同一订单可能出现两次，多取一些再去重
+        take = min(size, k * 2)
+        top = np.argpartition(-scores, take - 1)[:take]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        matches, seen = [], set()
+        for row in top:
+            reading_id = ids[row].decode('ascii')
+            if reading_id in seen or not np.isfinite(scores[row]):
+                continue
+            seen.add(reading_id)
+            matches.append({'reading_id': reading_id, 'score': round(float(scores[row]), 3)})
+            if len(matches) == k:
+                break
+        return matches
+
+
+if __name__ == '__main__':
+    # 用法: python synastry.py rebuild [--readings readings] [--index data/synastry.idx]
+    parser = argparse.ArgumentParser(description='Synastry index maintenance')
+    parser.add_argument('command', choices=['rebuild', 'stats'])
+    parser.add_argument('--index', default=os.path.join(os.getenv('DATA_DIR', 'data'), 'synastry.idx'))
+    parser.add_argument('--readings', default='readings')
+    args = parser.parse_args()
+
+    index = SynastryIndex(args.index)
+    if args.command == 'stats':
+        print(f"{len(index)} charts in {args.index}")
+    else:
+        from dotenv import load_dotenv
+        from storage import create_store
+
+        load_dotenv()
+        total = index.rebuild(create_store(readings_dir=args.readings).iter_all())
+        print(f"Indexed {total} charts into {args.index}")